@@ -0,0 +1,435 @@
+"""Adaptive concurrency limits and load shedding at the gateway edge.
+
+Each vendor route (the /vendor-*/messages endpoints, /v1/messages and
+/v1/batch) has its own limit on requests in flight, adapted by AIMD on
+latency. Requests are timed to their response headers in windows of
+ADMISSION_WINDOW_SAMPLES (or one second). A window whose median is more than
+ADMISSION_LATENCY_TOLERANCE times the route's baseline (the lowest window
+median seen, drifting slowly towards recent ones) cuts the limit by
+ADMISSION_BACKOFF; a window that used most of the limit without slowing
+down raises it by one. It is the median, not the tail, so vendor-a's
+occasional simulated multi-second stalls don't read as overload.
+
+A request over the limit waits in its route's bounded queue for at most
+ADMISSION_QUEUE_TIMEOUT_MS, or its X-Request-Timeout-Ms if shorter. When the
+queue is full or the wait runs out it is answered at once with a 503,
+``retryAfterMs`` and a Retry-After header, rather than holding on for a
+slot the client has given up on by then. Past capacity the gateway keeps
+serving its limit at normal latency and turns the rest away cheaply, so
+goodput stays flat instead of collapsing.
+
+Priority classes:
+
+- every other route (health, metrics, logs, sessions, static pages) is
+  never limited, queued or shed
+- ``interactive``: the vendor routes, admitted first from a queue
+- ``batch``: /v1/batch, and any request sent with ``X-Priority: low``; it
+  only gets ADMISSION_BATCH_SHARE of a route's limit, and is the first to
+  be pushed out of a full queue
+
+ADMISSION_TOTAL_LIMIT caps the requests holding a thread on limited routes,
+running or queued, across all of them. Under gunicorn's threaded workers
+gunicorn.conf.py sets it to one less than the threads, so every worker
+keeps a thread free for health checks and metrics. A queued request holds
+its thread while it waits, so the threads are sized from the route limits
+(``worker_threads``): with fewer, the gate would turn requests away before
+the adaptive limit or the queue ever came into play.
+
+All limits are per worker.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+
+import metrics
+
+INTERACTIVE = 0
+BATCH = 1
+
+# Limited routes and their default priority; everything else is never shed
+ROUTES = {
+    '/vendor-a/messages': INTERACTIVE,
+    '/vendor-b/messages': INTERACTIVE,
+    '/vendor-e/messages': INTERACTIVE,
+    '/vendor-o/messages': INTERACTIVE,
+    '/v1/messages': INTERACTIVE,
+    '/v1/batch': BATCH,
+}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_sequence = itertools.count()
+
+
+def _env_float(name, default):
+    return float(os.getenv(name, default))
+
+
+def enabled():
+    return os.getenv('ADMISSION_ENABLED', '1') != '0'
+
+
+def priority_for(route, header=None):
+    """The route's priority class, or None if it is never limited.
+
+    ``X-Priority: low`` (or ``batch``) can only lower a request's class.
+    """
+    priority = ROUTES.get(route)
+    if priority is not None and header and header.strip().lower() in ('low', 'batch'):
+        return BATCH
+    return priority
+
+
+def initial_limit():
+    min_limit = max(_env_float('ADMISSION_MIN_LIMIT', '4'), 1)
+    max_limit = max(_env_float('ADMISSION_MAX_LIMIT', '1000'), min_limit)
+    return min(max(_env_float('ADMISSION_INITIAL_LIMIT', '32'), min_limit), max_limit)
+
+
+def queue_size():
+    return int(os.getenv('ADMISSION_QUEUE_SIZE', '64'))
+
+
+def worker_threads():
+    """Threads a worker needs to run a route's initial limit with its queue full, plus one for other routes"""
+    return math.floor(initial_limit()) + queue_size() + 1
+
+
+def queue_timeout(header=None):
+    """Seconds a request may wait for a slot, capped by its X-Request-Timeout-Ms"""
+    timeout = _env_float('ADMISSION_QUEUE_TIMEOUT_MS', '200') / 1000
+    try:
+        if header is not None and float(header) > 0:
+            timeout = min(timeout, float(header) / 1000)
+    except ValueError:
+        pass
+    return timeout
+
+
+class ThreadGate:
+    """Counts requests holding a thread on any limited route (ADMISSION_TOTAL_LIMIT)"""
+
+    def __init__(self):
+        self.occupied = 0
+        self.peak = 0
+        self.shed = 0
+        self._lock = threading.Lock()
+
+    def capacity(self):
+        value = os.getenv('ADMISSION_TOTAL_LIMIT')
+        return int(value) if value else None
+
+    def enter(self):
+        capacity = self.capacity()
+        with self._lock:
+            if capacity is not None and self.occupied >= capacity:
+                self.shed += 1
+                return False
+            self.occupied += 1
+            self.peak = max(self.peak, self.occupied)
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.occupied -= 1
+
+    def snapshot(self):
+        with self._lock:
+            return {'occupied': self.occupied, 'peak': self.peak, 'shed': self.shed, 'capacity': self.capacity()}
+
+
+gate = ThreadGate()
+
+
+class _Waiter:
+    """A queued request; ``wake`` is called (under the limiter's lock) once it is decided"""
+
+    __slots__ = ('priority', 'seq', 'enqueued', 'outcome', 'wake')
+
+    def __init__(self, priority, wake):
+        self.priority = priority
+        self.seq = next(_sequence)
+        self.enqueued = time.monotonic()
+        self.outcome = None
+        self.wake = wake
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Ticket:
+    """An admitted request's slot: ``observe`` its latency once, ``release`` it once"""
+
+    __slots__ = ('limiter', 'gated', '_observed', '_released')
+
+    def __init__(self, limiter, gated=False):
+        self.limiter = limiter
+        self.gated = gated
+        self._observed = False
+        self._released = False
+
+    def observe(self, seconds):
+        if not self._observed:
+            self._observed = True
+            self.limiter.observe(seconds)
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.limiter.release()
+            if self.gated:
+                gate.leave()
+
+
+class RouteLimiter:
+    """AIMD concurrency limit and bounded priority queue for one route"""
+
+    def __init__(self, route):
+        self.route = route
+        self.min_limit = max(_env_float('ADMISSION_MIN_LIMIT', '4'), 1)
+        self.max_limit = max(_env_float('ADMISSION_MAX_LIMIT', '1000'), self.min_limit)
+        self.limit = initial_limit()
+        self.queue_size = queue_size()
+        self.batch_share = _env_float('ADMISSION_BATCH_SHARE', '0.5')
+        self.window_samples = int(os.getenv('ADMISSION_WINDOW_SAMPLES', '50'))
+        self.tolerance = _env_float('ADMISSION_LATENCY_TOLERANCE', '2')
+        self.slack = _env_float('ADMISSION_LATENCY_SLACK_MS', '5') / 1000
+        self.backoff = _env_float('ADMISSION_BACKOFF', '0.9')
+        self.in_flight = 0
+        self.baseline = None
+        self.last_median = None
+        self._queue = []
+        self._window = []
+        self._window_started = time.monotonic()
+        self._window_peak = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            'admitted': 0, 'queued': 0, 'shed_queue_full': 0, 'shed_queue_timeout': 0,
+            'shed_evicted': 0, 'increases': 0, 'decreases': 0,
+        }
+
+    def _capacity(self, priority):
+        if priority == BATCH:
+            return max(math.floor(self.limit * self.batch_share), 1)
+        return math.floor(self.limit)
+
+    def _take(self):
+        self.in_flight += 1
+        self._window_peak = max(self._window_peak, self.in_flight)
+        self.stats['admitted'] += 1
+
+    def _dispatch(self):
+        """Admit queued requests, best priority first, while there is room"""
+        while self._queue and self.in_flight < self._capacity(self._queue[0].priority):
+            waiter = heapq.heappop(self._queue)
+            self._take()
+            waiter.outcome = 'admitted'
+            waiter.wake()
+
+    def _shed_waiter(self, waiter, reason):
+        waiter.outcome = reason
+        self.stats[f'shed_{reason}'] += 1
+
+    def try_admit(self, priority):
+        """Admit at once if there is room and nobody of the same or better priority is waiting"""
+        with self._lock:
+            if self.in_flight < self._capacity(priority) and not (self._queue and self._queue[0].priority <= priority):
+                self._take()
+                return True
+            return False
+
+    def enqueue(self, priority, wake):
+        """Queue a request; returns its _Waiter, or None if the queue is full.
+
+        A full queue makes room for a better-priority request by shedding the
+        newest waiter of the worst class.
+        """
+        with self._lock:
+            if len(self._queue) >= self.queue_size:
+                victim = max(self._queue, key=lambda w: (w.priority, w.seq), default=None)
+                if victim is None or victim.priority <= priority:
+                    self.stats['shed_queue_full'] += 1
+                    return None
+                self._queue.remove(victim)
+                heapq.heapify(self._queue)
+                self._shed_waiter(victim, 'evicted')
+                victim.wake()
+            waiter = _Waiter(priority, wake)
+            heapq.heappush(self._queue, waiter)
+            self.stats['queued'] += 1
+            # A slot may have opened between try_admit and here
+            self._dispatch()
+            return waiter
+
+    def settle(self, waiter):
+        """After the wait: the waiter's outcome, shedding it if still queued"""
+        with self._lock:
+            if waiter.outcome is None:
+                self._queue.remove(waiter)
+                heapq.heapify(self._queue)
+                self._shed_waiter(waiter, 'queue_timeout')
+            metrics.ADMISSION_WAIT_SECONDS.observe(time.monotonic() - waiter.enqueued, self.route)
+            return waiter.outcome
+
+    def abandon(self, waiter):
+        """The waiting request went away (client disconnect): drop it or give back its slot"""
+        with self._lock:
+            if waiter.outcome is None:
+                self._queue.remove(waiter)
+                heapq.heapify(self._queue)
+                waiter.outcome = 'abandoned'
+            elif waiter.outcome == 'admitted':
+                self.in_flight -= 1
+                self._dispatch()
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._dispatch()
+
+    def observe(self, seconds):
+        """Record a request's latency; closes the window and adapts the limit when due"""
+        with self._lock:
+            self._window.append(seconds)
+            now = time.monotonic()
+            if len(self._window) < self.window_samples and (now - self._window_started < 1 or len(self._window) < 5):
+                return
+            window = sorted(self._window)
+            median = window[len(window) // 2]
+            peak = self._window_peak
+            self._window = []
+            self._window_started = now
+            self._window_peak = self.in_flight
+            self.last_median = median
+            if self.baseline is None or median < self.baseline:
+                self.baseline = median
+            else:
+                # Let the baseline follow a route that has become slower for good
+                self.baseline += (median - self.baseline) * 0.01
+            if median > max(self.baseline * self.tolerance, self.baseline + self.slack):
+                self.limit = max(self.limit * self.backoff, self.min_limit)
+                self.stats['decreases'] += 1
+            elif peak >= self.limit * 0.8 and self.limit < self.max_limit:
+                self.limit = min(self.limit + 1, self.max_limit)
+                self.stats['increases'] += 1
+                self._dispatch()
+
+    def retry_after(self):
+        """Seconds until the queue ahead of a new request has likely drained"""
+        with self._lock:
+            latency = self.last_median or self.baseline or 1.0
+            return max(latency * (len(self._queue) + 1) / max(self.limit, 1), 1.0)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(
+                self.stats,
+                limit=round(self.limit, 2),
+                in_flight=self.in_flight,
+                queue_depth=len(self._queue),
+                queue_size=self.queue_size,
+                baseline_ms=round(self.baseline * 1000, 3) if self.baseline is not None else None,
+                last_median_ms=round(self.last_median * 1000, 3) if self.last_median is not None else None,
+            )
+
+
+def limiter(route):
+    found = _limiters.get(route)
+    if found is None:
+        with _limiters_lock:
+            found = _limiters.get(route)
+            if found is None:
+                found = _limiters[route] = RouteLimiter(route)
+    return found
+
+
+def shed_response(route, reason, wait_seconds):
+    """503 body for a request turned away; retryAfterMs as vendor-b sends it"""
+    metrics.SHED.inc(route, reason)
+    body = {'error': 'Over capacity', 'reason': reason, 'retryAfterMs': int(math.ceil(wait_seconds * 1000))}
+    return body, 503
+
+
+def acquire(route, priority, timeout):
+    """Take a slot on ``route``, waiting up to ``timeout`` seconds on this thread.
+
+    Returns ``(ticket, None)``, or ``(None, (body, 503))`` when shed.
+    """
+    found = limiter(route)
+    if not gate.enter():
+        return None, shed_response(route, 'busy', found.retry_after())
+    if found.try_admit(priority):
+        return Ticket(found, gated=True), None
+    event = threading.Event()
+    waiter = found.enqueue(priority, event.set)
+    if waiter is None:
+        gate.leave()
+        return None, shed_response(route, 'queue_full', found.retry_after())
+    event.wait(timeout)
+    outcome = found.settle(waiter)
+    if outcome == 'admitted':
+        return Ticket(found, gated=True), None
+    gate.leave()
+    return None, shed_response(route, outcome, found.retry_after())
+
+
+async def acquire_async(route, priority, timeout):
+    """acquire() for the event loop: waits as a coroutine, holding no thread"""
+    found = limiter(route)
+    if found.try_admit(priority):
+        return Ticket(found), None
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def wake():
+        loop.call_soon_threadsafe(_resolve, future)
+
+    waiter = found.enqueue(priority, wake)
+    if waiter is None:
+        return None, shed_response(route, 'queue_full', found.retry_after())
+    try:
+        await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        pass
+    except BaseException:
+        found.abandon(waiter)
+        raise
+    outcome = found.settle(waiter)
+    if outcome == 'admitted':
+        return Ticket(found), None
+    return None, shed_response(route, outcome, found.retry_after())
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def retry_after_header(body):
+    """Retry-After (whole seconds) for a shed body"""
+    return {'Retry-After': str(max(int(math.ceil(body['retryAfterMs'] / 1000)), 1))}
+
+
+def admission_stats():
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {
+        'enabled': enabled(),
+        'threads': gate.snapshot(),
+        'routes': {route: found.snapshot() for route, found in limiters.items()},
+    }
+
+
+def _after_fork():
+    # A worker's limits and queues start fresh
+    global _limiters_lock, gate
+    _limiters.clear()
+    _limiters_lock = threading.Lock()
+    gate = ThreadGate()
+
+
+os.register_at_fork(after_in_child=_after_fork)
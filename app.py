@@ -1,195 +1,309 @@
-import random
+import json
+import re
 import time
 import uuid
 import os
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_from_directory
+from flask.json.provider import DefaultJSONProvider
 from datetime import datetime
-import requests as http_requests
 from dotenv import load_dotenv
+import admission
+import batch
+import cache
+import faults
+import invoices
+import jsoncodec
+import metrics
+import payloads
+import ratelimit
+import requestlog
+import router
+import rules
+import sessions
+import singleflight
+import startup
+import streaming
+import tokenizer
+import tools
+import upstream
 
 # Load environment variables from .env file
 load_dotenv()
 
+class GatewayJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider on the jsoncodec backend, timing each response it serializes.
+
+    Debug mode keeps Flask's indented output; otherwise responses are built
+    straight from the encoder's bytes.
+    """
+
+    def dumps_bytes(self, obj):
+        start = time.perf_counter()
+        payload = jsoncodec.dumps_bytes(obj, default=self.default)
+        metrics.SERIALIZE_SECONDS.observe(time.perf_counter() - start)
+        return payload
+
+    def dumps(self, obj, **kwargs):
+        if kwargs.get('indent'):
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return jsoncodec.loads(s)
+
+    def response(self, *args, **kwargs):
+        if self._app.debug:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj) + b'\n', mimetype=self.mimetype)
+
 app = Flask(__name__, static_folder='static')
+app.json = GatewayJSONProvider(app)
+metrics.start_flusher()
+
+def route_label():
+    """The matched URL rule, so metrics get one series per route, not per path"""
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+def request_client():
+    """The API client behind this request, for rate limits and session scopes (router.client_key)"""
+    return router.client_key(
+        request.headers.get('X-Client-Id'),
+        request.headers.get('Authorization'),
+        router.client_address(request.remote_addr, request.headers.get)
+    )
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    sessions.set_caller(request_client())
+    # Refuse an oversized body before reading it or queueing for a slot (see payloads.py)
+    limit = payloads.max_bytes(route_label())
+    if request.content_length is not None and request.content_length > limit:
+        return too_large(limit)
+    # A chunked body is read no further than one byte past the cap
+    request.max_content_length = limit + 1
+    shed = admit_request()
+    if shed is not None:
+        return shed
+    if request.is_json:
+        # Parse here so the handler's get_json() hits Flask's cache
+        start = time.perf_counter()
+        data = request.get_json(silent=True)
+        if len(request.get_data()) > limit:
+            return too_large(limit)
+        metrics.PARSE_SECONDS.observe(time.perf_counter() - start, route_label())
+        invalid = payloads.check(data)
+        if invalid is not None:
+            body, status = invalid
+            return jsonify(body), status
+
+def too_large(limit):
+    """The 413 for a body over ``limit``; the unread body is left out of the request log"""
+    g.body_refused = True
+    body, status = payloads.too_large(limit)
+    return jsonify(body), status, payloads.CLOSE_HEADERS
+
+def admit_request():
+    """Take a concurrency slot on a limited route (see admission.py); returns the 503 if shed"""
+    if not admission.enabled():
+        return None
+    route = route_label()
+    priority = admission.priority_for(route, request.headers.get('X-Priority'))
+    if priority is None:
+        return None
+    timeout = admission.queue_timeout(request.headers.get('X-Request-Timeout-Ms'))
+    ticket, shed = admission.acquire(route, priority, timeout)
+    if shed is not None:
+        # Shed before the body is read; it stays unread and out of the request log
+        g.body_refused = True
+        body, status = shed
+        return jsonify(body), status, admission.retry_after_header(body)
+    g.admission = ticket
+    g.admitted_at = time.perf_counter()
+    return None
+
+@app.after_request
+def record_request(response):
+    ticket = g.get('admission')
+    if ticket is not None:
+        # Service time, queue wait excluded; the slot is held until the body is sent
+        ticket.observe(time.perf_counter() - g.admitted_at)
+        response.call_on_close(ticket.release)
+    start = g.get('request_start')
+    if start is not None:
+        route = route_label()
+        elapsed = time.perf_counter() - start
+        metrics.REQUEST_SECONDS.observe(elapsed, route, request.method)
+        metrics.REQUESTS.inc(route, request.method, str(response.status_code))
+        startup.first_request_served()
+        if request.method == 'POST' and request.url_rule:
+            requestlog.record(
+                request.method, request.path, response.status_code, elapsed,
+                None if g.get('body_refused') else request.get_data(),
+                None if response.is_streamed else response.get_data(),
+                client=request.headers.get('X-Client-Id') or request.remote_addr,
+                stream=response.is_streamed
+            )
+    return response
 
-# Simple token counter for canned responses
+# Concurrent identical upstream calls share one request
+vendor_o_flight = singleflight.SingleFlight('vendor-o')
+
+def json_bytes(body):
+    """Serialize a body exactly like jsonify (non-debug) does"""
+    return app.json.dumps_bytes(body) + b'\n'
+
+def event_stream(events):
+    """Send an iterable of SSE byte strings as a text/event-stream response"""
+    return Response(events, mimetype='text/event-stream', headers=streaming.SSE_HEADERS)
+
+# Token counter for canned responses
 def count_tokens(text):
-    """Simple word-based token approximation"""
-    return len(text.split())
+    """Count tokens with the configured tokenizer (see tokenizer.py)"""
+    return tokenizer.count_tokens(text)
 
 def generate_canned_response(prompt, system_prompt=None):
-    """Generate a canned response based on prompt keywords"""
-    prompt_lower = prompt.lower()
-    
-    # Simple keyword-based responses
-    if any(word in prompt_lower for word in ['hello', 'hi', 'hey']):
-        return "Hello! How can I assist you today?"
-    elif any(word in prompt_lower for word in ['weather', 'temperature']):
-        return "I can help with weather information. Please specify a location."
-    elif any(word in prompt_lower for word in ['meaning of life', 'life']):
-        return "The meaning of life is a philosophical question that has been pondered throughout history."
-    elif any(word in prompt_lower for word in ['help', 'assist']):
-        return "I'm here to help! Please let me know what you need assistance with."
-    elif any(word in prompt_lower for word in ['thank', 'thanks']):
-        return "You're welcome! Feel free to ask if you need anything else."
-    else:
-        return "I understand your message. This is a simulated response for testing purposes."
+    """Generate a canned response based on prompt keywords (rules in data/rules.json)"""
+    return rules.get_rules().respond(rules.lower(prompt))
 
 def extract_invoice_id(prompt):
     """Extract invoice ID from prompt (looks for patterns like INV-123, invoice 123, #123)"""
-    import re
-    # Look for patterns like INV-123, invoice 123, #123, invoice #123
-    patterns = [
-        r'INV-\d+',
-        r'invoice[\s#]+\d+',
-        r'#\d+'
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, prompt, re.IGNORECASE)
-        if match:
-            # Extract just the number part
-            number_match = re.search(r'\d+', match.group())
-            if number_match:
-                return f"INV-{number_match.group()}"
-    return None
+    return rules.get_rules().find_invoice(rules.lower(prompt))
 
-def get_invoice_data(invoice_id):
-    """Return dummy invoice data"""
-    import json
-    # Parse invoice number from ID
-    invoice_num = invoice_id.split('-')[1] if '-' in invoice_id else invoice_id
-    
-    # Generate deterministic dummy data based on invoice number
-    seed = int(invoice_num) if invoice_num.isdigit() else 12345
-    
-    dummy_invoices = [
-        {
-            "invoice_id": invoice_id,
-            "customer_name": "Acme Corporation",
-            "amount": 1250.00 + (seed % 1000),
-            "currency": "USD",
-            "status": "paid",
-            "issue_date": "2025-12-01",
-            "due_date": "2025-12-31",
-            "items": [
-                {"description": "Consulting Services", "quantity": 10, "unit_price": 100.00},
-                {"description": "Software License", "quantity": 1, "unit_price": 250.00}
-            ]
-        },
-        {
-            "invoice_id": invoice_id,
-            "customer_name": "Tech Solutions Inc",
-            "amount": 3500.00 + (seed % 500),
-            "currency": "USD",
-            "status": "pending",
-            "issue_date": "2025-12-15",
-            "due_date": "2026-01-15",
-            "items": [
-                {"description": "Development Work", "quantity": 40, "unit_price": 85.00}
-            ]
+INVOICE_TOOL_SCHEMA = {
+    "description": "Get invoice details by invoice ID",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "invoice_id": {
+                "type": "string",
+                "description": "The invoice ID, e.g. INV-12345"
+            }
         },
-        {
-            "invoice_id": invoice_id,
-            "customer_name": "Global Enterprises",
-            "amount": 5200.00 + (seed % 2000),
-            "currency": "USD",
-            "status": "overdue",
-            "issue_date": "2025-11-01",
-            "due_date": "2025-12-01",
-            "items": [
-                {"description": "Project Management", "quantity": 20, "unit_price": 150.00},
-                {"description": "Infrastructure Setup", "quantity": 1, "unit_price": 2200.00}
-            ]
-        }
-    ]
-    
-    # Select invoice based on seed
-    invoice = dummy_invoices[seed % len(dummy_invoices)]
-    return json.dumps(invoice)
+        "required": ["invoice_id"]
+    }
+}
+
+def invoice_id_argument(arguments):
+    """The get_invoice tool's invoice ID, normalized once for both the cache key and the lookup"""
+    return str(arguments.get("invoice_id", "")).strip().upper()
+
+@tools.register_tool(
+    "get_invoice",
+    INVOICE_TOOL_SCHEMA,
+    cache_ttl=float(os.getenv('INVOICE_CACHE_TTL', '3600')),
+    cache_key=invoice_id_argument
+)
+def get_invoice(arguments):
+    return invoices.get_store().get_json(invoice_id_argument(arguments))
+
+# Simulated vendor failures (see faults.py)
+def injected_fault(vendor, cancel):
+    """Roll a router backend's simulated failures.
+
+    Waits out any injected delay (cut short if ``cancel`` is set) and returns
+    the injected error, router.CANCELLED, or None.
+    """
+    error, delay = faults.roll(vendor)
+    if delay and cancel.wait(delay):
+        return router.CANCELLED
+    return error
+
+def request_faults(vendor):
+    """Roll faults for a direct vendor request, honouring its X-Fault* headers"""
+    error, delay = faults.roll(vendor, faults.request_overrides(request.headers.get))
+    if delay:
+        # A WSGI request owns its thread anyway; ASGI mode waits without one
+        time.sleep(delay)
+    return error
 
 # Vendor A endpoints
-@app.route('/vendor-a/messages', methods=['POST'])
-def vendor_a_send_message():
-    start_time = time.time()
-    
-    # 10% chance of failure
-    if random.random() < 0.1:
-        return jsonify({
-            'error': 'Internal server error'
-        }), 500
-    
-    # 10% chance of slow response (2-5 seconds delay)
-    if random.random() < 0.1:
-        time.sleep(random.uniform(2, 5))
-    
-    data = request.get_json()
+def vendor_a_response(data, start_time):
+    """Build vendor-a's (body, status) for a parsed request"""
     prompt = data.get('prompt', data.get('message', 'Hello'))
-    system_prompt = data.get('system_prompt')
-    tools = data.get('tools')  # Optional tools parameter
+    request_tools = data.get('tools')  # Optional tools parameter
     
-    # Check if tools are provided and prompt mentions an invoice
-    if tools:
-        invoice_id = extract_invoice_id(prompt)
-        if invoice_id:
-            # Simulate tool call response
-            tool_call_id = f"call_{uuid.uuid4().hex[:8]}"
-            invoice_data = get_invoice_data(invoice_id)
+    prompt_lower = rules.lower(prompt)
+    
+    # Check if tools are provided and prompt mentions invoices
+    if request_tools:
+        invoice_ids = rules.get_rules().find_invoices(prompt_lower)
+        if invoice_ids:
+            # Simulate one tool call per invoice, all looked up together
+            found = invoices.get_store().get_many(invoice_ids)
             
             # Generate natural language response incorporating invoice data
-            import json
-            invoice_info = json.loads(invoice_data)
-            output_text = f"I found invoice {invoice_id} for {invoice_info['customer_name']}. The total amount is ${invoice_info['amount']:.2f} {invoice_info['currency']} and the status is '{invoice_info['status']}'. It was issued on {invoice_info['issue_date']} with a due date of {invoice_info['due_date']}."
+            sentences = []
+            for invoice_id, entry in zip(invoice_ids, found):
+                if entry is None:
+                    sentences.append(f"I couldn't find invoice {invoice_id}.")
+                    continue
+                invoice_info = entry[0]
+                sentences.append(f"I found invoice {invoice_id} for {invoice_info['customer_name']}. The total amount is ${invoice_info['amount']:.2f} {invoice_info['currency']} and the status is '{invoice_info['status']}'. It was issued on {invoice_info['issue_date']} with a due date of {invoice_info['due_date']}.")
+            output_text = ' '.join(sentences)
             
-            tokens_in = count_tokens(prompt)
-            tokens_out = count_tokens(output_text)
+            tokens_in, tokens_out = tokenizer.count_batch([prompt, output_text])
+            metrics.record_tokens('vendor-a', tokens_in, tokens_out)
             latency_ms = int((time.time() - start_time) * 1000)
             
-            return jsonify({
+            body = {
                 'outputText': output_text,
                 'tokensIn': tokens_in,
                 'tokensOut': tokens_out,
                 'latencyMS': latency_ms,
                 'tool_calls': [{
-                    'id': tool_call_id,
+                    'id': f"call_{uuid.uuid4().hex[:8]}",
                     'type': 'function',
                     'function': {
                         'name': 'get_invoice',
                         'arguments': json.dumps({'invoice_id': invoice_id})
                     }
-                }],
-                'invoice_data': invoice_info
-            }), 200
+                } for invoice_id in invoice_ids]
+            }
+            # invoice_data is the first invoice found; invoices lists them all when there are several
+            invoice_infos = [entry[0] for entry in found if entry is not None]
+            if invoice_infos:
+                body['invoice_data'] = invoice_infos[0]
+            if len(invoice_ids) > 1:
+                body['invoices'] = invoice_infos
+            return body, 200
     
     # Generate canned response
-    output_text = generate_canned_response(prompt, system_prompt)
+    output_text = rules.get_rules().respond(prompt_lower)
     
     # Calculate tokens
-    tokens_in = count_tokens(prompt)
-    tokens_out = count_tokens(output_text)
+    tokens_in, tokens_out = tokenizer.count_batch([prompt, output_text])
+    metrics.record_tokens('vendor-a', tokens_in, tokens_out)
     
     # Calculate latency
     latency_ms = int((time.time() - start_time) * 1000)
     
-    return jsonify({
+    return {
         'outputText': output_text,
         'tokensIn': tokens_in,
         'tokensOut': tokens_out,
         'latencyMS': latency_ms
-    }), 200
+    }, 200
 
-# Vendor B endpoints
-@app.route('/vendor-b/messages', methods=['POST'])
-def vendor_b_send_message():
-    # 10% chance of rate limit
-    if random.random() < 0.1:
-        retry_after_ms = random.randint(5000, 10000)
-        return jsonify({
-            'retryAfterMs': retry_after_ms,
-            'error': 'Rate limit exceeded'
-        }), 429
+@app.route('/vendor-a/messages', methods=['POST'])
+def vendor_a_send_message():
+    start_time = time.time()
+    
+    error = request_faults('vendor-a')
+    if error:
+        return jsonify(error[0]), error[1]
     
     data = request.get_json()
+    body, status = vendor_a_response(data, start_time)
+    if streaming.wants_stream(data):
+        events = streaming.vendor_a_events(body, start_time)
+        return event_stream(streaming.paced(events, streaming.token_delay(data)))
+    return jsonify(body), status
+
+# Vendor B endpoints
+def vendor_b_response(data):
+    """Build vendor-b's (body, status) for a parsed request"""
     prompt = data.get('prompt', data.get('message', 'Hello'))
     system_prompt = data.get('system_prompt')
     
@@ -197,10 +311,10 @@ def vendor_b_send_message():
     output_text = generate_canned_response(prompt, system_prompt)
     
     # Calculate tokens
-    input_tokens = count_tokens(prompt)
-    output_tokens = count_tokens(output_text)
+    input_tokens, output_tokens = tokenizer.count_batch([prompt, output_text])
+    metrics.record_tokens('vendor-b', input_tokens, output_tokens)
     
-    return jsonify({
+    return {
         'choices': [{
             'message': {
                 'content': output_text
@@ -210,189 +324,598 @@ def vendor_b_send_message():
             'input_tokens': input_tokens,
             'output_tokens': output_tokens
         }
-    }), 200
+    }, 200
 
-# Vendor E endpoints
-@app.route('/vendor-e/messages', methods=['POST'])
-def vendor_e_send_message():
+@app.route('/vendor-b/messages', methods=['POST'])
+def vendor_b_send_message():
+    error = request_faults('vendor-b')
+    if error:
+        return jsonify(error[0]), error[1]
+    
     data = request.get_json()
+    body, status = vendor_b_response(data)
+    if streaming.wants_stream(data):
+        events = streaming.vendor_b_events(body)
+        return event_stream(streaming.paced(events, streaming.token_delay(data)))
+    return jsonify(body), status
+
+# Vendor E endpoints
+def vendor_e_response(data):
+    """Build vendor-e's (body, status) for a parsed request"""
     prompt = data.get('prompt', data.get('message', 'Hello'))
     
     # Simply echo back with prefix
     echo_response = f"You entered {prompt}"
     
-    return jsonify({
+    return {
         'response': echo_response
-    }), 200
+    }, 200
 
-def execute_function_call(function_name, arguments_str):
-    """Execute a function call and return the result"""
-    import json
+@app.route('/vendor-e/messages', methods=['POST'])
+def vendor_e_send_message():
+    error = request_faults('vendor-e')
+    if error:
+        return jsonify(error[0]), error[1]
     
-    # Parse arguments
+    body, status = vendor_e_response(request.get_json())
+    return jsonify(body), status
+
+# Router backends: each vendor's request path without the HTTP layer,
+# so /v1/messages can fail over between them and cancel losing attempts
+def normalize_vendor_a(data, body):
+    return body['outputText'], {'input_tokens': body['tokensIn'], 'output_tokens': body['tokensOut']}
+
+def normalize_vendor_b(data, body):
+    return body['choices'][0]['message']['content'], body['usage']
+
+def normalize_vendor_e(data, body):
+    prompt = data.get('prompt', data.get('message', 'Hello'))
+    input_tokens, output_tokens = tokenizer.count_batch([prompt, body['response']])
+    metrics.record_tokens('vendor-e', input_tokens, output_tokens)
+    return body['response'], {'input_tokens': input_tokens, 'output_tokens': output_tokens}
+
+def normalize_vendor_o(data, body):
+    usage = body.get('usage') or {}
+    return body['choices'][0]['message'].get('content'), {
+        'input_tokens': usage.get('prompt_tokens', 0),
+        'output_tokens': usage.get('completion_tokens', 0)
+    }
+
+@router.register_vendor('vendor-a', normalize_vendor_a)
+def route_vendor_a(data, cancel):
+    start_time = time.time()
+    return injected_fault('vendor-a', cancel) or vendor_a_response(data, start_time)
+
+@router.register_vendor('vendor-b', normalize_vendor_b)
+def route_vendor_b(data, cancel):
+    return injected_fault('vendor-b', cancel) or vendor_b_response(data)
+
+@router.register_vendor('vendor-e', normalize_vendor_e)
+def route_vendor_e(data, cancel):
+    return injected_fault('vendor-e', cancel) or vendor_e_response(data)
+
+@router.register_vendor('vendor-o', normalize_vendor_o)
+def route_vendor_o(data, cancel):
+    try:
+        sessions.session_id(data)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    api_key = get_openai_api_key()
+    if not api_key:
+        return OPENAI_KEY_MISSING, 500
+    return vendor_o_response(api_key, data)
+
+@app.route('/v1/messages', methods=['POST'])
+def route_message():
+    client = request_client()
+    body, status = router.route(
+        request.get_json(),
+        client=client,
+        timeout=request.headers.get('X-Request-Timeout-Ms')
+    )
+    return jsonify(body), status, ratelimit.retry_after_headers(body, status)
+
+# Many requests in one call, answered as NDJSON lines in completion order
+@app.route('/v1/batch', methods=['POST'])
+def batch_messages():
+    client = request_client()
     try:
-        arguments = json.loads(arguments_str)
-    except json.JSONDecodeError:
-        return json.dumps({"error": "Invalid JSON arguments"})
+        items, concurrency = batch.parse_request(request.get_json())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    # Real implementation for get_current_weather using wttr.in
-    if function_name == "get_current_weather":
-        location = arguments.get("location", "Unknown")
-        unit = arguments.get("unit", "fahrenheit")
+    lines = (json_bytes(line) for line in batch.run(items, concurrency, client=client))
+    return Response(lines, mimetype='application/x-ndjson', headers=streaming.SSE_HEADERS)
+
+# Tools executed by the gateway on the model's behalf
+WEATHER_TOOL_SCHEMA = {
+    "description": "Get the current weather in a given location",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "location": {
+                "type": "string",
+                "description": "The city and state, e.g. San Francisco, CA"
+            },
+            "unit": {
+                "type": "string",
+                "enum": ["celsius", "fahrenheit"],
+                "description": "The temperature unit to use"
+            }
+        },
+        "required": ["location"]
+    }
+}
+
+def weather_request_url(location):
+    return upstream.weather_url(f"/{location}?format=j1")
+
+def weather_arguments(arguments):
+    return arguments.get("location", "Unknown"), arguments.get("unit", "fahrenheit")
+
+def weather_cache_key(arguments):
+    location, unit = weather_arguments(arguments)
+    return (str(location).strip().lower(), unit)
+
+def format_weather_result(location, unit, status_code, weather_json):
+    """Turn a wttr.in response into the tool result sent back to the model"""
+    if status_code == 200:
+        current = weather_json['current_condition'][0]
         
-        try:
-            # Call wttr.in weather API (free, no API key required)
-            weather_response = http_requests.get(
-                f"https://wttr.in/{location}?format=j1",
-                timeout=10
-            )
-            
-            if weather_response.status_code == 200:
-                weather_json = weather_response.json()
-                current = weather_json['current_condition'][0]
-                
-                # Convert temperature based on unit preference
-                if unit == "celsius":
-                    temp = current['temp_C']
-                    temp_unit = "°C"
-                else:
-                    temp = current['temp_F']
-                    temp_unit = "°F"
-                
-                weather_data = {
-                    "location": location,
-                    "temperature": f"{temp}{temp_unit}",
-                    "condition": current['weatherDesc'][0]['value'],
-                    "humidity": f"{current['humidity']}%",
-                    "wind_speed": f"{current['windspeedMiles']} mph",
-                    "feels_like": f"{current['FeelsLikeF']}°F" if unit == "fahrenheit" else f"{current['FeelsLikeC']}°C"
-                }
-                return json.dumps(weather_data)
-            else:
-                return json.dumps({
-                    "error": f"Failed to fetch weather data for {location}",
-                    "status_code": weather_response.status_code
-                })
-        except Exception as e:
-            return json.dumps({
-                "error": f"Weather API error: {str(e)}",
-                "location": location
-            })
-    
-    # Default response for unknown functions
-    return json.dumps({"error": f"Function {function_name} not implemented"})
+        # Convert temperature based on unit preference
+        if unit == "celsius":
+            temp = current['temp_C']
+            temp_unit = "°C"
+        else:
+            temp = current['temp_F']
+            temp_unit = "°F"
+        
+        return {
+            "location": location,
+            "temperature": f"{temp}{temp_unit}",
+            "condition": current['weatherDesc'][0]['value'],
+            "humidity": f"{current['humidity']}%",
+            "wind_speed": f"{current['windspeedMiles']} mph",
+            "feels_like": f"{current['FeelsLikeF']}°F" if unit == "fahrenheit" else f"{current['FeelsLikeC']}°C"
+        }
+    else:
+        return {
+            "error": f"Failed to fetch weather data for {location}",
+            "status_code": status_code
+        }
+
+def weather_error_result(location, error):
+    return {
+        "error": f"Weather API error: {str(error)}",
+        "location": location
+    }
+
+@tools.register_tool(
+    "get_current_weather",
+    WEATHER_TOOL_SCHEMA,
+    timeout=14,
+    cache_ttl=float(os.getenv('WEATHER_CACHE_TTL', '300')),
+    cache_key=weather_cache_key
+)
+def get_current_weather(arguments):
+    """Real implementation using wttr.in (free, no API key required)"""
+    location, unit = weather_arguments(arguments)
+    try:
+        weather_response = upstream.get(weather_request_url(location), read_timeout=10)
+        weather_json = jsoncodec.loads(weather_response.content) if weather_response.status_code == 200 else None
+        return format_weather_result(location, unit, weather_response.status_code, weather_json)
+    except Exception as e:
+        return weather_error_result(location, e)
+
+def execute_function_call(function_name, arguments_str):
+    """Execute a function call and return the result"""
+    return tools.execute(function_name, arguments_str)
 
 # Vendor O endpoints (OpenAI passthrough)
-@app.route('/vendor-o/messages', methods=['POST'])
-def vendor_o_send_message():
-    data = request.get_json()
+OPENAI_KEY_MISSING = {
+    'error': 'OPENAI_API_KEY not configured',
+    'type': 'ConfigurationError'
+}
+
+def get_openai_api_key():
+    """Return the configured OpenAI key, or None if it is missing or still the placeholder"""
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key or api_key == 'sk-your-openai-api-key-here':
+        return None
+    return api_key
+
+def openai_headers(api_key):
+    return {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    }
+
+def build_openai_request(data):
+    """Build the (messages, payload) pair for the first chat/completions call"""
     prompt = data.get('prompt', data.get('message', 'Hello'))
     system_prompt = data.get('system_prompt', 'You are a helpful assistant')
     model = data.get('model', 'gpt-3.5-turbo')
     tools = data.get('tools')  # Optional tools parameter
     tool_choice = data.get('tool_choice')  # Optional tool_choice parameter
     
-    # Get API key
-    api_key = os.getenv('OPENAI_API_KEY')
-    if not api_key or api_key == 'sk-your-openai-api-key-here':
-        return jsonify({
-            'error': 'OPENAI_API_KEY not configured',
-            'type': 'ConfigurationError'
-        }), 500
-    
-    try:
-        # Build OpenAI request payload
+    # A session request carries only its new turn; the gateway adds the history
+    session_id = sessions.session_id(data)
+    if session_id:
+        messages = sessions.build_messages(session_id, data)
+    else:
         messages = [
             {'role': 'system', 'content': system_prompt},
             {'role': 'user', 'content': prompt}
         ]
-        
-        payload = {
-            'model': model,
-            'messages': messages
-        }
-        
-        # Add tools if provided
-        if tools:
-            payload['tools'] = tools
-        
-        # Add tool_choice if provided
-        if tool_choice:
-            payload['tool_choice'] = tool_choice
-        
-        # First API call to OpenAI
-        response = http_requests.post(
-            'https://api.openai.com/v1/chat/completions',
-            headers={
-                'Authorization': f'Bearer {api_key}',
-                'Content-Type': 'application/json'
-            },
-            json=payload,
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            return jsonify(response.json()), response.status_code
-        
-        response_data = response.json()
-        assistant_message = response_data['choices'][0]['message']
-        
-        # Check if the model wants to call a function
-        if assistant_message.get('tool_calls'):
-            # Add assistant's response to messages
-            messages.append(assistant_message)
-            
-            # Execute each tool call
-            for tool_call in assistant_message['tool_calls']:
-                function_name = tool_call['function']['name']
-                function_args = tool_call['function']['arguments']
+    
+    payload = {
+        'model': model,
+        'messages': messages
+    }
+    
+    # Add tools if provided
+    if tools:
+        payload['tools'] = tools
+    
+    # Add tool_choice if provided
+    if tool_choice:
+        payload['tool_choice'] = tool_choice
+    
+    return messages, payload
+
+def tool_result_message(tool_call, content):
+    return {
+        'tool_call_id': tool_call['id'],
+        'role': 'tool',
+        'name': tool_call['function']['name'],
+        'content': content
+    }
+
+def upstream_error(response):
+    """(body, status) for a failed OpenAI call; a 429's Retry-After is copied into retryAfterMs"""
+    body = jsoncodec.loads(response.content)
+    if response.status_code == 429:
+        metrics.RATE_LIMITED.inc('vendor-o')
+    if response.status_code == 429 and isinstance(body, dict):
+        retry_after = ratelimit.parse_retry_after(response.headers.get('Retry-After'))
+        if retry_after is not None:
+            body = dict(body, retryAfterMs=int(retry_after * 1000))
+    return body, response.status_code
+
+def remember_reply(data, reply):
+    """Keep a finished exchange in the request's session, if it has one"""
+    session_id = sessions.session_id(data)
+    if session_id:
+        sessions.record(session_id, data, reply)
+
+def record_openai_usage(response_data):
+    usage = response_data.get('usage') or {}
+    metrics.record_tokens('vendor-o', usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0))
+
+# Usage counts in a raw chat/completions body; quotes inside strings are escaped, so only real keys match
+PROMPT_TOKENS_RE = re.compile(rb'"prompt_tokens"\s*:\s*(\d+)')
+COMPLETION_TOKENS_RE = re.compile(rb'"completion_tokens"\s*:\s*(\d+)')
+
+def record_openai_usage_bytes(payload):
+    """record_openai_usage for a body that is relayed without being decoded"""
+    # usage comes last in OpenAI's bodies, so skip the scan over the content
+    start = max(payload.rfind(b'"usage"'), 0)
+    counts = [pattern.search(payload, start) for pattern in (PROMPT_TOKENS_RE, COMPLETION_TOKENS_RE)]
+    metrics.record_tokens('vendor-o', *(int(match.group(1)) if match else 0 for match in counts))
+
+def passthrough_eligible(data):
+    """True if a vendor-o answer can be relayed as OpenAI's own bytes: no tool
+    loop to run and no session to record, so the gateway never needs its content"""
+    return (os.getenv('VENDOR_O_PASSTHROUGH', '1') != '0'
+            and not data.get('tools') and data.get('session_id') is None)
+
+def exception_response(error):
+    return {
+        'error': str(error),
+        'type': type(error).__name__
+    }, 500
+
+def follow_up_payload(payload, messages, rounds_done):
+    """Payload for the completion after ``rounds_done`` rounds of tool calls.
+
+    Tools stay available so the model can chain calls, up to MAX_TOOL_ROUNDS;
+    after that tool_choice is forced to "none" so the loop ends with an answer.
+    """
+    follow_up = {
+        'model': payload['model'],
+        'messages': messages
+    }
+    if payload.get('tools'):
+        follow_up['tools'] = payload['tools']
+        if rounds_done >= tools.max_tool_rounds():
+            follow_up['tool_choice'] = 'none'
+    return follow_up
+
+def run_tool_round(messages, assistant_message):
+    """Execute one assistant turn's tool calls concurrently and append the results in order"""
+    messages.append(assistant_message)
+    tool_calls = assistant_message['tool_calls']
+    results = tools.run_tool_calls(tool_calls, execute_function_call)
+    messages.extend(tool_result_message(call, result) for call, result in zip(tool_calls, results))
+
+def stream_vendor_o(api_key, messages, payload, data):
+    """Relay OpenAI's chat/completions stream to the client as it arrives.
+
+    Without tools or a session the upstream bytes are passed through
+    untouched. Otherwise events are relayed line by line: tool call deltas are
+    collected instead of relayed, and once a stream ends with tool calls they
+    run and the follow-up completion is streamed in its place. A session keeps
+    the final answer's text.
+    """
+    passthrough = not payload.get('tools') and not sessions.session_id(data)
+    response = upstream.post(
+        upstream.openai_url('/v1/chat/completions'),
+        headers=openai_headers(api_key),
+        data=jsoncodec.dumps_bytes(streaming.streaming_payload(payload)),
+        read_timeout=30,
+        stream=True
+    )
+    if response.status_code != 200:
+        with response:
+            body, status = upstream_error(response)
+            return jsonify(body), status
+    
+    def generate():
+        current = response
+        rounds_done = 0
+        try:
+            while True:
+                with current:
+                    if passthrough:
+                        tail = b''
+                        for chunk in current.iter_content(chunk_size=None):
+                            tail = (tail + chunk)[-streaming.USAGE_TAIL_BYTES:]
+                            yield chunk
+                        record_openai_usage_bytes(tail)
+                        return
+                    collector = streaming.ToolCallCollector()
+                    for line in current.iter_lines(chunk_size=None):
+                        for relayed in collector.feed(line):
+                            yield relayed + b'\n\n'
+                record_openai_usage({'usage': collector.usage})
                 
-                # Execute the function
-                function_response = execute_function_call(function_name, function_args)
+                if not collector.calls:
+                    remember_reply(data, collector.text())
+                    yield streaming.DONE
+                    return
                 
-                # Add function result to messages
-                messages.append({
-                    'tool_call_id': tool_call['id'],
-                    'role': 'tool',
-                    'name': function_name,
-                    'content': function_response
-                })
+                run_tool_round(messages, collector.assistant_message())
+                rounds_done += 1
+                follow_up = streaming.streaming_payload(follow_up_payload(payload, messages, rounds_done))
+                
+                current = upstream.post(
+                    upstream.openai_url('/v1/chat/completions'),
+                    headers=openai_headers(api_key),
+                    data=jsoncodec.dumps_bytes(follow_up),
+                    read_timeout=30,
+                    stream=True
+                )
+                if current.status_code != 200:
+                    with current:
+                        yield streaming.sse_event(jsoncodec.loads(current.content))
+                    return
+        except Exception as e:
+            yield streaming.sse_event(exception_response(e)[0])
+    
+    return event_stream(generate())
+
+def vendor_o_response(api_key, data):
+    """Run a vendor-o completion, including any rounds of tool calls, and return (body, status)"""
+    try:
+        # Build OpenAI request payload
+        messages, payload = build_openai_request(data)
+        request_payload = payload
+        rounds_done = 0
+        
+        while True:
+            response = upstream.post(
+                upstream.openai_url('/v1/chat/completions'),
+                headers=openai_headers(api_key),
+                data=jsoncodec.dumps_bytes(request_payload),
+                read_timeout=30
+            )
             
-            # Second API call with function results
-            second_payload = {
-                'model': model,
-                'messages': messages
-            }
+            if response.status_code != 200:
+                return upstream_error(response)
             
-            second_response = http_requests.post(
-                'https://api.openai.com/v1/chat/completions',
-                headers={
-                    'Authorization': f'Bearer {api_key}',
-                    'Content-Type': 'application/json'
-                },
-                json=second_payload,
-                timeout=30
-            )
+            response_data = jsoncodec.loads(response.content)
+            record_openai_usage(response_data)
+            assistant_message = response_data['choices'][0]['message']
             
-            if second_response.status_code == 200:
-                return jsonify(second_response.json()), 200
-            else:
-                return jsonify(second_response.json()), second_response.status_code
-        
-        # No tool calls, return first response
-        return jsonify(response_data), 200
+            # No tool calls: this is the final answer
+            if not assistant_message.get('tool_calls'):
+                remember_reply(data, assistant_message.get('content'))
+                return response_data, 200
+            
+            # Run the requested tools, then ask again with their results
+            run_tool_round(messages, assistant_message)
+            rounds_done += 1
+            request_payload = follow_up_payload(payload, messages, rounds_done)
             
     except Exception as e:
-        return jsonify({
-            'error': str(e),
-            'type': type(e).__name__
-        }), 500
+        return exception_response(e)
+
+def vendor_o_passthrough(api_key, data):
+    """Run a tool-free vendor-o completion and return OpenAI's body bytes untouched, with the status"""
+    try:
+        _, payload = build_openai_request(data)
+        response = upstream.post(
+            upstream.openai_url('/v1/chat/completions'),
+            headers=openai_headers(api_key),
+            data=jsoncodec.dumps_bytes(payload),
+            read_timeout=30
+        )
+        if response.status_code != 200:
+            body, status = upstream_error(response)
+            return json_bytes(body), status
+        record_openai_usage_bytes(response.content)
+        return response.content, 200
+    except Exception as e:
+        body, status = exception_response(e)
+        return json_bytes(body), status
+
+@app.route('/vendor-o/messages', methods=['POST'])
+def vendor_o_send_message():
+    data = request.get_json()
+    
+    # Get API key
+    api_key = get_openai_api_key()
+    if not api_key:
+        return jsonify(OPENAI_KEY_MISSING), 500
+    
+    try:
+        sessions.session_id(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if streaming.wants_stream(data):
+        try:
+            messages, payload = build_openai_request(data)
+            return stream_vendor_o(api_key, messages, payload, data)
+        except Exception as e:
+            body, status = exception_response(e)
+            return jsonify(body), status
+    
+    bypass = cache.bypass_requested(data, request.headers)
+    request_key = cache.response_cache_key(data)
+    
+    # Opt-in response cache: serve identical requests without calling OpenAI
+    response_cache = cache.get_response_cache()
+    cache_status = None
+    if response_cache:
+        if bypass:
+            response_cache.note_bypass()
+            cache_status = 'BYPASS'
+        else:
+            cached_body, tier = response_cache.get(request_key)
+            if cached_body is not None:
+                return Response(cached_body, mimetype='application/json',
+                                headers={'X-Cache': 'HIT', 'X-Cache-Tier': tier})
+            cache_status = 'MISS'
+    
+    def fetch():
+        if passthrough_eligible(data):
+            payload, status = vendor_o_passthrough(api_key, data)
+        else:
+            body, status = vendor_o_response(api_key, data)
+            payload = json_bytes(body)
+        if cache_status == 'MISS' and status == 200:
+            response_cache.set(request_key, payload)
+        return payload, status
+    
+    # Identical requests already in flight share one upstream call
+    payload, status = fetch() if bypass else vendor_o_flight.do(request_key, fetch)
+    response = Response(payload, status=status, mimetype='application/json')
+    if cache_status:
+        response.headers['X-Cache'] = cache_status
+    return response
 
 # Health check endpoint for fly.io
 @app.route('/health', methods=['GET'])
 def health():
     return jsonify({'status': 'healthy'}), 200
 
+# Prometheus metrics, summed across workers when METRICS_DIR is set
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.exposition(), mimetype=metrics.CONTENT_TYPE)
+
+# Upstream connection pool usage and coalescing counters for this worker
+@app.route('/metrics/upstream', methods=['GET'])
+def upstream_metrics():
+    return jsonify(dict(upstream.pool_stats(), singleflight=singleflight.stats())), 200
+
+# Response cache usage for this worker
+@app.route('/metrics/cache', methods=['GET'])
+def cache_metrics():
+    return jsonify(cache.cache_stats()), 200
+
+# Rolling per-vendor latency, error rates and failover/hedge counts for this worker
+@app.route('/metrics/router', methods=['GET'])
+def router_metrics():
+    return jsonify(router.router_stats()), 200
+
+# Vendor and client token buckets and the retry queue for this worker
+@app.route('/metrics/ratelimit', methods=['GET'])
+def ratelimit_metrics():
+    return jsonify(ratelimit.limiter_stats()), 200
+
+# Active tokenizer and its memo hit rates for this worker
+@app.route('/metrics/tokenizer', methods=['GET'])
+def tokenizer_metrics():
+    return jsonify(tokenizer.tokenizer_stats()), 200
+
+# Tool call and tool result cache counters for this worker
+@app.route('/metrics/tools', methods=['GET'])
+def tool_metrics():
+    return jsonify(tools.tool_stats()), 200
+
+# Invoice store backend and lookup counters for this worker
+@app.route('/metrics/invoices', methods=['GET'])
+def invoice_metrics():
+    return jsonify(invoices.invoice_stats()), 200
+
+# Concurrency limits, queues and shed counts per route for this worker
+@app.route('/metrics/admission', methods=['GET'])
+def admission_metrics():
+    return jsonify(admission.admission_stats()), 200
+
+# Cold-start phases and warm-up step timings for this worker
+@app.route('/metrics/startup', methods=['GET'])
+def startup_metrics():
+    return jsonify(startup.startup_stats()), 200
+
+# Recorded requests, newest first, filtered by time range, vendor and status
+@app.route('/logs/requests', methods=['GET'])
+def query_request_log():
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+        entries, cursor = requestlog.query(
+            start=requestlog.parse_time(request.args.get('start')),
+            end=requestlog.parse_time(request.args.get('end')),
+            vendor=request.args.get('vendor') or None,
+            status=request.args.get('status') or None,
+            limit=limit,
+            cursor=request.args.get('cursor') or None
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'entries': entries, 'next_cursor': cursor}), 200
+
+# Request log writer queue and files for this worker
+@app.route('/metrics/requestlog', methods=['GET'])
+def request_log_metrics():
+    return jsonify(requestlog.log_stats()), 200
+
+# Vendor-o conversation history kept for a session_id
+@app.route('/sessions/<session_id>', methods=['GET'])
+def get_session(session_id):
+    session = sessions.describe(session_id)
+    if session is None:
+        return jsonify({'error': 'Session not found'}), 404
+    return jsonify(session), 200
+
+@app.route('/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    if not sessions.delete(session_id):
+        return jsonify({'error': 'Session not found'}), 404
+    return jsonify({'deleted': session_id}), 200
+
+# Session store size and history budgets
+@app.route('/metrics/sessions', methods=['GET'])
+def session_metrics():
+    return jsonify(sessions.session_stats()), 200
+
+# Definitions of the tools the gateway can execute, ready for a request's "tools" field
+@app.route('/tools', methods=['GET'])
+def list_tools():
+    return jsonify({'tools': tools.definitions()}), 200
+
 # Serve frontend
 @app.route('/')
 def index():
@@ -402,5 +925,45 @@ def index():
 def request_viewer():
     return send_from_directory('static', 'request-viewer.html')
 
+# Warm-up (see startup.py and gunicorn.conf.py)
+def warm_up(per_process=True, async_client=False):
+    """Build what the first request would otherwise build on first use.
+
+    The fork-safe part (the URL map, parsed data files, the tokenizer) runs
+    once in a preloading gunicorn master and is shared by the workers;
+    ``per_process`` adds the caches and executors each worker owns. The HTTP
+    client stays lazy, since only vendor-o and the weather tool need it,
+    unless WARMUP_PRECONNECT asks for it up front: the threaded app also
+    opens a pooled OpenAI connection, the ASGI app (``async_client``) loads
+    httpx, whose clients belong to the event loop.
+    """
+    preconnect = os.getenv('WARMUP_PRECONNECT', '0') != '0'
+    if not per_process:
+        steps = [
+            ('routes', lambda: app.url_map.bind('localhost').match('/health')),
+            ('tokenizer', lambda: tokenizer.count_batch(['Warm up the merge table.'])),
+            ('rules', rules.get_rules),
+            ('faults', faults.get_profiles),
+            ('invoices', invoices.get_store),
+        ]
+        if preconnect:
+            steps.append(('upstream_client', lambda: upstream.preload(async_client)))
+        startup.warm_up(steps, phase='shared_warm')
+        return
+    if not startup.reached('shared_warm'):
+        warm_up(per_process=False, async_client=async_client)
+    steps = [
+        ('response_cache', cache.get_response_cache),
+        ('sessions', sessions.get_store),
+        ('tool_executor', tools.get_executor),
+        ('router_executor', router.get_executor),
+        ('batch_executor', batch.get_executor),
+    ]
+    if preconnect and not async_client:
+        steps.append(('preconnect', lambda: upstream.preconnect(upstream.openai_url('/v1/models'))))
+    startup.warm_up(steps)
+
+startup.mark('imported')
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8080)
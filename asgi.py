@@ -0,0 +1,527 @@
+"""ASGI serving mode.
+
+Serves the /vendor-*/messages routes on an asyncio event loop: simulated
+delays are ``asyncio.sleep`` and vendor-o's upstream calls go through
+``upstream``'s async client, so a slow request holds a coroutine instead of
+a gunicorn thread. Response bodies are built by the same helpers as the
+Flask handlers and serialized by Flask's JSON provider, so both modes return
+byte-identical JSON. Every other path (static pages, metrics) falls through
+to the Flask app.
+
+    uvicorn asgi:app --port 8080
+    gunicorn -k uvicorn_worker.UvicornWorker --workers 2 asgi:app
+"""
+import asyncio
+import time
+
+from uvicorn.middleware.wsgi import WSGIMiddleware
+
+import admission
+import app as gateway
+import batch
+import cache
+import faults
+import jsoncodec
+import metrics
+import payloads
+import ratelimit
+import requestlog
+import router
+import sessions
+import singleflight
+import startup
+import streaming
+import tools
+import upstream
+
+flask_app = gateway.app
+_flask_fallback = WSGIMiddleware(flask_app)
+
+vendor_o_flight = singleflight.AsyncSingleFlight('vendor-o.async')
+
+
+class EventStream:
+    """Handler result for a text/event-stream response"""
+    content_type = b'text/event-stream; charset=utf-8'
+
+    def __init__(self, events):
+        self.events = events
+
+
+class NDJSONStream(EventStream):
+    """Handler result for a streamed application/x-ndjson response"""
+    content_type = b'application/x-ndjson'
+
+
+class BadRequest(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+    def result(self):
+        return {'error': str(self)}, self.status
+
+
+class BodyTooLarge(BadRequest):
+    def __init__(self, limit):
+        super().__init__(413, 'Request body too large')
+        self.limit = limit
+
+    def result(self):
+        return (*payloads.too_large(self.limit), payloads.CLOSE_HEADERS)
+
+
+async def read_json(scope, receive):
+    """Read and parse the request body, mirroring request.get_json()"""
+    headers = dict(scope['headers'])
+    content_type = headers.get(b'content-type', b'').split(b';')[0].strip()
+    if content_type != b'application/json' and not content_type.endswith(b'+json'):
+        raise BadRequest(415, 'Content-Type must be application/json')
+
+    # Stop reading as soon as a chunked body runs past the cap (see payloads.py)
+    limit = payloads.max_bytes(scope['path'])
+    chunks = []
+    size = 0
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > limit:
+            raise BodyTooLarge(limit)
+        chunks.append(chunk)
+        more_body = message.get('more_body', False)
+    raw = scope['gateway.body'] = b''.join(chunks)
+    # Parse with one copy of the body alive, not the chunks as well
+    del chunks
+    start = time.perf_counter()
+    try:
+        data = jsoncodec.loads(raw)
+    except ValueError:
+        raise BadRequest(400, 'Failed to decode JSON object')
+    finally:
+        metrics.PARSE_SECONDS.observe(time.perf_counter() - start, scope['path'])
+    invalid = payloads.check(data)
+    if invalid is not None:
+        raise BadRequest(invalid[1], invalid[0]['error'])
+    return data
+
+
+def header(scope, name):
+    """Return a request header (lowercase bytes name) as str, or None"""
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def request_client(scope):
+    """app.request_client for an ASGI scope"""
+    return router.client_key(
+        header(scope, b'x-client-id'),
+        header(scope, b'authorization'),
+        router.client_address(scope['client'][0] if scope.get('client') else None,
+                              lambda name: header(scope, name.lower().encode()))
+    )
+
+
+async def send_json(send, body, status, headers=None):
+    """Send a JSON response; ``body`` may already be serialized bytes"""
+    payload = body if isinstance(body, bytes) else gateway.json_bytes(body)
+    raw_headers = [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(payload)).encode()),
+    ]
+    for name, value in (headers or {}).items():
+        raw_headers.append((name.lower().encode(), value.encode()))
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': raw_headers,
+    })
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def send_event_stream(send, stream):
+    headers = [(b'content-type', stream.content_type)]
+    headers += [(name.lower().encode(), value.encode()) for name, value in streaming.SSE_HEADERS.items()]
+    await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+    try:
+        async for event in stream.events:
+            await send({'type': 'http.response.body', 'body': event, 'more_body': True})
+    finally:
+        # Stop the producer now if the client went away mid-stream
+        await stream.events.aclose()
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def injected_fault(vendor, scope=None):
+    """Roll ``vendor``'s faults (with the request's X-Fault* headers, given a
+    scope), sleep out any injected delay without holding a thread, and return
+    the injected error or None"""
+    overrides = faults.request_overrides(lambda name: header(scope, name.lower().encode())) if scope else None
+    error, delay = faults.roll(vendor, overrides)
+    if delay:
+        await asyncio.sleep(delay)
+    return error
+
+
+# Vendor handlers: each takes (scope, receive) and returns (body, status[, headers])
+# or an EventStream
+async def vendor_a(scope, receive):
+    start_time = time.time()
+
+    error = await injected_fault('vendor-a', scope)
+    if error:
+        return error
+
+    data = await read_json(scope, receive)
+    body, status = gateway.vendor_a_response(data, start_time)
+    if streaming.wants_stream(data):
+        return EventStream(streaming.apaced(streaming.vendor_a_events(body, start_time), streaming.token_delay(data)))
+    return body, status
+
+
+async def vendor_b(scope, receive):
+    error = await injected_fault('vendor-b', scope)
+    if error:
+        return error
+
+    data = await read_json(scope, receive)
+    body, status = gateway.vendor_b_response(data)
+    if streaming.wants_stream(data):
+        return EventStream(streaming.apaced(streaming.vendor_b_events(body), streaming.token_delay(data)))
+    return body, status
+
+
+async def vendor_e(scope, receive):
+    error = await injected_fault('vendor-e', scope)
+    if error:
+        return error
+    return gateway.vendor_e_response(await read_json(scope, receive))
+
+
+@tools.async_handler('get_current_weather')
+async def get_current_weather(arguments):
+    """Async counterpart of app.get_current_weather"""
+    location, unit = gateway.weather_arguments(arguments)
+    try:
+        weather_response = await upstream.async_get(gateway.weather_request_url(location), read_timeout=10)
+        weather_json = jsoncodec.loads(weather_response.content) if weather_response.status_code == 200 else None
+        return gateway.format_weather_result(location, unit, weather_response.status_code, weather_json)
+    except Exception as e:
+        return gateway.weather_error_result(location, e)
+
+
+async def run_tool_round(messages, assistant_message):
+    """Async counterpart of app.run_tool_round"""
+    messages.append(assistant_message)
+    tool_calls = assistant_message['tool_calls']
+    results = await tools.run_tool_calls_async(tool_calls)
+    messages.extend(gateway.tool_result_message(call, result) for call, result in zip(tool_calls, results))
+
+
+async def stream_vendor_o(api_key, messages, payload, data):
+    """Async counterpart of app.stream_vendor_o"""
+    response = await upstream.async_post(
+        upstream.openai_url('/v1/chat/completions'),
+        headers=gateway.openai_headers(api_key),
+        content=jsoncodec.dumps_bytes(streaming.streaming_payload(payload)),
+        read_timeout=30,
+        stream=True
+    )
+    if response.status_code != 200:
+        await response.aread()
+        await response.aclose()
+        return gateway.upstream_error(response)
+    passthrough = not payload.get('tools') and not sessions.session_id(data)
+
+    async def generate():
+        current = response
+        rounds_done = 0
+        try:
+            while True:
+                collector = streaming.ToolCallCollector()
+                try:
+                    if passthrough:
+                        tail = b''
+                        async for chunk in current.aiter_raw():
+                            tail = (tail + chunk)[-streaming.USAGE_TAIL_BYTES:]
+                            yield chunk
+                        gateway.record_openai_usage_bytes(tail)
+                        return
+                    async for line in current.aiter_lines():
+                        for relayed in collector.feed(line.encode()):
+                            yield relayed + b'\n\n'
+                finally:
+                    await current.aclose()
+                gateway.record_openai_usage({'usage': collector.usage})
+
+                if not collector.calls:
+                    gateway.remember_reply(data, collector.text())
+                    yield streaming.DONE
+                    return
+
+                await run_tool_round(messages, collector.assistant_message())
+                rounds_done += 1
+                follow_up = streaming.streaming_payload(gateway.follow_up_payload(payload, messages, rounds_done))
+
+                current = await upstream.async_post(
+                    upstream.openai_url('/v1/chat/completions'),
+                    headers=gateway.openai_headers(api_key),
+                    content=jsoncodec.dumps_bytes(follow_up),
+                    read_timeout=30,
+                    stream=True
+                )
+                if current.status_code != 200:
+                    await current.aread()
+                    await current.aclose()
+                    yield streaming.sse_event(jsoncodec.loads(current.content))
+                    return
+        except Exception as e:
+            yield streaming.sse_event(gateway.exception_response(e)[0])
+
+    return EventStream(generate())
+
+
+async def vendor_o_response(api_key, data):
+    """Async counterpart of app.vendor_o_response"""
+    try:
+        messages, payload = gateway.build_openai_request(data)
+        request_payload = payload
+        rounds_done = 0
+
+        while True:
+            response = await upstream.async_post(
+                upstream.openai_url('/v1/chat/completions'),
+                headers=gateway.openai_headers(api_key),
+                content=jsoncodec.dumps_bytes(request_payload),
+                read_timeout=30
+            )
+            if response.status_code != 200:
+                return gateway.upstream_error(response)
+
+            response_data = jsoncodec.loads(response.content)
+            gateway.record_openai_usage(response_data)
+            assistant_message = response_data['choices'][0]['message']
+            if not assistant_message.get('tool_calls'):
+                gateway.remember_reply(data, assistant_message.get('content'))
+                return response_data, 200
+
+            await run_tool_round(messages, assistant_message)
+            rounds_done += 1
+            request_payload = gateway.follow_up_payload(payload, messages, rounds_done)
+
+    except Exception as e:
+        return gateway.exception_response(e)
+
+
+async def vendor_o_passthrough(api_key, data):
+    """Async counterpart of app.vendor_o_passthrough"""
+    try:
+        _, payload = gateway.build_openai_request(data)
+        response = await upstream.async_post(
+            upstream.openai_url('/v1/chat/completions'),
+            headers=gateway.openai_headers(api_key),
+            content=jsoncodec.dumps_bytes(payload),
+            read_timeout=30
+        )
+        if response.status_code != 200:
+            body, status = gateway.upstream_error(response)
+            return gateway.json_bytes(body), status
+        gateway.record_openai_usage_bytes(response.content)
+        return response.content, 200
+    except Exception as e:
+        body, status = gateway.exception_response(e)
+        return gateway.json_bytes(body), status
+
+
+async def vendor_o(scope, receive):
+    data = await read_json(scope, receive)
+
+    api_key = gateway.get_openai_api_key()
+    if not api_key:
+        return gateway.OPENAI_KEY_MISSING, 500
+
+    try:
+        sessions.session_id(data)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    if streaming.wants_stream(data):
+        try:
+            messages, payload = gateway.build_openai_request(data)
+            return await stream_vendor_o(api_key, messages, payload, data)
+        except Exception as e:
+            return gateway.exception_response(e)
+
+    bypass = cache.bypass_requested(data, {'Cache-Control': header(scope, b'cache-control')})
+    request_key = cache.response_cache_key(data)
+
+    response_cache = cache.get_response_cache()
+    cache_status = None
+    if response_cache:
+        if bypass:
+            response_cache.note_bypass()
+            cache_status = 'BYPASS'
+        else:
+            cached_body, tier = response_cache.get(request_key)
+            if cached_body is not None:
+                return cached_body, 200, {'X-Cache': 'HIT', 'X-Cache-Tier': tier}
+            cache_status = 'MISS'
+
+    async def fetch():
+        if gateway.passthrough_eligible(data):
+            payload, status = await vendor_o_passthrough(api_key, data)
+        else:
+            body, status = await vendor_o_response(api_key, data)
+            payload = gateway.json_bytes(body)
+        if cache_status == 'MISS' and status == 200:
+            response_cache.set(request_key, payload)
+        return payload, status
+
+    payload, status = await (fetch() if bypass else vendor_o_flight.do(request_key, fetch))
+    return payload, status, {'X-Cache': cache_status} if cache_status else None
+
+
+@router.async_backend('vendor-a')
+async def route_vendor_a(data):
+    start_time = time.time()
+    return await injected_fault('vendor-a') or gateway.vendor_a_response(data, start_time)
+
+
+@router.async_backend('vendor-b')
+async def route_vendor_b(data):
+    return await injected_fault('vendor-b') or gateway.vendor_b_response(data)
+
+
+@router.async_backend('vendor-e')
+async def route_vendor_e(data):
+    return await injected_fault('vendor-e') or gateway.vendor_e_response(data)
+
+
+@router.async_backend('vendor-o')
+async def route_vendor_o(data):
+    try:
+        sessions.session_id(data)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    api_key = gateway.get_openai_api_key()
+    if not api_key:
+        return gateway.OPENAI_KEY_MISSING, 500
+    return await vendor_o_response(api_key, data)
+
+
+async def route_message(scope, receive):
+    client = request_client(scope)
+    body, status = await router.aroute(
+        await read_json(scope, receive),
+        client=client,
+        timeout=header(scope, b'x-request-timeout-ms')
+    )
+    return body, status, ratelimit.retry_after_headers(body, status)
+
+
+async def batch_messages(scope, receive):
+    client = request_client(scope)
+    try:
+        items, concurrency = batch.parse_request(await read_json(scope, receive))
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    async def lines():
+        async for line in batch.arun(items, concurrency, client=client):
+            yield gateway.json_bytes(line)
+    return NDJSONStream(lines())
+
+
+async def health(scope, receive):
+    return {'status': 'healthy'}, 200
+
+
+ROUTES = {
+    ('POST', '/vendor-a/messages'): vendor_a,
+    ('POST', '/vendor-b/messages'): vendor_b,
+    ('POST', '/vendor-e/messages'): vendor_e,
+    ('POST', '/vendor-o/messages'): vendor_o,
+    ('POST', '/v1/messages'): route_message,
+    ('POST', '/v1/batch'): batch_messages,
+    ('GET', '/health'): health,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            gateway.warm_up(async_client=True)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await upstream.aclose_async_clients()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+
+    handler = ROUTES.get((scope.get('method'), scope['path'])) if scope['type'] == 'http' else None
+    if handler is None:
+        await _flask_fallback(scope, receive, send)
+        return
+
+    start = time.perf_counter()
+    sessions.set_caller(request_client(scope))
+    limit = payloads.max_bytes(scope['path'])
+    length = header(scope, b'content-length')
+    if length is not None and length.isdigit() and int(length) > limit:
+        # Refused before the body is read or a slot is taken
+        await respond(scope, send, BodyTooLarge(limit).result(), start)
+        return
+
+    ticket = shed = None
+    priority = admission.priority_for(scope['path'], header(scope, b'x-priority')) if admission.enabled() else None
+    if priority is not None:
+        timeout = admission.queue_timeout(header(scope, b'x-request-timeout-ms'))
+        ticket, shed = await admission.acquire_async(scope['path'], priority, timeout)
+    if shed is not None:
+        await respond(scope, send, (*shed, admission.retry_after_header(shed[0])), start)
+        return
+
+    admitted = time.perf_counter()
+    try:
+        try:
+            result = await handler(scope, receive)
+        except BadRequest as e:
+            result = e.result()
+        if ticket is not None:
+            # Service time, queue wait excluded, and for a stream until its headers
+            ticket.observe(time.perf_counter() - admitted)
+        await respond(scope, send, result, start)
+    finally:
+        if ticket is not None:
+            ticket.release()
+
+
+async def respond(scope, send, result, start):
+    """Record the request's metrics and log entry, then send its response"""
+    # Timed like Flask's after_request: a stream counts until its headers
+    stream = isinstance(result, EventStream)
+    status = 200 if stream else result[1]
+    elapsed = time.perf_counter() - start
+    metrics.REQUEST_SECONDS.observe(elapsed, scope['path'], scope['method'])
+    metrics.REQUESTS.inc(scope['path'], scope['method'], str(status))
+    startup.first_request_served()
+    if scope['method'] == 'POST':
+        requestlog.record(
+            scope['method'], scope['path'], status, elapsed,
+            scope.get('gateway.body'), None if stream else result[0],
+            client=header(scope, b'x-client-id') or (scope['client'][0] if scope.get('client') else None),
+            stream=stream
+        )
+    if isinstance(result, EventStream):
+        await send_event_stream(send, result)
+    else:
+        await send_json(send, *result)
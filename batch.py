@@ -0,0 +1,153 @@
+"""Batch requests: many messages in one HTTP call.
+
+``POST /v1/batch`` takes ``{"requests": [...]}``. An item with a ``vendor``
+field is sent to that vendor as if posted to its /vendor-*/messages endpoint
+(simulated failures and delays included); any other item is routed like a
+/v1/messages body. Items run concurrently, at most BATCH_CONCURRENCY at a
+time per batch (a batch may ask for fewer with ``concurrency``), and results
+stream back as NDJSON lines in the order they finish:
+
+    {"index": 3, "id": "q3", "status": 200, "body": {...}}
+
+A failed or slow item only holds up its own line. If the client goes away,
+items not yet started are dropped and running vendor calls are cancelled.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+
+import router
+
+# Item fields the batch consumes; everything else is the request body
+ITEM_FIELDS = ('id', 'vendor')
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def max_items():
+    return int(os.getenv('BATCH_MAX_ITEMS', '1000'))
+
+
+def max_concurrency():
+    return max(int(os.getenv('BATCH_CONCURRENCY', '8')), 1)
+
+
+def parse_request(data):
+    """Validate a batch body; returns (items, concurrency) or raises ValueError"""
+    if not isinstance(data, dict) or not isinstance(data.get('requests'), list):
+        raise ValueError('Body must be an object with a "requests" array')
+    items = data['requests']
+    if not items:
+        raise ValueError('"requests" must not be empty')
+    if len(items) > max_items():
+        raise ValueError(f'At most {max_items()} requests per batch')
+    limit = max_concurrency()
+    concurrency = data.get('concurrency', limit)
+    if not isinstance(concurrency, int) or isinstance(concurrency, bool) or concurrency < 1:
+        raise ValueError('"concurrency" must be a positive integer')
+    return items, min(concurrency, limit)
+
+
+def get_executor():
+    """Return this process's batch thread pool (rebuilt after a fork)"""
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                workers = max(int(os.getenv('BATCH_WORKERS', '32')), 1)
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch')
+                _executor_pid = pid
+    return _executor
+
+
+def _prepare(item):
+    """Split an item into (vendor or None, body), or return an error (body, status)"""
+    if not isinstance(item, dict):
+        return None, ({'error': 'Each request must be a JSON object'}, 400)
+    data = {key: value for key, value in item.items() if key not in ITEM_FIELDS}
+    name = item.get('vendor')
+    if name is None:
+        return None, data
+    vendor = router.get_vendor(name) if isinstance(name, str) else None
+    if vendor is None:
+        return None, ({'error': f'Unknown vendor {name!r}'}, 400)
+    return vendor, data
+
+
+def run_item(item, client, cancel):
+    vendor, data = _prepare(item)
+    if isinstance(data, tuple):
+        return data
+    if vendor is None:
+        return router.route(data, client=client)
+    return router.call_backend(vendor, data, cancel)
+
+
+async def arun_item(item, client, cancel):
+    vendor, data = _prepare(item)
+    if isinstance(data, tuple):
+        return data
+    if vendor is None:
+        return await router.aroute(data, client=client)
+    return await router.acall_backend(vendor, data, cancel)
+
+
+def result_line(index, item, body, status):
+    line = {'index': index, 'status': status, 'body': body}
+    if isinstance(item, dict) and 'id' in item:
+        line['id'] = item['id']
+    return line
+
+
+def run(items, concurrency, client=None):
+    """Run a batch on the pool, yielding result lines (dicts) as items finish"""
+    executor = get_executor()
+    queued = iter(enumerate(items))
+    running = {}
+    try:
+        while True:
+            for index, item in queued:
+                cancel = threading.Event()
+                running[executor.submit(contextvars.copy_context().run, run_item, item, client, cancel)] = (index, cancel)
+                if len(running) >= concurrency:
+                    break
+            if not running:
+                return
+            done, _ = wait_futures(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, _ = running.pop(future)
+                yield result_line(index, items[index], *future.result())
+    finally:
+        # The client went away: drop what has not started, cancel the rest
+        for future, (_, cancel) in running.items():
+            future.cancel()
+            cancel.set()
+
+
+async def arun(items, concurrency, client=None):
+    """Async counterpart of run() (ASGI mode)"""
+    queued = iter(enumerate(items))
+    running = {}
+    try:
+        while True:
+            for index, item in queued:
+                cancel = threading.Event()
+                running[asyncio.ensure_future(arun_item(item, client, cancel))] = (index, cancel)
+                if len(running) >= concurrency:
+                    break
+            if not running:
+                return
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index, _ = running.pop(task)
+                yield result_line(index, items[index], *task.result())
+    finally:
+        for task, (_, cancel) in running.items():
+            cancel.set()
+            task.cancel()
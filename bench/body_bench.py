@@ -0,0 +1,160 @@
+"""Peak worker memory per request for large prompts and tool payloads.
+
+Starts a fresh single-worker gunicorn per case and request size, resets the
+worker's peak RSS (``/proc/<pid>/clear_refs``), sends one large vendor-a
+request and waits for the request log to write it. It then reports how far
+the worker's peak RSS (VmHWM) rose above its RSS before the request, and the
+request's latency. Each case runs twice:
+
+- ``unchunked``: chunk sizes, the body cap and the log's body cap set out of
+  reach, so the prompt is lowercased, split and logged whole, as before
+- ``chunked``: the defaults (see payloads.py)
+
+Cases: a long prompt, a prompt with a large ``tools`` array (schemas
+padded to the given size), and a body over the 4 MB cap. Prints JSON.
+Linux only.
+
+    python -m bench.body_bench --sizes-mb 1,3
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    'unchunked': {
+        'TOKENIZER_CHUNK_CHARS': str(10 ** 12), 'RULES_CHUNK_CHARS': str(10 ** 12),
+        'BODY_MAX_BYTES': str(10 ** 12), 'REQUEST_LOG_MAX_BODY_BYTES': str(10 ** 12),
+    },
+    'chunked': {},
+}
+
+WORDS = ('the invoice for our order was paid late so please check the status of account '
+         'payment terms net thirty days def total(items): return sum(i.amount for i in items)').split()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def prose(chars, seed):
+    rng = random.Random(seed)
+    words = []
+    length = 0
+    while length < chars:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)
+
+
+def prompt_body(size):
+    return {'prompt': prose(size, 1) + ' Thanks for the weather report'}
+
+
+def tools_body(size):
+    # 64 tools; each schema's description pads the body out to ``size``
+    tools = [{
+        'type': 'function',
+        'function': {
+            'name': f'tool_{index}',
+            'description': prose(size // 64, index),
+            'parameters': {'type': 'object', 'properties': {'invoice_id': {'type': 'string'}}},
+        },
+    } for index in range(64)]
+    return {'prompt': 'What is the status of invoice INV-1042? ' + prose(4096, 0), 'tools': tools}
+
+
+def oversized_body(size):
+    return prompt_body(max(size, 5 * 1024 * 1024))
+
+
+CASES = {'prompt': prompt_body, 'tools': tools_body, 'oversized': oversized_body}
+
+
+def proc_status(pid, field):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+    raise KeyError(field)
+
+
+def worker_pid(master_pid, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with open(f'/proc/{master_pid}/task/{master_pid}/children') as f:
+            children = f.read().split()
+        if children:
+            return int(children[0])
+        time.sleep(0.05)
+    raise RuntimeError('gunicorn started no worker')
+
+
+def measure(mode, payload, log_dir):
+    port = free_port()
+    env = dict(os.environ, **MODES[mode], PORT=str(port), WEB_CONCURRENCY='1', GUNICORN_THREADS='1',
+               REQUEST_LOG_PATH=os.path.join(log_dir, f'{mode}.jsonl'), REQUEST_LOG_FLUSH_INTERVAL='0.1')
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:app'], cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        base_url = f'http://127.0.0.1:{port}'
+        session = requests.Session()
+        headers = {'Content-Type': 'application/json', 'X-Fault': 'none'}
+        for _ in range(300):
+            try:
+                # One small request so first-use work is not counted
+                session.post(f'{base_url}/vendor-a/messages', data=b'{"prompt": "Hello"}', headers=headers, timeout=5)
+                break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        time.sleep(0.5)
+        pid = worker_pid(proc.pid)
+        with open(f'/proc/{pid}/clear_refs', 'w') as f:
+            f.write('5')
+        before = proc_status(pid, 'VmRSS')
+        start = time.perf_counter()
+        response = session.post(f'{base_url}/vendor-a/messages', data=payload, headers=headers, timeout=120)
+        latency = time.perf_counter() - start
+        # Let the log writer build and write the entry
+        time.sleep(0.5)
+        return {
+            'status': response.status_code,
+            'peak_rss_growth_mb': round((proc_status(pid, 'VmHWM') - before) / 2 ** 20, 1),
+            'latency_ms': round(latency * 1000, 1),
+        }
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes-mb', default='1,3', help='Body sizes to send, in MB')
+    parser.add_argument('--cases', default=','.join(CASES))
+    parser.add_argument('--log-dir', default='/tmp')
+    args = parser.parse_args()
+
+    results = {}
+    for case in args.cases.split(','):
+        sizes = [5.0] if case == 'oversized' else [float(size) for size in args.sizes_mb.split(',')]
+        for size in sizes:
+            payload = json.dumps(CASES[case](int(size * 2 ** 20))).encode()
+            results[f'{case}_{size:g}mb'] = {'body_mb': round(len(payload) / 2 ** 20, 2)}
+            for mode in MODES:
+                results[f'{case}_{size:g}mb'][mode] = measure(mode, payload, args.log_dir)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
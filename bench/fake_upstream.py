@@ -0,0 +1,229 @@
+"""Local stand-in for api.openai.com and wttr.in.
+
+Serves just enough of ``/v1/chat/completions`` (plain, streamed and
+tool-calling) and ``/<location>?format=j1`` for the gateway to run against,
+over HTTP or HTTPS (self-signed), with a configurable latency and error
+profile.
+
+    python -m bench.fake_upstream --port 9443 --tls --latency-ms 20
+"""
+import argparse
+import json
+import os
+import random
+import re
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_self_signed_cert(directory):
+    """Create a localhost cert/key pair with openssl and return (cert, key) paths"""
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    subprocess.run([
+        'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+        '-keyout', key, '-out', cert, '-days', '1',
+        '-subj', '/CN=localhost',
+        '-addext', 'subjectAltName=DNS:localhost,IP:127.0.0.1',
+    ], check=True, capture_output=True)
+    return cert, key
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _simulate(self):
+        """Apply the server's latency/error profile; return True if the request failed"""
+        profile = self.server.profile
+        latency_ms = profile['latency_ms']
+        if profile['jitter_ms']:
+            latency_ms += random.uniform(0, profile['jitter_ms'])
+        if latency_ms:
+            time.sleep(latency_ms / 1000)
+        if random.random() < profile['error_rate']:
+            self._send_json(500, {'error': {'message': 'Injected upstream error', 'type': 'server_error'}})
+            return True
+        return False
+
+    def _send_chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+    def _send_stream(self, model, content, tool_calls):
+        """Send a chat.completion.chunk SSE stream using chunked transfer encoding"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        base = {'id': f'chatcmpl-{uuid.uuid4().hex[:12]}', 'object': 'chat.completion.chunk',
+                'created': int(time.time()), 'model': model}
+        deltas = [{'role': 'assistant', 'content': ''}]
+        if tool_calls:
+            for index, call in enumerate(tool_calls):
+                deltas.append({'tool_calls': [{'index': index, 'id': call['id'], 'type': 'function',
+                                               'function': {'name': call['function']['name'], 'arguments': ''}}]})
+                deltas.append({'tool_calls': [{'index': index, 'function': {'arguments': call['function']['arguments']}}]})
+        else:
+            deltas.extend({'content': token} for token in re.findall(r'\S+\s*', content))
+        for delta in deltas:
+            if self.server.profile['token_delay_ms']:
+                time.sleep(self.server.profile['token_delay_ms'] / 1000)
+            chunk = dict(base, choices=[{'index': 0, 'delta': delta, 'finish_reason': None}])
+            self._send_chunk(b'data: ' + json.dumps(chunk).encode() + b'\n\n')
+        finish = 'tool_calls' if tool_calls else 'stop'
+        self._send_chunk(b'data: ' + json.dumps(dict(base, choices=[{'index': 0, 'delta': {}, 'finish_reason': finish}])).encode() + b'\n\n')
+        usage = {'prompt_tokens': 10, 'completion_tokens': 10, 'total_tokens': 20}
+        self._send_chunk(b'data: ' + json.dumps(dict(base, choices=[], usage=usage)).encode() + b'\n\n')
+        self._send_chunk(b'data: [DONE]\n\n')
+        self._send_chunk(b'')
+
+    def _tool_calls(self, body):
+        """Ask for the weather once per city in "weather in Paris, Tokyo" style prompts"""
+        messages = body.get('messages', [])
+        tool_names = [tool.get('function', {}).get('name') for tool in body.get('tools') or []]
+        if 'get_current_weather' not in tool_names or not messages or messages[-1].get('role') != 'user':
+            return None
+        prompt = messages[-1].get('content') or ''
+        _, _, places = prompt.partition('weather in ')
+        cities = [city.strip(' ?.!') for city in places.split(',') if city.strip(' ?.!')] or ['London']
+        return [{
+            'id': f'call_{uuid.uuid4().hex[:8]}',
+            'type': 'function',
+            'function': {'name': 'get_current_weather', 'arguments': json.dumps({'location': city})},
+        } for city in cities]
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if self.path.rstrip('/') != '/v1/chat/completions':
+            self._send_json(404, {'error': {'message': 'Not found'}})
+            return
+        if self._simulate():
+            return
+        model = body.get('model', 'gpt-3.5-turbo')
+        last = body.get('messages', [{}])[-1]
+        if last.get('role') == 'tool':
+            content = 'Stand-in summary of ' + ', '.join(
+                message.get('content', '') for message in body['messages'] if message.get('role') == 'tool'
+            )
+        else:
+            content = f"Stand-in reply to: {last.get('content', '')}"
+        content = content[:self.server.profile['max_content_chars']]
+        tool_calls = self._tool_calls(body)
+        if body.get('stream'):
+            self._send_stream(model, content, tool_calls)
+            return
+        message = {'role': 'assistant', 'content': None if tool_calls else content}
+        if tool_calls:
+            message['tool_calls'] = tool_calls
+        self._send_json(200, {
+            'id': f'chatcmpl-{uuid.uuid4().hex[:12]}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': message,
+                'finish_reason': 'tool_calls' if tool_calls else 'stop',
+            }],
+            'usage': {'prompt_tokens': 10, 'completion_tokens': 10, 'total_tokens': 20},
+        })
+
+    def do_GET(self):
+        if self._simulate():
+            return
+        self._send_json(200, {
+            'current_condition': [{
+                'temp_C': '21', 'temp_F': '70',
+                'FeelsLikeC': '21', 'FeelsLikeF': '70',
+                'humidity': '40', 'windspeedMiles': '5',
+                'weatherDesc': [{'value': 'Sunny'}],
+            }]
+        })
+
+
+class FakeUpstreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, latency_ms=0, jitter_ms=0, error_rate=0.0, token_delay_ms=0,
+                 max_content_chars=200, certfile=None, keyfile=None):
+        super().__init__(address, FakeUpstreamHandler)
+        self.profile = {
+            'latency_ms': latency_ms,
+            'jitter_ms': jitter_ms,
+            'error_rate': error_rate,
+            'token_delay_ms': token_delay_ms,
+            'max_content_chars': max_content_chars,
+        }
+        self.scheme = 'http'
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.socket = context.wrap_socket(self.socket, server_side=True)
+            self.scheme = 'https'
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'{self.scheme}://localhost:{port}'
+
+
+def start_fake_upstream(port=0, tls=False, **profile):
+    """Start a stand-in server on a background thread.
+
+    Returns (server, cert_path); cert_path is None unless ``tls`` is set and
+    should be trusted by clients (e.g. via REQUESTS_CA_BUNDLE).
+    """
+    cert = key = None
+    if tls:
+        cert, key = make_self_signed_cert(tempfile.mkdtemp(prefix='fake-upstream-'))
+    server = FakeUpstreamServer(('127.0.0.1', port), certfile=cert, keyfile=key, **profile)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, cert
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=9443)
+    parser.add_argument('--tls', action='store_true')
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--token-delay-ms', type=float, default=0,
+                        help='delay between chunks of a streamed completion')
+    args = parser.parse_args()
+
+    server, cert = start_fake_upstream(
+        args.port, tls=args.tls, latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        token_delay_ms=args.token_delay_ms,
+    )
+    print(f'Fake upstream listening on {server.base_url}')
+    if cert:
+        print(f'Trust it with REQUESTS_CA_BUNDLE={cert}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
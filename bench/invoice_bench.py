@@ -0,0 +1,102 @@
+"""Microbenchmark invoice lookups for vendor-a's simulated tool calls.
+
+Compares the original path (build the three dummy invoices, ``json.dumps``
+the chosen one, then ``json.loads`` it back) with ``invoices`` store lookups,
+warm and cold, one invoice and a batch, for the built-in dummy invoices and
+for a generated SQLite dataset. Checks the store returns the same invoices
+and prints microseconds per lookup as JSON.
+
+    python -m bench.invoice_bench --dataset-size 1000000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import invoices  # noqa: E402
+
+
+def legacy_invoice(invoice_id):
+    invoice_num = invoice_id.split('-')[1] if '-' in invoice_id else invoice_id
+    seed = int(invoice_num) if invoice_num.isdigit() else 12345
+    dummy_invoices = [
+        {
+            "invoice_id": invoice_id, "customer_name": "Acme Corporation", "amount": 1250.00 + (seed % 1000),
+            "currency": "USD", "status": "paid", "issue_date": "2025-12-01", "due_date": "2025-12-31",
+            "items": [
+                {"description": "Consulting Services", "quantity": 10, "unit_price": 100.00},
+                {"description": "Software License", "quantity": 1, "unit_price": 250.00}
+            ]
+        },
+        {
+            "invoice_id": invoice_id, "customer_name": "Tech Solutions Inc", "amount": 3500.00 + (seed % 500),
+            "currency": "USD", "status": "pending", "issue_date": "2025-12-15", "due_date": "2026-01-15",
+            "items": [
+                {"description": "Development Work", "quantity": 40, "unit_price": 85.00}
+            ]
+        },
+        {
+            "invoice_id": invoice_id, "customer_name": "Global Enterprises", "amount": 5200.00 + (seed % 2000),
+            "currency": "USD", "status": "overdue", "issue_date": "2025-11-01", "due_date": "2025-12-01",
+            "items": [
+                {"description": "Project Management", "quantity": 20, "unit_price": 150.00},
+                {"description": "Infrastructure Setup", "quantity": 1, "unit_price": 2200.00}
+            ]
+        }
+    ]
+    # What vendor-a did with the tool's string
+    return json.loads(json.dumps(dummy_invoices[seed % len(dummy_invoices)]))
+
+
+def per_lookup_us(fn, batches):
+    start = time.perf_counter()
+    lookups = 0
+    for batch in batches:
+        fn(batch)
+        lookups += len(batch)
+    return round((time.perf_counter() - start) / lookups * 1e6, 2)
+
+
+def measure(store, batches):
+    cold = per_lookup_us(store.get_many, batches)
+    warm = per_lookup_us(store.get_many, batches)
+    return {'cold_us': cold, 'warm_us': warm}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--batch', type=int, default=5, help='Invoices per prompt for the batch case')
+    parser.add_argument('--dataset-size', type=int, default=200000, help='Invoices in the generated SQLite file')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    ids = [f'INV-{rng.randint(1, args.dataset_size)}' for _ in range(args.lookups)]
+    singles = [[invoice_id] for invoice_id in ids]
+    batches = [ids[i:i + args.batch] for i in range(0, len(ids), args.batch)]
+    cache_size = len(ids)
+
+    for invoice_id in ids[:200]:
+        assert invoices.SyntheticInvoiceStore(1).get(invoice_id)[0] == legacy_invoice(invoice_id), invoice_id
+
+    results = {'legacy_us': per_lookup_us(lambda batch: [legacy_invoice(i) for i in batch], singles)}
+    results['synthetic'] = measure(invoices.SyntheticInvoiceStore(cache_size), singles)
+    results['synthetic_batch'] = measure(invoices.SyntheticInvoiceStore(cache_size), batches)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'invoices.db')
+        start = time.perf_counter()
+        invoices.generate(args.dataset_size, path)
+        results['sqlite_generate_s'] = round(time.perf_counter() - start, 2)
+        results['sqlite'] = measure(invoices.SQLiteInvoiceStore(path, cache_size, 256 * 1024 * 1024), singles)
+        results['sqlite_batch'] = measure(invoices.SQLiteInvoiceStore(path, cache_size, 256 * 1024 * 1024), batches)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
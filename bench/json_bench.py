@@ -0,0 +1,107 @@
+"""Microbenchmark the JSON work per vendor-o request on large completions.
+
+For chat/completions bodies of several sizes (plain text, and with per-token
+logprobs, which multiply the object count), compares the CPU a request
+spends on the upstream body:
+
+- ``stdlib``: the original path, ``response.json()`` then jsonify
+  (standard library decode and sorted, compact encode)
+- ``codec``: the same decode and re-encode with the jsoncodec backend
+- ``passthrough``: the tool-free path, which relays the bytes and only
+  scans them for usage counts
+
+and the decode of a large request body. Prints microseconds per request as JSON.
+
+    python -m bench.json_bench --sizes 4000,64000,256000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as gateway  # noqa: E402
+import jsoncodec  # noqa: E402
+
+WORDS = ("the gateway relays completions from several vendors and keeps their latency "
+         "low under load with caching coalescing and failover between backends").split()
+
+
+def completion_body(chars, logprobs, rng):
+    tokens = []
+    length = 0
+    while length < chars:
+        token = rng.choice(WORDS) + ' '
+        tokens.append(token)
+        length += len(token)
+    choice = {
+        'index': 0,
+        'message': {'role': 'assistant', 'content': ''.join(tokens)},
+        'finish_reason': 'stop',
+    }
+    if logprobs:
+        choice['logprobs'] = {'content': [
+            {'token': token, 'logprob': -rng.random(), 'bytes': list(token.encode()),
+             'top_logprobs': [{'token': rng.choice(WORDS), 'logprob': -rng.random() * 5} for _ in range(3)]}
+            for token in tokens
+        ]}
+    body = {
+        'id': 'chatcmpl-bench', 'object': 'chat.completion', 'created': 1700000000, 'model': 'gpt-4o-mini',
+        'choices': [choice],
+        'usage': {'prompt_tokens': 120, 'completion_tokens': len(tokens), 'total_tokens': 120 + len(tokens)},
+    }
+    # As OpenAI sends it: the stdlib's default separators, unsorted
+    return json.dumps(body).encode()
+
+
+def stdlib_round_trip(raw):
+    body = json.loads(raw)
+    return (json.dumps(body, separators=(',', ':'), sort_keys=True) + '\n').encode()
+
+
+def codec_round_trip(raw):
+    return jsoncodec.dumps_bytes(jsoncodec.loads(raw)) + b'\n'
+
+
+def per_call_us(fn, arg, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(arg)
+    return round((time.perf_counter() - start) / repeat * 1e6, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='4000,64000,256000', help='Completion lengths in characters')
+    parser.add_argument('--repeat', type=int, default=0, help='Calls per case (default: scaled to size)')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    results = {'backend': jsoncodec.BACKEND}
+    for size in (int(size) for size in args.sizes.split(',')):
+        for logprobs in (False, True):
+            raw = completion_body(size, logprobs, rng)
+            repeat = args.repeat or max(20000000 // len(raw), 3)
+            assert json.loads(codec_round_trip(raw)) == json.loads(raw)
+            case = {
+                'body_bytes': len(raw),
+                'stdlib_us': per_call_us(stdlib_round_trip, raw, repeat),
+                'codec_us': per_call_us(codec_round_trip, raw, repeat),
+                'passthrough_us': per_call_us(gateway.record_openai_usage_bytes, raw, repeat),
+            }
+            results[f"{size}{'/logprobs' if logprobs else ''}"] = case
+        prompt = json.dumps({'prompt': ' '.join(rng.choice(WORDS) for _ in range(size // 6))}).encode()
+        repeat = args.repeat or max(20000000 // len(prompt), 3)
+        results[f'{size}/request_parse'] = {
+            'body_bytes': len(prompt),
+            'stdlib_us': per_call_us(json.loads, prompt, repeat),
+            'codec_us': per_call_us(jsoncodec.loads, prompt, repeat),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
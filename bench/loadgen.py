@@ -0,0 +1,270 @@
+"""Open-loop load generator for the gateway's message routes.
+
+Starts the gateway (in this process, under gunicorn, or under gunicorn with
+uvicorn workers) next to the local OpenAI/wttr.in stand-in, then sends
+requests to each route at a fixed rate for a fixed time. Arrivals follow the
+schedule whether or not earlier requests have finished, and latency is
+measured from each request's scheduled send time, so a stalled server shows
+up as latency instead of as a slower request rate. Prints throughput, status
+counts, error rate and latency percentiles per route as JSON; ``--output``
+saves the report and ``--baseline`` compares against a saved one.
+
+    python -m bench.loadgen --server gunicorn --workers 2 --threads 8 --rps 100 --duration 10
+    python -m bench.loadgen --server asgi --routes vendor-o --upstream-latency-ms 200 --output asgi.json
+    python -m bench.loadgen --url http://localhost:8080 --routes v1 --baseline asgi.json
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.fake_upstream import start_fake_upstream  # noqa: E402
+from bench.upstream_bench import summarize  # noqa: E402
+
+ROUTES = {
+    'vendor-a': '/vendor-a/messages',
+    'vendor-b': '/vendor-b/messages',
+    'vendor-e': '/vendor-e/messages',
+    'vendor-o': '/vendor-o/messages',
+    'v1': '/v1/messages',
+}
+PROMPT = 'Hello, how are you?'
+
+_local = threading.local()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_healthy(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f'{base_url}/health', timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f'Gateway at {base_url} did not become healthy')
+
+
+def start_inprocess():
+    """Serve the Flask app on a thread; shares this process's GIL with the load"""
+    import logging
+
+    from werkzeug.serving import make_server
+
+    import app as gateway
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', free_port(), gateway.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}', server.shutdown
+
+
+def start_gunicorn(workers, threads, asgi=False):
+    port = free_port()
+    command = [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', f'127.0.0.1:{port}',
+               '--log-level', 'warning']
+    if asgi:
+        command += ['--worker-class', 'uvicorn_worker.UvicornWorker', 'asgi:app']
+    else:
+        command += ['--threads', str(threads), 'app:app']
+    process = subprocess.Popen(command, cwd=ROOT)
+
+    def stop():
+        process.terminate()
+        process.wait(timeout=30)
+    return f'http://127.0.0.1:{port}', stop
+
+
+def send(url, payload, timeout):
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = _local.session = requests.Session()
+    try:
+        return session.post(url, json=payload, timeout=timeout).status_code
+    except requests.RequestException as e:
+        return type(e).__name__
+
+
+def drive(url, rps, duration, timeout, max_in_flight, poisson=False, repeat_prompt=False, slo_ms=None):
+    """Send to ``url`` at ``rps`` for ``duration`` seconds; returns the route's report.
+
+    Prompts are numbered so caching and request coalescing do not hide the
+    upstream, unless ``repeat_prompt`` is set. With ``slo_ms``, goodput counts
+    the 200s answered within it.
+    """
+    results = []
+    results_lock = threading.Lock()
+    in_flight = [0]
+    dropped = 0
+    lateness = []
+
+    def fire(scheduled, payload):
+        status = send(url, payload, timeout)
+        latency = (time.perf_counter() - scheduled) * 1000
+        with results_lock:
+            results.append((status, latency))
+            in_flight[0] -= 1
+
+    rng = random.Random(0)
+    started = time.perf_counter()
+    next_send = started
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='load') as executor:
+        while next_send < started + duration:
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            lateness.append(max(time.perf_counter() - next_send, 0) * 1000)
+            with results_lock:
+                full = in_flight[0] >= max_in_flight
+                if not full:
+                    in_flight[0] += 1
+            if full:
+                # Every load thread is stuck waiting; count it rather than queue without bound
+                dropped += 1
+            else:
+                prompt = PROMPT if repeat_prompt else f'{PROMPT} #{len(lateness)}'
+                executor.submit(fire, next_send, {'prompt': prompt})
+            next_send += rng.expovariate(rps) if poisson else 1 / rps
+    elapsed = time.perf_counter() - started
+
+    statuses = Counter(str(status) for status, _ in results)
+    ok = [latency for status, latency in results if status == 200]
+    errors = len(results) - len(ok)
+    report = {
+        'sent': len(results) + dropped,
+        'completed': len(results),
+        'dropped': dropped,
+        'throughput_rps': round(len(ok) / elapsed, 2),
+        'statuses': dict(sorted(statuses.items())),
+        'error_rate': round(errors / len(results), 4) if results else None,
+        'send_lag_p99_ms': round(sorted(lateness)[int(len(lateness) * 0.99)], 3) if lateness else None,
+    }
+    if slo_ms is not None:
+        report['goodput_rps'] = round(sum(1 for latency in ok if latency <= slo_ms) / elapsed, 2)
+    if ok:
+        report['latency'] = dict(summarize(ok), max_ms=round(max(ok), 3))
+    return report
+
+
+def compare(report, baseline):
+    """Per-route change against a saved report (positive = higher now)"""
+    changes = {}
+    for route, current in report['routes'].items():
+        previous = baseline.get('routes', {}).get(route)
+        if not previous:
+            continue
+        change = {'throughput_rps': round(current['throughput_rps'] - previous['throughput_rps'], 2)}
+        if current.get('error_rate') is not None and previous.get('error_rate') is not None:
+            change['error_rate'] = round(current['error_rate'] - previous['error_rate'], 4)
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if key in current.get('latency', {}) and key in previous.get('latency', {}):
+                change[key] = round(current['latency'][key] - previous['latency'][key], 3)
+        changes[route] = change
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--server', choices=['inprocess', 'gunicorn', 'asgi'], default='gunicorn')
+    parser.add_argument('--url', help='Load an already running gateway instead of starting one')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8, help='gunicorn threads per worker (Flask only)')
+    parser.add_argument('--routes', default='vendor-a,vendor-b,vendor-e,vendor-o',
+                        help=f"Comma-separated, from {', '.join(ROUTES)}")
+    parser.add_argument('--rps', type=float, default=50)
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per route')
+    parser.add_argument('--poisson', action='store_true', help='Exponential gaps between requests')
+    parser.add_argument('--repeat-prompt', action='store_true',
+                        help='Send the same prompt every time (lets the cache and coalescing kick in)')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--slo-ms', type=float, help='Also report goodput: 200s answered within this many ms')
+    parser.add_argument('--max-in-flight', type=int, default=512)
+    parser.add_argument('--upstream-latency-ms', type=float, default=50)
+    parser.add_argument('--upstream-jitter-ms', type=float, default=0)
+    parser.add_argument('--upstream-error-rate', type=float, default=0.0)
+    parser.add_argument('--output', help='Write the report here as well')
+    parser.add_argument('--baseline', help='Earlier report to compare against')
+    args = parser.parse_args()
+
+    routes = [route.strip() for route in args.routes.split(',') if route.strip()]
+    unknown = [route for route in routes if route not in ROUTES]
+    if unknown:
+        parser.error(f"unknown route(s): {', '.join(unknown)}")
+
+    stop = None
+    fake = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+    else:
+        fake, _ = start_fake_upstream(
+            latency_ms=args.upstream_latency_ms,
+            jitter_ms=args.upstream_jitter_ms,
+            error_rate=args.upstream_error_rate,
+        )
+        os.environ.update({
+            'OPENAI_BASE_URL': fake.base_url,
+            'WEATHER_BASE_URL': fake.base_url,
+            'OPENAI_API_KEY': os.environ.get('OPENAI_API_KEY', 'sk-loadgen'),
+        })
+        if args.server == 'inprocess':
+            base_url, stop = start_inprocess()
+        else:
+            base_url, stop = start_gunicorn(args.workers, args.threads, asgi=args.server == 'asgi')
+
+    try:
+        wait_healthy(base_url)
+        report = {
+            'config': {
+                'server': 'external' if args.url else args.server,
+                'workers': None if args.url or args.server == 'inprocess' else args.workers,
+                'threads': args.threads if not args.url and args.server == 'gunicorn' else None,
+                'rps': args.rps,
+                'duration_s': args.duration,
+                'arrivals': 'poisson' if args.poisson else 'uniform',
+                'repeat_prompt': args.repeat_prompt,
+                'slo_ms': args.slo_ms,
+                'upstream_latency_ms': None if args.url else args.upstream_latency_ms,
+                'upstream_error_rate': None if args.url else args.upstream_error_rate,
+            },
+            'routes': {},
+        }
+        for route in routes:
+            report['routes'][route] = drive(
+                base_url + ROUTES[route], args.rps, args.duration, args.timeout,
+                args.max_in_flight, poisson=args.poisson, repeat_prompt=args.repeat_prompt, slo_ms=args.slo_ms
+            )
+    finally:
+        if stop:
+            stop()
+        if fake:
+            fake.shutdown()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['vs_baseline'] = compare(report, json.load(f))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Goodput and health-check latency past capacity, with and without admission control.
+
+Starts gunicorn next to the local OpenAI stand-in (whose latency bounds what
+each thread can serve) and drives one route at increasing offered rates,
+once with the concurrency limiter off (ADMISSION_ENABLED=0) and once on.
+While each step runs, a probe polls /health. Reports, per rate, goodput
+(200s answered within the SLO), the status mix, p99 latency of the 200s and
+the probe's p99 as JSON.
+
+Without the limiter, requests past capacity queue behind the busy threads
+until every answer misses the SLO; with it the excess gets a fast 503 and
+goodput stays near capacity.
+
+    python -m bench.overload_bench --rates 40,80,160 --duration 10
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fake_upstream import start_fake_upstream  # noqa: E402
+from bench.loadgen import ROUTES, drive, start_gunicorn, wait_healthy  # noqa: E402
+from bench.upstream_bench import percentile  # noqa: E402
+
+
+def probe_health(base_url, stop, samples, interval=0.05):
+    session = requests.Session()
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            session.get(f'{base_url}/health', timeout=10)
+        except requests.RequestException:
+            pass
+        samples.append((time.perf_counter() - start) * 1000)
+        stop.wait(interval)
+
+
+def run_step(base_url, route, rps, args):
+    samples = []
+    stop = threading.Event()
+    probe = threading.Thread(target=probe_health, args=(base_url, stop, samples), daemon=True)
+    probe.start()
+    try:
+        report = drive(base_url + ROUTES[route], rps, args.duration, args.timeout, args.max_in_flight, slo_ms=args.slo_ms)
+    finally:
+        stop.set()
+        probe.join()
+    return {
+        'goodput_rps': report['goodput_rps'],
+        'statuses': report['statuses'],
+        'ok_p99_ms': report.get('latency', {}).get('p99_ms'),
+        'health_p99_ms': round(percentile(samples, 99), 2) if samples else None,
+        # If this grows, the load generator itself is saturated (it shares the host's CPUs)
+        'send_lag_p99_ms': report['send_lag_p99_ms'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--route', default='vendor-o', choices=sorted(ROUTES))
+    parser.add_argument('--rates', default='40,80,160', help='Offered requests per second, one step each')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per step')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--slo-ms', type=float, default=1000)
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--max-in-flight', type=int, default=1024)
+    parser.add_argument('--upstream-latency-ms', type=float, default=50)
+    args = parser.parse_args()
+
+    fake, _ = start_fake_upstream(latency_ms=args.upstream_latency_ms)
+    os.environ.update({
+        'OPENAI_BASE_URL': fake.base_url,
+        'OPENAI_API_KEY': os.environ.get('OPENAI_API_KEY', 'sk-loadgen'),
+    })
+    results = {'config': {
+        'route': args.route, 'workers': args.workers, 'threads': args.threads,
+        'slo_ms': args.slo_ms, 'upstream_latency_ms': args.upstream_latency_ms,
+    }}
+    try:
+        for label, enabled in (('admission_off', '0'), ('admission_on', '1')):
+            os.environ['ADMISSION_ENABLED'] = enabled
+            results[label] = {}
+            for rps in (float(rate) for rate in args.rates.split(',')):
+                # A fresh server per step, so one step's backlog doesn't spill into the next
+                base_url, stop = start_gunicorn(args.workers, args.threads)
+                try:
+                    wait_healthy(base_url)
+                    results[label][f'{rps:g}'] = run_step(base_url, args.route, rps, args)
+                finally:
+                    stop()
+    finally:
+        fake.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Compare tail latency of pinning vendor-a against the /v1/messages router.
+
+Runs the router in-process (no HTTP) with the vendors' real simulated
+faults: once pinned to vendor-a with hedging off, once with the default
+ranking, failover and hedging. Prints latency percentiles, error counts and
+the router's counters as JSON.
+
+    python -m bench.router_bench --requests 500 --concurrency 32
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402,F401  (registers the vendor backends)
+import router  # noqa: E402
+from bench.upstream_bench import summarize  # noqa: E402
+
+
+def run(payload, count, concurrency):
+    def send(_):
+        start = time.perf_counter()
+        _, status = router.route(dict(payload))
+        return (time.perf_counter() - start) * 1000, status
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(count)))
+    return dict(
+        summarize([latency for latency, _ in results]),
+        max_ms=round(max(latency for latency, _ in results), 3),
+        errors=sum(1 for _, status in results if status != 200),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=32)
+    args = parser.parse_args()
+
+    pinned = run({'prompt': 'hello', 'vendors': ['vendor-a'], 'hedge': False}, args.requests, args.concurrency)
+    routed = run({'prompt': 'hello'}, args.requests, args.concurrency)
+
+    print(json.dumps({
+        'requests': args.requests,
+        'pinned_vendor_a': pinned,
+        'router': routed,
+        'router_stats': router.router_stats(),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""Microbenchmark the canned-vendor prompt rules on multi-KB prompts.
+
+Compares the original implementation (an any() chain over the lowercased
+prompt, and three uncompiled case-insensitive searches plus a second search
+for the number) with ``rules.RuleSet``, checks both give the same answers on
+every prompt, and prints microseconds per call as JSON.
+
+    python -m bench.rules_bench --sizes 1000,5000,50000
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rules  # noqa: E402
+
+FILLER = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+          "incididunt ut labore et dolore magna aliqua ut enim ad minim veniam quis nostrud").split()
+
+
+def legacy_canned_response(prompt):
+    prompt_lower = prompt.lower()
+    if any(word in prompt_lower for word in ['hello', 'hi', 'hey']):
+        return "Hello! How can I assist you today?"
+    elif any(word in prompt_lower for word in ['weather', 'temperature']):
+        return "I can help with weather information. Please specify a location."
+    elif any(word in prompt_lower for word in ['meaning of life', 'life']):
+        return "The meaning of life is a philosophical question that has been pondered throughout history."
+    elif any(word in prompt_lower for word in ['help', 'assist']):
+        return "I'm here to help! Please let me know what you need assistance with."
+    elif any(word in prompt_lower for word in ['thank', 'thanks']):
+        return "You're welcome! Feel free to ask if you need anything else."
+    else:
+        return "I understand your message. This is a simulated response for testing purposes."
+
+
+def legacy_invoice_id(prompt):
+    for pattern in [r'INV-\d+', r'invoice[\s#]+\d+', r'#\d+']:
+        match = re.search(pattern, prompt, re.IGNORECASE)
+        if match:
+            number_match = re.search(r'\d+', match.group())
+            if number_match:
+                return f"INV-{number_match.group()}"
+    return None
+
+
+def prompts(size, rng):
+    base = ' '.join(rng.choice(FILLER) for _ in range(size // 6))
+    return {
+        'no_match': base,
+        'match_at_end': base + ' Thanks! Where is INVOICE #42?',
+        'match_at_start': 'Hi, see inv-7. ' + base,
+        'lower_priority_first': '#5 life ' + base + ' INV-9 hello',
+    }
+
+
+def per_call_us(fn, text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(text)
+    return round((time.perf_counter() - start) / repeat * 1e6, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='1000,5000,50000')
+    parser.add_argument('--repeat', type=int, default=500)
+    args = parser.parse_args()
+
+    ruleset = rules.get_rules()
+    rng = random.Random(0)
+    results = {}
+    for size in (int(size) for size in args.sizes.split(',')):
+        for name, text in prompts(size, rng).items():
+            assert ruleset.respond(text.lower()) == legacy_canned_response(text), name
+            assert ruleset.find_invoice(text.lower()) == legacy_invoice_id(text), name
+            results[f'{size}/{name}'] = {
+                'canned_legacy_us': per_call_us(legacy_canned_response, text, args.repeat),
+                'canned_rules_us': per_call_us(lambda t: ruleset.respond(t.lower()), text, args.repeat),
+                'invoice_legacy_us': per_call_us(legacy_invoice_id, text, args.repeat),
+                'invoice_rules_us': per_call_us(lambda t: ruleset.find_invoice(t.lower()), text, args.repeat),
+            }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
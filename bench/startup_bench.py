@@ -0,0 +1,112 @@
+"""Measure cold start: time from launching gunicorn to the first served request.
+
+Starts the gateway under gunicorn (with gunicorn.conf.py) several times per
+configuration and, from the moment the process is spawned, keeps sending one
+request until it is answered, as the request that wakes a stopped fly.io
+machine would. Configurations:
+
+- ``lazy``: no preload, no warm-up; each worker imports the app and builds
+  everything on first use
+- ``preload``: the master imports the app once before forking
+- ``preload_warm``: preload plus the warm-up (the container's default)
+
+Reports, per configuration, the median time to the first response, that
+request's own latency and the next one's, plus the server's
+``/metrics/startup`` phases from the last run, and the import time of the
+app module on its own. Prints JSON.
+
+    python -m bench.startup_bench --runs 5
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIGS = {
+    'lazy': {'GUNICORN_PRELOAD': '0', 'WARMUP': '0'},
+    'preload': {'GUNICORN_PRELOAD': '1', 'WARMUP': '0'},
+    'preload_warm': {'GUNICORN_PRELOAD': '1', 'WARMUP': '1'},
+}
+
+# Exercises the rules, the invoice store and the tokenizer; no upstream call
+BODY = json.dumps({'prompt': 'What is the status of invoice INV-1042?', 'tools': [{'name': 'get_invoice'}]}).encode()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def post(port, timeout=30):
+    req = urllib.request.Request(
+        f'http://127.0.0.1:{port}/vendor-a/messages', data=BODY,
+        headers={'Content-Type': 'application/json', 'X-Fault': 'none'}
+    )
+    start = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def cold_start(env, workers):
+    port = free_port()
+    env = dict(os.environ, **env, PORT=str(port), WEB_CONCURRENCY=str(workers))
+    spawned = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:app'], cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while True:
+            try:
+                first = post(port)
+                break
+            except (urllib.error.URLError, ConnectionError):
+                if proc.poll() is not None:
+                    raise RuntimeError('gunicorn exited before serving a request')
+                time.sleep(0.005)
+        served = time.perf_counter() - spawned
+        second = post(port)
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics/startup') as response:
+            phases = json.load(response)
+        return served, first, second, phases
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def import_seconds():
+    code = 'import time; start = time.perf_counter(); import app; print(time.perf_counter() - start)'
+    return float(subprocess.check_output([sys.executable, '-c', code], cwd=ROOT))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=5, help='Cold starts per configuration')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--configs', default=','.join(CONFIGS))
+    args = parser.parse_args()
+
+    results = {'import_app_ms': round(statistics.median(import_seconds() for _ in range(args.runs)) * 1000, 1)}
+    for name in args.configs.split(','):
+        runs = [cold_start(CONFIGS[name], args.workers) for _ in range(args.runs)]
+        results[name] = {
+            'first_response_ms': round(statistics.median(run[0] for run in runs) * 1000, 1),
+            'first_request_ms': round(statistics.median(run[1] for run in runs) * 1000, 2),
+            'second_request_ms': round(statistics.median(run[2] for run in runs) * 1000, 2),
+            'server_phases_s': runs[-1][3]['phases'],
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Measure the per-request cost of token counting.
+
+Counts a request's prompt and canned reply the way vendor-a/b do, with the
+whitespace counter, with the BPE tokenizer from cold memos (every word is
+new), with warm memos (the usual case: repeated prompts and words), and with
+memos warm per word only (new texts made of known words). Prints
+microseconds per request as JSON.
+
+    python -m bench.tokenizer_bench --requests 2000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tokenizer  # noqa: E402
+from bench.upstream_bench import summarize  # noqa: E402
+
+PROMPTS = [
+    "Hello, how are you?",
+    "What's the weather like in San Francisco, CA today?",
+    "def fib(n):\n    return n if n < 2 else fib(n - 1) + fib(n - 2)",
+    "Can you summarize invoice INV-12345 and tell me when it is due?",
+    "Привет! Как дела? Расскажи о погоде в Москве.",
+    "今日は天気がいいですね。散歩に行きましょう。",
+]
+REPLY = "I understand your message. This is a simulated response for testing purposes."
+
+
+def time_requests(count_pair, requests):
+    samples = []
+    for prompt in requests:
+        start = time.perf_counter()
+        count_pair(prompt)
+        samples.append((time.perf_counter() - start) * 1e6)
+    return samples
+
+
+def summarize_us(samples):
+    return {key.replace('_ms', '_us'): value for key, value in summarize(samples).items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    repeated = [rng.choice(PROMPTS) for _ in range(args.requests)]
+    # Fresh text each time, built from words seen before
+    words = ' '.join(PROMPTS).split()
+    varied = [' '.join(rng.choice(words) for _ in range(12)) + f' #{i}' for i in range(args.requests)]
+
+    whitespace = tokenizer.WhitespaceTokenizer()
+    bpe = tokenizer.BPETokenizer()
+    tokenizer._tokenizer = bpe
+
+    results = {
+        'whitespace': summarize_us(time_requests(
+            lambda prompt: (whitespace.count(prompt), whitespace.count(REPLY)), repeated)),
+    }
+
+    def cold(prompt):
+        bpe._cached_count.cache_clear()
+        bpe._word_tokens.cache_clear()
+        tokenizer.count_batch([prompt, REPLY])
+
+    results['bpe_cold'] = summarize_us(time_requests(cold, repeated[:200]))
+    results['bpe_warm'] = summarize_us(time_requests(lambda prompt: tokenizer.count_batch([prompt, REPLY]), repeated))
+    results['bpe_new_text_known_words'] = summarize_us(
+        time_requests(lambda prompt: tokenizer.count_batch([prompt, REPLY]), varied))
+
+    long_text = ' '.join(PROMPTS * 200)
+    start = time.perf_counter()
+    long_tokens = bpe.count(long_text)
+    results['long_text'] = {
+        'chars': len(long_text),
+        'tokens': long_tokens,
+        'ms': round((time.perf_counter() - start) * 1000, 3),
+    }
+    results['counts'] = {
+        prompt: {'whitespace': whitespace.count(prompt), 'bpe': bpe.count(prompt)} for prompt in PROMPTS
+    }
+    results['memo'] = tokenizer.tokenizer_stats()
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
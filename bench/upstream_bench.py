@@ -0,0 +1,74 @@
+"""Measure connection reuse against a local HTTPS stand-in.
+
+Sends the same chat completion request N times with a fresh connection per
+call (the old module-level ``requests.post``) and then through the pooled
+``upstream`` client, and prints latency percentiles for both as JSON.
+
+    python -m bench.upstream_bench --requests 200
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import upstream  # noqa: E402
+from bench.fake_upstream import start_fake_upstream  # noqa: E402
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples):
+    return {
+        'p50_ms': round(percentile(samples, 50), 3),
+        'p95_ms': round(percentile(samples, 95), 3),
+        'p99_ms': round(percentile(samples, 99), 3),
+        'mean_ms': round(statistics.mean(samples), 3),
+    }
+
+
+def run(send, count, url, payload):
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        response = send(url, payload)
+        response.raise_for_status()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    args = parser.parse_args()
+
+    server, cert = start_fake_upstream(tls=True, latency_ms=args.latency_ms)
+    os.environ['REQUESTS_CA_BUNDLE'] = cert
+    os.environ['OPENAI_BASE_URL'] = server.base_url
+    url = upstream.openai_url('/v1/chat/completions')
+    payload = {'model': 'gpt-3.5-turbo', 'messages': [{'role': 'user', 'content': 'hi'}]}
+
+    fresh = run(lambda u, p: requests.post(u, json=p, timeout=30), args.requests, url, payload)
+    pooled = run(lambda u, p: upstream.post(u, json=p, read_timeout=30), args.requests, url, payload)
+    server.shutdown()
+
+    print(json.dumps({
+        'requests': args.requests,
+        'fresh_connection': summarize(fresh),
+        'pooled': summarize(pooled),
+        'pool': upstream.pool_stats()['hosts'],
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
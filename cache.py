@@ -0,0 +1,228 @@
+"""Response cache for vendor-o.
+
+Identical requests (same model, system prompt, prompt, tools and tool
+choice) are answered from cache instead of paying another OpenAI round trip.
+Each worker keeps a bounded LRU with a TTL in memory; an optional SQLite file
+adds a shared tier so gunicorn workers see each other's entries. Entries are
+the serialized JSON body, so a hit is sent without re-encoding.
+
+The cache is opt-in: it is off unless RESPONSE_CACHE_TTL is set.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire ``ttl`` seconds after being stored"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        """Remove ``key``; True if it was there"""
+        with self._lock:
+            return self._entries.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """Cache tier in a SQLite file shared by every worker on the machine.
+
+    Connections are per thread (and re-opened after a fork). Any SQLite error
+    is treated as a miss: the cache must never fail a request.
+    """
+
+    PRUNE_EVERY = 256
+
+    def __init__(self, path, maxsize, ttl):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS response_cache ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                'expires_at REAL NOT NULL, stored_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS response_cache_stored_at ON response_cache (stored_at)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        try:
+            row = self._connection().execute(
+                'SELECT value FROM response_cache WHERE key = ? AND expires_at > ?', (key, time.time())
+            ).fetchone()
+        except sqlite3.Error:
+            return None
+        return bytes(row[0]) if row else None
+
+    def set(self, key, value):
+        now = time.time()
+        try:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO response_cache (key, value, expires_at, stored_at) VALUES (?, ?, ?, ?)',
+                (key, value, now + self.ttl, now)
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                self._prune(conn, now)
+        except sqlite3.Error:
+            pass
+
+    def _prune(self, conn, now):
+        conn.execute('DELETE FROM response_cache WHERE expires_at <= ?', (now,))
+        conn.execute(
+            'DELETE FROM response_cache WHERE key IN ('
+            'SELECT key FROM response_cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?)',
+            (self.maxsize,)
+        )
+
+
+class ResponseCache:
+    """Memory tier in front of an optional shared SQLite tier"""
+
+    def __init__(self, maxsize, ttl, sqlite_path=None, sqlite_maxsize=100000):
+        self.memory = TTLCache(maxsize, ttl)
+        self.shared = SQLiteCache(sqlite_path, sqlite_maxsize, ttl) if sqlite_path else None
+        self.ttl = ttl
+        self._stats_lock = threading.Lock()
+        self.stats = {'hits_memory': 0, 'hits_sqlite': 0, 'misses': 0, 'bypassed': 0, 'stores': 0}
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def get(self, key):
+        """Return (body_bytes, tier) or (None, None)"""
+        value = self.memory.get(key)
+        if value is not None:
+            self._count('hits_memory')
+            return value, 'memory'
+        if self.shared:
+            value = self.shared.get(key)
+            if value is not None:
+                # Promote so the next hit on this worker skips SQLite
+                self.memory.set(key, value)
+                self._count('hits_sqlite')
+                return value, 'sqlite'
+        self._count('misses')
+        return None, None
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.shared:
+            self.shared.set(key, value)
+        self._count('stores')
+
+    def note_bypass(self):
+        self._count('bypassed')
+
+    def snapshot(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return dict(
+            stats,
+            enabled=True,
+            ttl=self.ttl,
+            entries=len(self.memory),
+            maxsize=self.memory.maxsize,
+            evictions=self.memory.evictions,
+            sqlite_path=self.shared.path if self.shared else None,
+        )
+
+
+def get_response_cache():
+    """Return this process's ResponseCache, or None when caching is disabled"""
+    global _cache
+    ttl = float(os.getenv('RESPONSE_CACHE_TTL', '0') or 0)
+    if ttl <= 0:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache(
+                    maxsize=int(os.getenv('RESPONSE_CACHE_MAXSIZE', '1024')),
+                    ttl=ttl,
+                    sqlite_path=os.getenv('RESPONSE_CACHE_SQLITE_PATH') or None,
+                    sqlite_maxsize=int(os.getenv('RESPONSE_CACHE_SQLITE_MAXSIZE', '100000')),
+                )
+    return _cache
+
+
+def response_cache_key(data):
+    """Hash the fields that determine a vendor-o completion, with defaults applied"""
+    normalized = {
+        'model': data.get('model', 'gpt-3.5-turbo'),
+        'system_prompt': data.get('system_prompt', 'You are a helpful assistant'),
+        'prompt': data.get('prompt', data.get('message', 'Hello')),
+        'tools': data.get('tools') or None,
+        'tool_choice': data.get('tool_choice') or None,
+    }
+    encoded = json.dumps(normalized, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def bypass_requested(data, headers):
+    """True if the request opts out with "cache": false or Cache-Control: no-cache/no-store.
+
+    Session requests always bypass: their answer depends on the session's history.
+    """
+    if data.get('cache') is False or data.get('session_id') is not None:
+        return True
+    cache_control = (headers.get('Cache-Control') or '').lower()
+    return 'no-cache' in cache_control or 'no-store' in cache_control
+
+
+def cache_stats():
+    cache = get_response_cache()
+    return cache.snapshot() if cache else {'enabled': False}
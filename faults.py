@@ -0,0 +1,234 @@
+"""Simulated vendor failures, configured per vendor.
+
+Each vendor has an ordered list of fault rules (data/faults.json, or
+FAULTS_PATH). For every request the rules are tried in order; each fires
+with its ``rate`` and the first one that fires decides the outcome:
+
+    {"name": "slow_error", "rate": 0.05,
+     "delay_s": {"dist": "lognormal", "median": 0.5, "sigma": 0.8, "max": 10},
+     "status": 504, "body": {"error": "Gateway timeout"}}
+
+A rule with ``delay_s`` stalls the request; one with ``status`` fails it
+with that status and ``body`` (after the delay, if both are given). A 429
+rule may add ``retry_after_ms`` to its body. Delays and retry hints are
+distributions: ``fixed`` (value), ``uniform`` (low, high), ``randint``
+(low, high) or ``lognormal`` (median, sigma, optional max).
+
+A rule with a ``window`` only applies inside it: ``{"every_s": 600,
+"duration_s": 60, "offset_s": 0}`` is active for the first minute of every
+ten, on the wall clock, so all workers agree. An outage is a window with
+rate 1; a burst is a window with a higher error rate, listed before the
+vendor's usual rules.
+
+Rolls use one RNG per process, seeded from FAULTS_SEED when set. Requests
+may steer their own roll with headers:
+
+- ``X-Fault-Seed: <int>``: roll with a fresh RNG seeded by this value
+- ``X-Fault: none`` skips faults; ``X-Fault: <rule name>`` forces that rule;
+  ``X-Fault: <status>`` fails with that status
+- ``X-Fault-Delay-Ms: <ms>`` adds a fixed delay, capped at
+  FAULTS_HEADER_MAX_DELAY_MS
+
+A malformed override (a negative or non-finite delay, a forced status
+outside 400-599, a rule name the vendor does not have, a seed that is not an
+integer) fails the request with a 400 instead. FAULTS_HEADERS=0 ignores the headers, for deployments where
+clients must not pick their own faults.
+
+The roll only returns the delay; callers wait without holding a thread
+where they can (``asyncio.sleep`` in the ASGI app, the router's
+cancellable ``Event.wait``).
+"""
+import json
+import math
+import os
+import random
+import time
+
+import metrics
+
+FAULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'faults.json')
+
+_profiles = None
+_rng = None
+
+
+class Distribution:
+    KINDS = {
+        'fixed': ('value',),
+        'uniform': ('low', 'high'),
+        'randint': ('low', 'high'),
+        'lognormal': ('median', 'sigma'),
+    }
+
+    def __init__(self, spec):
+        if isinstance(spec, (int, float)):
+            spec = {'dist': 'fixed', 'value': spec}
+        self.kind = spec.get('dist')
+        if self.kind not in self.KINDS:
+            raise ValueError(f"Unknown distribution {self.kind!r}; expected one of {', '.join(self.KINDS)}")
+        missing = [name for name in self.KINDS[self.kind] if name not in spec]
+        if missing:
+            raise ValueError(f"{self.kind} distribution needs {', '.join(missing)}")
+        self.spec = spec
+        self.max = spec.get('max')
+
+    def sample(self, rng):
+        spec = self.spec
+        if self.kind == 'fixed':
+            value = spec['value']
+        elif self.kind == 'uniform':
+            value = rng.uniform(spec['low'], spec['high'])
+        elif self.kind == 'randint':
+            value = rng.randint(spec['low'], spec['high'])
+        else:
+            value = rng.lognormvariate(math.log(spec['median']), spec['sigma'])
+        if self.max is not None:
+            value = min(value, self.max)
+        return value
+
+
+class Window:
+    def __init__(self, spec):
+        self.every = float(spec['every_s'])
+        self.duration = float(spec['duration_s'])
+        self.offset = float(spec.get('offset_s', 0))
+        if self.every <= 0 or self.duration <= 0:
+            raise ValueError('Fault windows need positive every_s and duration_s')
+
+    def active(self, now):
+        return (now - self.offset) % self.every < self.duration
+
+
+class FaultRule:
+    def __init__(self, spec):
+        self.status = spec.get('status')
+        self.body = spec.get('body') or ({'error': 'Injected fault'} if self.status else None)
+        self.delay = Distribution(spec['delay_s']) if 'delay_s' in spec else None
+        self.retry_after = Distribution(spec['retry_after_ms']) if 'retry_after_ms' in spec else None
+        self.window = Window(spec['window']) if 'window' in spec else None
+        self.rate = float(spec.get('rate', 1))
+        self.name = spec.get('name') or ('error' if self.status else 'delay')
+        if self.status is None and self.delay is None:
+            raise ValueError(f"Fault rule {self.name!r} needs a status, a delay_s or both")
+
+    def outcome(self, rng):
+        """(error, delay_seconds) when this rule fires"""
+        delay = self.delay.sample(rng) if self.delay else 0
+        if self.status is None:
+            return None, delay
+        body = dict(self.body)
+        if self.retry_after is not None:
+            body['retryAfterMs'] = int(self.retry_after.sample(rng))
+        return (body, self.status), delay
+
+
+def load(path):
+    """Compile a faults file: {vendor: [rule, ...]}"""
+    with open(path) as f:
+        config = json.load(f)
+    return {vendor: [FaultRule(rule) for rule in rules] for vendor, rules in config.items()}
+
+
+def get_profiles():
+    """Return this process's fault rules, loaded from FAULTS_PATH on first use"""
+    global _profiles
+    if _profiles is None:
+        _profiles = load(os.getenv('FAULTS_PATH') or FAULTS_PATH)
+    return _profiles
+
+
+def get_rng():
+    global _rng
+    if _rng is None:
+        seed = os.getenv('FAULTS_SEED')
+        _rng = random.Random(int(seed) if seed not in (None, '') else None)
+    return _rng
+
+
+def _after_fork():
+    # Workers forked from a preloaded app would otherwise share one RNG state
+    global _rng
+    _rng = None
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def request_overrides(get_header):
+    """Read the X-Fault* override headers through ``get_header(name)``"""
+    overrides = {}
+    if os.getenv('FAULTS_HEADERS', '1') == '0':
+        return overrides
+    for key, name in (('fault', 'X-Fault'), ('seed', 'X-Fault-Seed'), ('delay_ms', 'X-Fault-Delay-Ms')):
+        value = get_header(name)
+        if value:
+            overrides[key] = value.strip()
+    return overrides
+
+
+def _header_seed(value):
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError('X-Fault-Seed must be an integer') from None
+
+
+def _header_delay(value):
+    """Seconds of delay for an X-Fault-Delay-Ms value, capped at FAULTS_HEADER_MAX_DELAY_MS"""
+    try:
+        delay_ms = float(value)
+    except ValueError:
+        delay_ms = math.nan
+    if not math.isfinite(delay_ms) or delay_ms < 0:
+        raise ValueError('X-Fault-Delay-Ms must be a non-negative number of milliseconds')
+    return min(delay_ms, float(os.getenv('FAULTS_HEADER_MAX_DELAY_MS', '10000'))) / 1000
+
+
+def _forced(rules, fault, rng):
+    if fault.isdigit():
+        status = int(fault) if fault.isascii() else 0
+        if not 400 <= status <= 599:
+            raise ValueError('X-Fault status must be between 400 and 599')
+        return ({'error': f'Injected {fault}'}, status), 0, 'forced'
+    for rule in rules:
+        if rule.name == fault:
+            return (*rule.outcome(rng), rule.name)
+    raise ValueError(f'Unknown fault rule: {fault}')
+
+
+def roll(vendor, overrides=None):
+    """Roll ``vendor``'s faults for one request.
+
+    Returns (error, delay_seconds): error is a (body, status) pair or None,
+    and the delay applies before the response (or the error) is sent. A
+    malformed override gives a 400 error and no delay.
+    """
+    overrides = overrides or {}
+    if os.getenv('FAULTS_ENABLED', '1') == '0' or overrides.get('fault') == 'none':
+        return None, 0
+    rules = get_profiles().get(vendor, ())
+    try:
+        rng = random.Random(_header_seed(overrides['seed'])) if 'seed' in overrides else get_rng()
+        extra_delay = _header_delay(overrides['delay_ms']) if 'delay_ms' in overrides else 0
+        forced = _forced(rules, overrides['fault'], rng) if 'fault' in overrides else None
+    except ValueError as e:
+        return ({'error': str(e)}, 400), 0
+
+    if forced is not None:
+        error, delay, name = forced
+    else:
+        error, delay, name = None, 0, None
+        now = time.time()
+        for rule in rules:
+            if rule.window is not None and not rule.window.active(now):
+                continue
+            if rng.random() < rule.rate:
+                error, delay = rule.outcome(rng)
+                name = rule.name
+                break
+
+    if name is not None:
+        metrics.INJECTED_FAULTS.inc(vendor, name)
+        if error is not None and error[1] == 429:
+            metrics.RATE_LIMITED.inc(vendor)
+    return error, delay + extra_delay
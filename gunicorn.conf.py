@@ -0,0 +1,61 @@
+"""gunicorn settings for the container (picked up from the working directory).
+
+The app is preloaded: the master imports it and runs the fork-safe warm-up
+(client libraries, URL map, data files, tokenizer) once, then forks workers
+that share all of it copy-on-write. Each worker builds its own pools and
+executors in ``post_fork``, before it accepts a connection, so the request
+that woke a stopped machine doesn't pay for any of it. See startup.py.
+
+- GUNICORN_PRELOAD: ``0`` imports the app in each worker instead
+- WARMUP: ``0`` skips the warm-up (everything is built on first use)
+- WEB_CONCURRENCY, GUNICORN_THREADS: workers and threads per worker
+
+Threaded workers also keep one thread out of reach of the vendor routes
+(ADMISSION_TOTAL_LIMIT, see admission.py) unless it is set explicitly. The
+thread count defaults to what a route's admission limit and queue need, so
+requests past the limit wait in its priority queue instead of being turned
+away for want of a thread.
+
+Workers sum their metrics through METRICS_DIR (see metrics.py); unless it
+is set, it defaults to a directory under the system temp dir named for the
+port, emptied when the server starts.
+"""
+import os
+import tempfile
+
+import admission
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+# Set before the app is loaded, so the master and every worker see it
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f"gateway-metrics-{os.getenv('PORT', '8080')}"))
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+threads = int(os.getenv('GUNICORN_THREADS') or admission.worker_threads())
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') != '0'
+warmup = os.getenv('WARMUP', '1') != '0'
+
+
+def _async_worker(server):
+    return 'uvicorn' in str(server.cfg.worker_class_str).lower()
+
+
+def on_starting(server):
+    # Snapshots from the previous run would be summed into this one's metrics
+    import metrics
+    metrics.clear_snapshots()
+
+
+def when_ready(server):
+    if preload_app and warmup:
+        import app
+        app.warm_up(per_process=False, async_client=_async_worker(server))
+        server.log.info('Warm-up (shared): %s', app.startup.startup_stats()['warmup'])
+
+
+def post_fork(server, worker):
+    if not _async_worker(server) and server.cfg.threads > 1:
+        # Limited routes may hold all threads but one; health checks and metrics get that one
+        os.environ.setdefault('ADMISSION_TOTAL_LIMIT', str(server.cfg.threads - 1))
+    if warmup:
+        import app
+        app.warm_up(async_client=_async_worker(server))
+        worker.log.info('Warm-up (worker %s): %s', worker.pid, app.startup.startup_stats()['phases'])
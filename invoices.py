@@ -0,0 +1,265 @@
+"""Invoice data behind vendor-a's simulated tool calls and the get_invoice tool.
+
+Every lookup returns an (invoice dict, serialized JSON) pair, so vendor-a
+reads fields straight from the dict and the tool sends the string without
+re-encoding. Pairs are kept in a bounded LRU (INVOICE_STORE_CACHE_SIZE), and
+``get_many`` resolves every invoice a prompt mentions in one pass.
+
+The backend is picked by INVOICES_PATH:
+
+- unset: the built-in dummy invoices; any ID resolves, by its number, to
+  one of three templates
+- ``*.jsonl``: one invoice object per line, loaded into memory at startup
+  and indexed by ``invoice_id``
+- anything else: a SQLite file with an ``invoices (id, body)`` table, read
+  through a memory map (INVOICES_MMAP_BYTES), for datasets too large to load
+
+Build a synthetic dataset of any size with:
+
+    python -m invoices --count 1000000 --output invoices.db
+"""
+import abc
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+TEMPLATES = (
+    {
+        "customer_name": "Acme Corporation",
+        "base_amount": 1250.00,
+        "amount_spread": 1000,
+        "currency": "USD",
+        "status": "paid",
+        "issue_date": "2025-12-01",
+        "due_date": "2025-12-31",
+        "items": [
+            {"description": "Consulting Services", "quantity": 10, "unit_price": 100.00},
+            {"description": "Software License", "quantity": 1, "unit_price": 250.00}
+        ]
+    },
+    {
+        "customer_name": "Tech Solutions Inc",
+        "base_amount": 3500.00,
+        "amount_spread": 500,
+        "currency": "USD",
+        "status": "pending",
+        "issue_date": "2025-12-15",
+        "due_date": "2026-01-15",
+        "items": [
+            {"description": "Development Work", "quantity": 40, "unit_price": 85.00}
+        ]
+    },
+    {
+        "customer_name": "Global Enterprises",
+        "base_amount": 5200.00,
+        "amount_spread": 2000,
+        "currency": "USD",
+        "status": "overdue",
+        "issue_date": "2025-11-01",
+        "due_date": "2025-12-01",
+        "items": [
+            {"description": "Project Management", "quantity": 20, "unit_price": 150.00},
+            {"description": "Infrastructure Setup", "quantity": 1, "unit_price": 2200.00}
+        ]
+    },
+)
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def synthetic_invoice(invoice_id):
+    """The dummy invoice for an ID: its number picks the template and amount"""
+    invoice_num = invoice_id.split('-')[1] if '-' in invoice_id else invoice_id
+    seed = int(invoice_num) if invoice_num.isdigit() else 12345
+    template = TEMPLATES[seed % len(TEMPLATES)]
+    return {
+        "invoice_id": invoice_id,
+        "customer_name": template["customer_name"],
+        "amount": template["base_amount"] + (seed % template["amount_spread"]),
+        "currency": template["currency"],
+        "status": template["status"],
+        "issue_date": template["issue_date"],
+        "due_date": template["due_date"],
+        "items": template["items"],
+    }
+
+
+class InvoiceStore(abc.ABC):
+    """LRU of (dict, JSON) pairs in front of a backend's ``_fetch``"""
+
+    backend = None
+
+    def __init__(self, cache_size):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'lookups': 0, 'cache_hits': 0, 'not_found': 0}
+
+    @abc.abstractmethod
+    def _fetch(self, invoice_ids):
+        """Return {invoice_id: (dict, json)} for the IDs that exist"""
+
+    def get_many(self, invoice_ids):
+        """Look up several invoices; returns one (dict, json) pair or None per ID.
+
+        The dicts are shared with the cache: read them, never change them.
+        """
+        found = {}
+        with self._lock:
+            self.stats['lookups'] += len(invoice_ids)
+            for invoice_id in invoice_ids:
+                entry = self._cache.get(invoice_id)
+                if entry is not None:
+                    self._cache.move_to_end(invoice_id)
+                    found[invoice_id] = entry
+            self.stats['cache_hits'] += len(found)
+        missing = [invoice_id for invoice_id in dict.fromkeys(invoice_ids) if invoice_id not in found]
+        if missing:
+            fetched = self._fetch(missing)
+            with self._lock:
+                for invoice_id, entry in fetched.items():
+                    self._cache[invoice_id] = entry
+                    self._cache.move_to_end(invoice_id)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+                self.stats['not_found'] += len(missing) - len(fetched)
+            found.update(fetched)
+        return [found.get(invoice_id) for invoice_id in invoice_ids]
+
+    def get(self, invoice_id):
+        return self.get_many([invoice_id])[0]
+
+    def get_json(self, invoice_id):
+        """The invoice as a JSON string, or an error dict (the get_invoice tool's result)"""
+        entry = self.get(invoice_id)
+        if entry is None:
+            return {'error': f'Invoice {invoice_id} not found'}
+        return entry[1]
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, backend=self.backend, cached=len(self._cache), cache_size=self.cache_size)
+
+
+class SyntheticInvoiceStore(InvoiceStore):
+    backend = 'synthetic'
+
+    def _fetch(self, invoice_ids):
+        fetched = {}
+        for invoice_id in invoice_ids:
+            invoice = synthetic_invoice(invoice_id)
+            fetched[invoice_id] = (invoice, json.dumps(invoice))
+        return fetched
+
+
+class JSONLInvoiceStore(InvoiceStore):
+    """Every invoice's JSON text in memory, indexed by ID; parsed on first use"""
+
+    backend = 'jsonl'
+
+    def __init__(self, path, cache_size):
+        super().__init__(cache_size)
+        self.path = path
+        self._index = {}
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    self._index[json.loads(line)['invoice_id']] = line
+
+    def _fetch(self, invoice_ids):
+        return {invoice_id: (json.loads(self._index[invoice_id]), self._index[invoice_id])
+                for invoice_id in invoice_ids if invoice_id in self._index}
+
+    def snapshot(self):
+        return dict(super().snapshot(), path=self.path, invoices=len(self._index))
+
+
+class SQLiteInvoiceStore(InvoiceStore):
+    """Invoices in a read-only SQLite file, one query per batch.
+
+    Connections are per thread (and re-opened after a fork).
+    """
+
+    backend = 'sqlite'
+
+    def __init__(self, path, cache_size, mmap_bytes):
+        super().__init__(cache_size)
+        self.path = path
+        self.mmap_bytes = mmap_bytes
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+            conn.execute(f'PRAGMA mmap_size={int(self.mmap_bytes)}')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _fetch(self, invoice_ids):
+        placeholders = ','.join('?' * len(invoice_ids))
+        rows = self._connection().execute(
+            f'SELECT id, body FROM invoices WHERE id IN ({placeholders})', invoice_ids
+        ).fetchall()
+        return {invoice_id: (json.loads(body), body) for invoice_id, body in rows}
+
+    def snapshot(self):
+        return dict(super().snapshot(), path=self.path)
+
+
+def get_store():
+    """Return this process's invoice store, picked by INVOICES_PATH on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                cache_size = int(os.getenv('INVOICE_STORE_CACHE_SIZE', '10000'))
+                path = os.getenv('INVOICES_PATH')
+                if not path:
+                    _store = SyntheticInvoiceStore(cache_size)
+                elif path.endswith('.jsonl'):
+                    _store = JSONLInvoiceStore(path, cache_size)
+                else:
+                    mmap_bytes = int(os.getenv('INVOICES_MMAP_BYTES', str(256 * 1024 * 1024)))
+                    _store = SQLiteInvoiceStore(path, cache_size, mmap_bytes)
+    return _store
+
+
+def invoice_stats():
+    return get_store().snapshot()
+
+
+def generate(count, output):
+    """Write ``count`` synthetic invoices (INV-1 ... INV-<count>) to a .jsonl or SQLite file"""
+    bodies = ((f'INV-{number}', json.dumps(synthetic_invoice(f'INV-{number}'))) for number in range(1, count + 1))
+    if output.endswith('.jsonl'):
+        with open(output, 'w') as f:
+            for _, body in bodies:
+                f.write(body + '\n')
+        return
+    if os.path.exists(output):
+        os.remove(output)
+    conn = sqlite3.connect(output)
+    conn.execute('CREATE TABLE invoices (id TEXT PRIMARY KEY, body TEXT NOT NULL) WITHOUT ROWID')
+    conn.executemany('INSERT INTO invoices (id, body) VALUES (?, ?)', bodies)
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic invoice dataset for INVOICES_PATH')
+    parser.add_argument('--count', type=int, default=1000000)
+    parser.add_argument('--output', required=True, help='A .jsonl file, or anything else for SQLite')
+    args = parser.parse_args()
+    generate(args.count, args.output)
+    print(f'Wrote {args.count} invoices to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
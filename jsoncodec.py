@@ -0,0 +1,85 @@
+"""The JSON encoder and decoder used across the gateway.
+
+JSON_BACKEND picks the library: ``orjson`` or ``msgspec`` when installed
+(both encode and decode several times faster than the standard library),
+``stdlib``, or ``auto`` (the default: the first of orjson, msgspec, stdlib
+that imports). Output is compact with sorted keys, like jsonify. The fast
+backends write non-ASCII characters as UTF-8 instead of ``\\u`` escapes.
+Objects a backend cannot encode (Decimal, big integers, ...) fall back to
+the standard library, so the choice never changes what can be sent.
+"""
+import json
+import os
+
+BACKENDS = ('orjson', 'msgspec', 'stdlib')
+
+
+def _stdlib_dumps(obj, default=None):
+    return json.dumps(obj, default=default, separators=(',', ':'), sort_keys=True).encode()
+
+
+def _load_orjson():
+    import orjson
+    options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(obj, default=None):
+        try:
+            return orjson.dumps(obj, default=default, option=options)
+        except TypeError:
+            return _stdlib_dumps(obj, default)
+    return dumps, orjson.loads
+
+
+def _load_msgspec():
+    import msgspec
+    encoders = {}
+    decoder = msgspec.json.Decoder()
+
+    def dumps(obj, default=None):
+        encoder = encoders.get(default)
+        if encoder is None:
+            encoder = encoders[default] = msgspec.json.Encoder(enc_hook=default, order='sorted')
+        try:
+            return encoder.encode(obj)
+        except (TypeError, msgspec.EncodeError):
+            return _stdlib_dumps(obj, default)
+
+    def loads(data):
+        try:
+            return decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+    return dumps, loads
+
+
+def _select(name):
+    loaders = {'orjson': _load_orjson, 'msgspec': _load_msgspec}
+    if name == 'stdlib':
+        return name, _stdlib_dumps, json.loads
+    if name != 'auto':
+        if name not in loaders:
+            raise ValueError(f"Unknown JSON_BACKEND {name!r}; expected auto or one of {', '.join(BACKENDS)}")
+        return (name, *loaders[name]())
+    for candidate, loader in loaders.items():
+        try:
+            return (candidate, *loader())
+        except ImportError:
+            continue
+    return 'stdlib', _stdlib_dumps, json.loads
+
+
+BACKEND, _dumps, _loads = _select(os.getenv('JSON_BACKEND', 'auto').strip().lower() or 'auto')
+
+
+def dumps_bytes(obj, default=None):
+    """Compact, key-sorted UTF-8 JSON; ``default`` converts unsupported objects"""
+    return _dumps(obj, default)
+
+
+def dumps(obj, default=None):
+    return _dumps(obj, default).decode()
+
+
+def loads(data):
+    """Parse JSON from bytes or str; raises ValueError on invalid input"""
+    return _loads(data)
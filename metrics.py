@@ -0,0 +1,306 @@
+"""Prometheus metrics for the gateway, served as text on ``GET /metrics``.
+
+Counters, gauges and fixed-bucket histograms live in plain lists, one per
+label combination. Recording is a dict lookup, a ``bisect`` and two list
+increments, so it is cheap enough for every request; nothing is formatted
+until a scrape. Increments take no lock: losing one needs a thread switch
+between the read and the write of the same slot, which is rare enough not
+to matter for monitoring, and a lock would double the cost of recording.
+
+Under gunicorn every worker has its own numbers. With METRICS_DIR set to a
+directory shared by the workers (gunicorn.conf.py sets one by default), each
+one writes a snapshot there (``metrics-<pid>.json``) every
+METRICS_FLUSH_INTERVAL seconds; a scrape, whichever worker answers it, sums
+all the snapshots. Snapshots of workers
+that have exited are kept, with their gauges zeroed, so counters never go
+backwards; the directory is cleared when the whole server restarts
+(gunicorn.conf.py's ``on_starting``).
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Seconds; spans cache hits (sub-millisecond) to vendor-a's slow responses
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_registry = []
+_flusher_started = False
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        _registry.append(self)
+
+    def inc(self, *labels, amount=1):
+        value = self._series.get(labels)
+        if value is None:
+            value = self._series.setdefault(labels, [0])
+        value[0] += amount
+
+    def reset(self):
+        self._series = {}
+
+    def snapshot(self):
+        series = [[list(labels), value[0]] for labels, value in list(self._series.items())]
+        return {'type': self.type, 'help': self.help, 'labels': list(self.labelnames), 'series': series}
+
+
+class Gauge(Counter):
+    """A value that goes up and down; workers' values are summed like counters'"""
+
+    type = 'gauge'
+
+    def set(self, value, *labels):
+        self._series[labels] = [value]
+
+    def zero(self):
+        for value in list(self._series.values()):
+            value[0] = 0
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        _registry.append(self)
+
+    def observe(self, value, *labels):
+        """Record ``value`` (seconds) for the given label values"""
+        counts = self._series.get(labels)
+        if counts is None:
+            # One slot per bucket, then +Inf, then the running sum
+            counts = self._series.setdefault(labels, [0] * (len(self.buckets) + 2))
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def reset(self):
+        self._series = {}
+
+    def snapshot(self):
+        series = [[list(labels), list(counts)] for labels, counts in list(self._series.items())]
+        return {'type': self.type, 'help': self.help, 'labels': list(self.labelnames),
+                'buckets': list(self.buckets), 'series': series}
+
+
+# Requests
+REQUEST_SECONDS = Histogram('gateway_request_duration_seconds',
+                            'Time to handle a request, until the response (or a stream\'s headers) is ready',
+                            ('route', 'method'))
+REQUESTS = Counter('gateway_requests_total', 'Requests answered, by status code', ('route', 'method', 'status'))
+PARSE_SECONDS = Histogram('gateway_request_parse_seconds', 'Time to parse a JSON request body', ('route',))
+SERIALIZE_SECONDS = Histogram('gateway_serialize_seconds', 'Time to serialize a JSON response body')
+
+# Upstream HTTP calls
+UPSTREAM_CONNECT_SECONDS = Histogram('gateway_upstream_connect_seconds',
+                                     'Time to open a new upstream connection, TLS included', ('host',))
+UPSTREAM_TTFB_SECONDS = Histogram('gateway_upstream_ttfb_seconds',
+                                  'Time from sending an upstream request to its response headers', ('host',))
+UPSTREAM_SECONDS = Histogram('gateway_upstream_duration_seconds',
+                             'Time for a whole upstream call (headers only for streamed calls)', ('host',))
+
+# Vendors and tools
+VENDOR_SECONDS = Histogram('gateway_vendor_attempt_duration_seconds',
+                           'Time for one router attempt at a vendor', ('vendor', 'result'))
+TOOL_SECONDS = Histogram('gateway_tool_duration_seconds', 'Time to run a tool (cache hits excluded)', ('tool',))
+INJECTED_FAULTS = Counter('gateway_injected_faults_total', 'Simulated vendor failures', ('vendor', 'fault'))
+RATE_LIMITED = Counter('gateway_vendor_rate_limited_total', '429 responses sent by vendors', ('vendor',))
+TOKENS = Counter('gateway_tokens_total', 'Tokens reported in vendor usage', ('vendor', 'direction'))
+
+# Admission control
+SHED = Counter('gateway_shed_total', 'Requests turned away by the concurrency limiter', ('route', 'reason'))
+ADMISSION_WAIT_SECONDS = Histogram('gateway_admission_wait_seconds',
+                                   'Time a request waited in a route\'s admission queue', ('route',))
+
+# Router retry queue (ratelimit.py)
+RETRY_QUEUE = Counter('gateway_retry_queue_total',
+                      'Routed requests that waited to retry, or were shed instead, by outcome', ('outcome',))
+RETRY_QUEUE_DEPTH = Gauge('gateway_retry_queue_depth', 'Routed requests waiting to retry')
+
+
+def record_tokens(vendor, input_tokens, output_tokens):
+    TOKENS.inc(vendor, 'input', amount=input_tokens)
+    TOKENS.inc(vendor, 'output', amount=output_tokens)
+
+
+def snapshot():
+    return {metric.name: metric.snapshot() for metric in _registry}
+
+
+def merge(snapshots):
+    """Sum snapshots from several workers into one"""
+    merged = {}
+    for snap in snapshots:
+        for name, metric in snap.items():
+            target = merged.get(name)
+            if target is None:
+                target = merged[name] = dict(metric, series={})
+            for labels, value in metric['series']:
+                key = tuple(labels)
+                current = target['series'].get(key)
+                if current is None:
+                    target['series'][key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    target['series'][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target['series'][key] = current + value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(merged):
+    """Prometheus text exposition for merged snapshots"""
+    lines = []
+    for name, metric in merged.items():
+        lines.append(f'# HELP {name} {metric["help"]}')
+        lines.append(f'# TYPE {name} {metric["type"]}')
+        names = metric['labels']
+        for labels, value in sorted(metric['series'].items()):
+            if metric['type'] != 'histogram':
+                lines.append(f'{name}{_labels(names, labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(metric['buckets'] + ['+Inf'], value[:-1]):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(float(bound))
+                bucket_labels = _labels(names, labels, f'le="{le}"')
+                lines.append(f'{name}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{name}_sum{_labels(names, labels)} {_number(float(value[-1]))}')
+            lines.append(f'{name}_count{_labels(names, labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_dir():
+    return os.getenv('METRICS_DIR') or None
+
+
+def flush():
+    """Write this worker's snapshot to METRICS_DIR (atomically)"""
+    directory = metrics_dir()
+    if not directory:
+        return
+    snap = snapshot()
+    if not any(metric['series'] for metric in snap.values()):
+        return
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'metrics-{os.getpid()}.json')
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(snap, f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def clear_snapshots():
+    """Remove every worker's snapshot from METRICS_DIR"""
+    directory = metrics_dir()
+    if not directory or not os.path.isdir(directory):
+        return
+    for filename in os.listdir(directory):
+        if filename.startswith('metrics-') and filename.endswith(('.json', '.json.tmp')):
+            try:
+                os.remove(os.path.join(directory, filename))
+            except OSError:
+                pass
+
+
+def _read_snapshots(directory):
+    snapshots = []
+    for filename in os.listdir(directory):
+        if not (filename.startswith('metrics-') and filename.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            # Removed or half-written by another process; the next scrape gets it
+            continue
+    return snapshots
+
+
+def collect():
+    """Metrics for every worker when METRICS_DIR is set, else for this one"""
+    directory = metrics_dir()
+    if not directory:
+        return merge([snapshot()])
+    flush()
+    if not os.path.isdir(directory):
+        return merge([snapshot()])
+    return merge(_read_snapshots(directory))
+
+
+def exposition():
+    return render(collect())
+
+
+def _flush_quietly():
+    try:
+        flush()
+    except OSError:
+        pass
+
+
+def _flush_on_exit():
+    # An exited worker's snapshot is kept, so it must not leave its gauges up
+    for metric in _registry:
+        if isinstance(metric, Gauge):
+            metric.zero()
+    _flush_quietly()
+
+
+def _flush_loop():
+    interval = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+    while True:
+        time.sleep(interval)
+        _flush_quietly()
+
+
+def start_flusher():
+    """Flush this worker's snapshot in the background when METRICS_DIR is set"""
+    global _flusher_started
+    if _flusher_started or not metrics_dir():
+        return
+    _flusher_started = True
+    threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+
+
+def _after_fork():
+    # A forked worker starts from zero (its snapshot file is new) with its own flusher
+    global _flusher_started
+    for metric in _registry:
+        metric.reset()
+    _flusher_started = False
+    start_flusher()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+# A worker's last numbers survive it
+atexit.register(_flush_on_exit)
@@ -0,0 +1,60 @@
+"""Request body limits.
+
+Every request body is capped at BODY_MAX_BYTES, with per-route overrides in
+BODY_MAX_BYTES_OVERRIDES (``"/v1/batch=16777216"``). When a request's
+Content-Length is over the cap, the request gets a 413 before any of the body
+is read or any admission slot is taken. A chunked body with no length is read
+only up to the cap. The body is then parsed once with jsoncodec. A ``tools``
+array longer than BODY_MAX_TOOLS gets a 400 before any handler sees it;
+OpenAI's own limit is 128 tools.
+
+Most of the memory a large request needs comes after parsing, in what the
+gateway does with the prompt. tokenizer.py and rules.py scan long prompts in
+bounded chunks instead of lowercasing or splitting the whole text.
+requestlog.py keeps only the size of a body over REQUEST_LOG_MAX_BODY_BYTES.
+"""
+import os
+
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+
+
+def _overrides():
+    """Parse BODY_MAX_BYTES_OVERRIDES ("/v1/batch=16777216,/vendor-o/messages=1048576")"""
+    overrides = {}
+    for item in os.getenv('BODY_MAX_BYTES_OVERRIDES', '').split(','):
+        route, _, value = item.partition('=')
+        if route.strip() and value.strip():
+            overrides[route.strip()] = int(value)
+    return overrides
+
+
+def max_bytes(route):
+    """Largest body accepted on ``route``, in bytes"""
+    override = _overrides().get(route)
+    if override is not None:
+        return override
+    return int(os.getenv('BODY_MAX_BYTES', str(DEFAULT_MAX_BYTES)))
+
+
+def max_tools():
+    return int(os.getenv('BODY_MAX_TOOLS', '128'))
+
+
+def too_large(limit):
+    """The (body, status) of a 413 for a body over ``limit`` bytes"""
+    return {'error': 'Request body too large', 'maxBytes': limit}, 413
+
+
+# An unread body is not worth draining from a keep-alive connection
+CLOSE_HEADERS = {'Connection': 'close'}
+
+
+def check(data):
+    """The (body, status) of a 400 if a parsed body breaks a structural limit, else None"""
+    if not isinstance(data, dict):
+        return None
+    request_tools = data.get('tools')
+    limit = max_tools()
+    if isinstance(request_tools, list) and len(request_tools) > limit:
+        return {'error': f"Too many tools: {len(request_tools)} given, at most {limit} accepted"}, 400
+    return None
@@ -0,0 +1,269 @@
+"""Gateway-side rate limiting for routed requests.
+
+Each vendor and each API client gets a token bucket. A vendor that answers
+429 is blocked for its ``retryAfterMs`` (or ``Retry-After``) and its rate is
+halved, then earns the rate back one success at a time. Requests that cannot
+be served right now wait in a bounded retry queue with jittered exponential
+backoff, but never past their deadline: a request that cannot finish in time
+is shed at once with a 429 and a Retry-After hint instead of waiting for
+nothing.
+
+All limits are per worker.
+"""
+import math
+import os
+import random
+import threading
+import time
+
+import metrics
+
+_vendor_buckets = {}
+_client_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def _env_float(name, default):
+    return float(os.getenv(name, default))
+
+
+def _rate_overrides():
+    """Parse RATE_LIMIT_VENDOR_RPS_OVERRIDES ("vendor-b=5,vendor-o=20")"""
+    overrides = {}
+    for item in os.getenv('RATE_LIMIT_VENDOR_RPS_OVERRIDES', '').split(','):
+        name, _, value = item.partition('=')
+        if name.strip() and value.strip():
+            overrides[name.strip()] = float(value)
+    return overrides
+
+
+class TokenBucket:
+    """Token bucket that can also be blocked outright for a Retry-After period.
+
+    A rate of 0 means unlimited; the bucket then only enforces blocks.
+    """
+
+    def __init__(self, rate, burst):
+        self.base_rate = rate
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.throttled = 0
+        self.limited = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Take a token; returns 0, or the seconds to wait before one is available"""
+        now = time.monotonic()
+        with self._lock:
+            if self.blocked_until > now:
+                self.throttled += 1
+                return self.blocked_until - now
+            if self.rate <= 0:
+                return 0.0
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            self.throttled += 1
+            return (1 - self.tokens) / self.rate
+
+    def wait_time(self):
+        """Seconds until acquire() could succeed, without taking anything"""
+        now = time.monotonic()
+        with self._lock:
+            if self.blocked_until > now:
+                return self.blocked_until - now
+            if self.rate <= 0:
+                return 0.0
+            self._refill(now)
+            return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def limited_for(self, seconds):
+        """The vendor said 429: block for ``seconds`` and back off the rate"""
+        now = time.monotonic()
+        with self._lock:
+            self.limited += 1
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            self.tokens = 0.0
+            self.updated = now
+            if self.base_rate > 0:
+                self.rate = max(self.rate / 2, self.base_rate / 16)
+
+    def succeeded(self):
+        with self._lock:
+            if self.base_rate > 0 and self.rate < self.base_rate:
+                self.rate = min(self.base_rate, self.rate + self.base_rate / 10)
+
+    def snapshot(self):
+        wait = self.wait_time()
+        return {
+            'rate': self.rate,
+            'base_rate': self.base_rate,
+            'tokens': round(self.tokens, 2) if self.rate > 0 else None,
+            'blocked_ms': int(max(self.blocked_until - time.monotonic(), 0) * 1000),
+            'wait_ms': int(wait * 1000),
+            'throttled': self.throttled,
+            'rate_limited': self.limited,
+        }
+
+
+def vendor_bucket(name):
+    bucket = _vendor_buckets.get(name)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _vendor_buckets.get(name)
+            if bucket is None:
+                rate = _rate_overrides().get(name, _env_float('RATE_LIMIT_VENDOR_RPS', '0'))
+                burst = _env_float('RATE_LIMIT_VENDOR_BURST', str(max(rate, 1)))
+                bucket = _vendor_buckets[name] = TokenBucket(rate, burst)
+    return bucket
+
+
+def client_bucket(client):
+    """Bucket for an API client, or None when per-client limits are off"""
+    rate = _env_float('RATE_LIMIT_CLIENT_RPS', '0')
+    if rate <= 0 or not client:
+        return None
+    bucket = _client_buckets.get(client)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _client_buckets.get(client)
+            if bucket is None:
+                if len(_client_buckets) >= int(os.getenv('RATE_LIMIT_MAX_CLIENTS', '10000')):
+                    # Drop the oldest client rather than grow without bound
+                    _client_buckets.pop(next(iter(_client_buckets)))
+                burst = _env_float('RATE_LIMIT_CLIENT_BURST', str(max(rate, 1)))
+                bucket = _client_buckets[client] = TokenBucket(rate, burst)
+    return bucket
+
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delta-seconds form), or None"""
+    try:
+        return max(float(value), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after_seconds(body, headers=None):
+    """Learn the wait a 429 asks for, from retryAfterMs or Retry-After"""
+    if isinstance(body, dict) and body.get('retryAfterMs') is not None:
+        try:
+            return max(float(body['retryAfterMs']) / 1000, 0)
+        except (TypeError, ValueError):
+            pass
+    seconds = parse_retry_after((headers or {}).get('Retry-After'))
+    if seconds is not None:
+        return seconds
+    return _env_float('RATE_LIMIT_DEFAULT_BACKOFF_MS', '1000') / 1000
+
+
+def vendor_limited(name, body=None, headers=None):
+    vendor_bucket(name).limited_for(retry_after_seconds(body, headers))
+
+
+def vendor_succeeded(name):
+    vendor_bucket(name).succeeded()
+
+
+class RetryQueue:
+    """Counts requests waiting to retry; full means new waiters are shed"""
+
+    def __init__(self):
+        self.depth = 0
+        self.peak = 0
+        self.stats = {'queued': 0, 'retried': 0, 'shed_queue_full': 0, 'shed_deadline': 0}
+        self._lock = threading.Lock()
+
+    def capacity(self):
+        return int(os.getenv('RATE_LIMIT_QUEUE_SIZE', '256'))
+
+    def enter(self):
+        with self._lock:
+            if self.depth >= self.capacity():
+                self._count('shed_queue_full')
+                return False
+            self.depth += 1
+            self.peak = max(self.peak, self.depth)
+            self._count('queued')
+            metrics.RETRY_QUEUE_DEPTH.set(self.depth)
+            return True
+
+    def leave(self, retried=True):
+        with self._lock:
+            self.depth -= 1
+            if retried:
+                self._count('retried')
+            metrics.RETRY_QUEUE_DEPTH.set(self.depth)
+
+    def shed_deadline(self):
+        with self._lock:
+            self._count('shed_deadline')
+
+    def _count(self, name):
+        # Called under the lock; also exported on /metrics
+        self.stats[name] += 1
+        metrics.RETRY_QUEUE.inc(name)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, depth=self.depth, peak_depth=self.peak, capacity=self.capacity())
+
+
+queue = RetryQueue()
+
+
+def backoff_delay(attempt, hint=0.0):
+    """Jittered exponential backoff, never shorter than the server's hint"""
+    base = _env_float('RATE_LIMIT_BACKOFF_BASE_MS', '100') / 1000
+    cap = _env_float('RATE_LIMIT_BACKOFF_MAX_MS', '5000') / 1000
+    return hint + random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def plan_wait(delay, deadline):
+    """Return True if waiting ``delay`` seconds still leaves time before ``deadline``"""
+    if time.monotonic() + delay >= deadline:
+        queue.shed_deadline()
+        return False
+    return True
+
+
+def max_retries():
+    return int(os.getenv('RATE_LIMIT_MAX_RETRIES', '5'))
+
+
+def shed_response(wait_seconds, attempts=None, reason='Rate limit exceeded'):
+    """429 body for a request the gateway gave up on; retryAfterMs as vendor-b sends it"""
+    body = {'error': reason, 'retryAfterMs': int(math.ceil(max(wait_seconds, 0) * 1000))}
+    if attempts is not None:
+        body['attempts'] = attempts
+    return body, 429
+
+
+def retry_after_headers(body, status):
+    """Retry-After header for a 429 body carrying retryAfterMs"""
+    if status == 429 and isinstance(body, dict) and body.get('retryAfterMs') is not None:
+        return {'Retry-After': str(int(math.ceil(body['retryAfterMs'] / 1000)))}
+    return None
+
+
+def limiter_stats():
+    with _buckets_lock:
+        vendors = dict(_vendor_buckets)
+        clients = dict(_client_buckets)
+    return {
+        'queue': queue.snapshot(),
+        'vendors': {name: bucket.snapshot() for name, bucket in vendors.items()},
+        'clients': {
+            'tracked': len(clients),
+            'throttled': sum(bucket.throttled for bucket in clients.values()),
+        },
+    }
@@ -0,0 +1,435 @@
+"""Structured log of gateway requests and responses, with a query API.
+
+Every POST to a gateway endpoint becomes one JSON line: time, route, vendor,
+status, latency, tokens, tool calls and both bodies. Request threads only
+append raw bodies to an in-memory queue; a background thread wakes every
+REQUEST_LOG_FLUSH_INTERVAL seconds, builds the lines and appends them with
+one write. When the file passes REQUEST_LOG_MAX_BYTES it is rotated
+(``requests.jsonl`` -> ``requests.jsonl.1`` ...), keeping
+REQUEST_LOG_BACKUPS old files. Workers may share one log: each write is a
+single O_APPEND call and rotation is done under a file lock.
+
+Queries read the files through a sparse index: one entry per block of lines
+with the block's time range, vendors and statuses. The index is built by
+scanning a file once and extended as it grows, so a query only reads the
+blocks that can match, newest first.
+"""
+import atexit
+import base64
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+
+DEFAULT_PATH = os.path.join('logs', 'requests.jsonl')
+
+# Lines per index block; a query reads whole blocks
+BLOCK_LINES = 256
+
+_queue = deque()
+_dropped = 0
+_written = 0
+_writer_started = False
+_writer_lock = threading.Lock()
+_start_lock = threading.Lock()
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def log_path():
+    return os.getenv('REQUEST_LOG_PATH') or DEFAULT_PATH
+
+
+def enabled():
+    return os.getenv('REQUEST_LOG_ENABLED', '1') != '0'
+
+
+def record(method, path, status, latency, request_body, response_body, client=None, stream=False):
+    """Queue one request for the log; never blocks on disk.
+
+    Bodies may be raw JSON bytes, already-parsed objects or None; decoding
+    and summarizing happen on the writer thread.
+    """
+    global _dropped
+    if not enabled():
+        return
+    if len(_queue) >= int(os.getenv('REQUEST_LOG_QUEUE_SIZE', '10000')):
+        _dropped += 1
+        return
+    if not _writer_started:
+        _start_writer()
+    _queue.append((time.time() - latency, method, path, status, latency, _bounded(request_body),
+                   _bounded(response_body), client, stream))
+
+
+def max_body_bytes():
+    return int(os.getenv('REQUEST_LOG_MAX_BODY_BYTES', str(64 * 1024)))
+
+
+def _bounded(body):
+    """A raw body over REQUEST_LOG_MAX_BODY_BYTES, as its size only, so the queue doesn't keep it alive"""
+    if isinstance(body, (bytes, bytearray)) and len(body) > max_body_bytes():
+        return {'omitted': True, 'bytes': len(body)}
+    return body
+
+
+def _decode(body):
+    if isinstance(body, (bytes, bytearray)):
+        if not body:
+            return None
+        try:
+            return json.loads(body)
+        except ValueError:
+            return body.decode('utf-8', 'replace')
+    return body
+
+
+def _usage(body):
+    """(tokens_in, tokens_out) from any vendor's response format"""
+    if not isinstance(body, dict):
+        return None, None
+    if 'tokensIn' in body:
+        return body.get('tokensIn'), body.get('tokensOut')
+    usage = body.get('usage')
+    if isinstance(usage, dict):
+        if 'prompt_tokens' in usage:
+            return usage.get('prompt_tokens'), usage.get('completion_tokens')
+        return usage.get('input_tokens'), usage.get('output_tokens')
+    return None, None
+
+
+def _tool_calls(body):
+    if not isinstance(body, dict):
+        return []
+    calls = body.get('tool_calls')
+    if calls is None:
+        try:
+            calls = body['choices'][0]['message'].get('tool_calls')
+        except (KeyError, IndexError, TypeError, AttributeError):
+            calls = None
+    names = []
+    for call in calls or []:
+        try:
+            names.append(call['function']['name'])
+        except (KeyError, TypeError):
+            continue
+    return names
+
+
+def _vendor(path, body):
+    parts = path.strip('/').split('/')
+    if parts and parts[0].startswith('vendor-'):
+        return parts[0]
+    if isinstance(body, dict) and isinstance(body.get('vendor'), str):
+        return body['vendor']
+    return None
+
+
+def build_entry(queued):
+    started, method, path, status, latency, request_body, response_body, client, stream = queued
+    request_json = _decode(request_body)
+    response_json = _decode(response_body)
+    tokens_in, tokens_out = _usage(response_json)
+    return {
+        'id': uuid.uuid4().hex[:12],
+        'ts': round(started, 6),
+        'time': datetime.fromtimestamp(started, timezone.utc).isoformat(timespec='milliseconds'),
+        'method': method,
+        'path': path,
+        'vendor': _vendor(path, response_json),
+        'status': status,
+        'latency_ms': round(latency * 1000, 2),
+        'tokens_in': tokens_in,
+        'tokens_out': tokens_out,
+        'tool_calls': _tool_calls(response_json),
+        'client': client,
+        'stream': stream,
+        'request': request_json,
+        'response': response_json,
+    }
+
+
+def max_bytes():
+    return int(os.getenv('REQUEST_LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+
+
+def _backups():
+    return max(int(os.getenv('REQUEST_LOG_BACKUPS', '5')), 0)
+
+
+def log_files():
+    """The log and its rotated files that exist, newest first"""
+    path = log_path()
+    candidates = [path] + [f'{path}.{n}' for n in range(1, _backups() + 1)]
+    return [candidate for candidate in candidates if os.path.exists(candidate)]
+
+
+def _rotate(path):
+    """Shift path -> path.1 -> ... under a lock, unless another worker just did"""
+    with open(f'{path}.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.path.getsize(path) < max_bytes():
+                return
+            backups = _backups()
+            if backups == 0:
+                os.remove(path)
+                return
+            for n in range(backups - 1, 0, -1):
+                if os.path.exists(f'{path}.{n}'):
+                    os.replace(f'{path}.{n}', f'{path}.{n + 1}')
+            os.replace(path, f'{path}.1')
+        except FileNotFoundError:
+            pass
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def flush():
+    """Write everything queued so far; returns the number of lines written"""
+    global _written
+    with _writer_lock:
+        batch = []
+        while _queue:
+            batch.append(_queue.popleft())
+        if not batch:
+            return 0
+        data = ''.join(json.dumps(build_entry(item), separators=(',', ':'), default=str) + '\n'
+                       for item in batch).encode()
+        path = log_path()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+            size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+        _written += len(batch)
+        if size >= max_bytes():
+            _rotate(path)
+        return len(batch)
+
+
+def _flush_quietly():
+    try:
+        flush()
+    except OSError:
+        pass
+
+
+def _writer_loop():
+    interval = float(os.getenv('REQUEST_LOG_FLUSH_INTERVAL', '0.5'))
+    while True:
+        time.sleep(interval)
+        _flush_quietly()
+
+
+def _start_writer():
+    global _writer_started
+    with _start_lock:
+        if _writer_started:
+            return
+        _writer_started = True
+    threading.Thread(target=_writer_loop, name='request-log', daemon=True).start()
+
+
+def _after_fork():
+    # The parent's queue and writer thread belong to the parent
+    global _writer_started, _writer_lock, _start_lock
+    _queue.clear()
+    _writer_started = False
+    _writer_lock = threading.Lock()
+    _start_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+atexit.register(_flush_quietly)
+
+
+class FileIndex:
+    """Sparse index of one log file: (start, end, min_ts, max_ts, vendors, statuses) per block"""
+
+    def __init__(self):
+        self.blocks = []
+        self.scanned = 0
+
+    def update(self, path):
+        """Index lines appended since the last update"""
+        with open(path, 'rb') as f:
+            f.seek(self.scanned)
+            block = None
+            offset = self.scanned
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Partially written; index it next time
+                    break
+                end = offset + len(line)
+                try:
+                    entry = json.loads(line)
+                    ts, vendor, status = entry['ts'], entry.get('vendor'), entry.get('status')
+                except (ValueError, KeyError, TypeError):
+                    offset = end
+                    continue
+                if block is None:
+                    block = [offset, end, ts, ts, set(), set(), 0]
+                block[1] = end
+                block[2] = min(block[2], ts)
+                block[3] = max(block[3], ts)
+                block[4].add(vendor)
+                block[5].add(status)
+                block[6] += 1
+                if block[6] >= BLOCK_LINES:
+                    self.blocks.append(tuple(block[:6]))
+                    block = None
+                offset = end
+            if block is not None:
+                self.blocks.append(tuple(block[:6]))
+            self.scanned = offset
+
+
+def _file_index(path):
+    """Index for ``path``, keyed by inode so it survives rotation"""
+    stat = os.stat(path)
+    key = (stat.st_dev, stat.st_ino)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None or stat.st_size < index.scanned:
+            index = _indexes[key] = FileIndex()
+        if stat.st_size > index.scanned:
+            index.update(path)
+        return key, index
+
+
+def _forget_missing(live_keys):
+    with _indexes_lock:
+        for key in list(_indexes):
+            if key not in live_keys:
+                del _indexes[key]
+
+
+def parse_time(value):
+    """Epoch seconds or an ISO 8601 timestamp (UTC if no offset), or None"""
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def encode_cursor(key, offset):
+    raw = f'{key[0]}:{key[1]}:{offset}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        dev, ino, offset = (int(part) for part in raw.split(':'))
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+    return (dev, ino), offset
+
+
+def _read_block(f, start, end):
+    """Yield (offset, line) for a block's lines, last line first"""
+    f.seek(start)
+    data = f.read(end - start)
+    lines = []
+    offset = start
+    for line in data.splitlines(keepends=True):
+        lines.append((offset, line))
+        offset += len(line)
+    return reversed(lines)
+
+
+def _status_matcher(status):
+    """Predicate for a status filter: an exact code or a class like ``5xx``"""
+    if status is None:
+        return None
+    status = str(status).lower()
+    if len(status) == 3 and status.endswith('xx'):
+        status_class = int(status[0])
+        return lambda value: isinstance(value, int) and value // 100 == status_class
+    code = int(status)
+    return lambda value: value == code
+
+
+def query(start=None, end=None, vendor=None, status=None, limit=50, cursor=None):
+    """Entries matching the filters, newest first, and a cursor for the next page.
+
+    ``start``/``end`` are epoch seconds (end exclusive); ``status`` is an
+    exact code or a class like ``5xx``.
+    """
+    match_status = _status_matcher(status)
+    after = decode_cursor(cursor) if cursor else None
+    entries = []
+    live_keys = set()
+    for path in log_files():
+        try:
+            key, index = _file_index(path)
+        except FileNotFoundError:
+            # Rotated away between listing and opening
+            continue
+        live_keys.add(key)
+        if after is not None and key != after[0]:
+            # Still looking for the file the cursor points into
+            continue
+        stop_at = after[1] if after is not None else None
+        after = None
+        with open(path, 'rb') as f:
+            for block_start, block_end, min_ts, max_ts, vendors, statuses in reversed(index.blocks):
+                if stop_at is not None and block_start >= stop_at:
+                    continue
+                if start is not None and max_ts < start:
+                    continue
+                if end is not None and min_ts >= end:
+                    continue
+                if vendor is not None and vendor not in vendors:
+                    continue
+                if match_status is not None and not any(match_status(value) for value in statuses):
+                    continue
+                for offset, line in _read_block(f, block_start, block_end):
+                    if stop_at is not None and offset >= stop_at:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    ts = entry.get('ts', 0)
+                    if start is not None and ts < start:
+                        continue
+                    if end is not None and ts >= end:
+                        continue
+                    if vendor is not None and entry.get('vendor') != vendor:
+                        continue
+                    if match_status is not None and not match_status(entry.get('status')):
+                        continue
+                    entries.append(entry)
+                    if len(entries) >= limit:
+                        return entries, encode_cursor(key, offset)
+    if after is None:
+        _forget_missing(live_keys)
+    return entries, None
+
+
+def log_stats():
+    files = log_files()
+    return {
+        'enabled': enabled(),
+        'path': log_path(),
+        'queued': len(_queue),
+        'written': _written,
+        'dropped': _dropped,
+        'files': [{'path': path, 'bytes': os.path.getsize(path)} for path in files],
+        'indexed_blocks': sum(len(index.blocks) for index in list(_indexes.values())),
+    }
@@ -0,0 +1,592 @@
+"""Latency-aware vendor router behind /v1/messages.
+
+Vendors register a backend that takes the normalized request and returns
+their native (body, status), plus a function that maps that body to the
+router's response shape. For every request the router ranks the vendors by
+their recent latency and error rate, sends the request to the best one, and
+
+- fails over to the next vendor when an attempt returns 5xx or 429, and
+- sends a hedged request to the next vendor when the attempt in flight has
+  run past that vendor's p95 latency, then cancels whichever loses.
+
+Vendors and clients are rate limited through ``ratelimit``: a vendor that
+answered 429 is skipped until its retryAfterMs has passed, and when no
+vendor can take the request it waits in the retry queue and tries another
+round, as long as the request's deadline allows.
+
+Flask drives attempts on a per-worker thread pool and cancels through a
+threading.Event the backend waits on; ASGI mode runs them as tasks and
+cancels the losing task.
+"""
+import asyncio
+import contextvars
+import ipaddress
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+
+import metrics
+import ratelimit
+
+_vendors = {}
+_totals = {'routed': 0, 'failovers': 0, 'hedges': 0, 'hedge_wins': 0, 'exhausted': 0, 'timeouts': 0}
+_totals_lock = threading.Lock()
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+CANCELLED = ({'error': 'Cancelled'}, 499)
+
+
+def _env_float(name, default):
+    return float(os.getenv(name, default))
+
+
+def _count(name):
+    with _totals_lock:
+        _totals[name] += 1
+
+
+class VendorStats:
+    """Rolling window of recent attempt latencies and outcomes for one vendor"""
+
+    def __init__(self, window):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.counters = {'attempts': 0, 'errors': 0, 'rate_limited': 0, 'cancelled': 0, 'wins': 0}
+
+    def record(self, latency, ok, status=None):
+        with self._lock:
+            self._samples.append((latency, ok))
+            self.counters['attempts'] += 1
+            if not ok:
+                self.counters['errors'] += 1
+            if status == 429:
+                self.counters['rate_limited'] += 1
+
+    def record_cancelled(self, elapsed):
+        # A cancelled attempt was at least this slow: keep it as a latency
+        # sample so a vendor that stalls is not remembered as fast
+        with self._lock:
+            self._samples.append((elapsed, True))
+            self.counters['cancelled'] += 1
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def summary(self):
+        """Return (samples, error_rate, mean_latency, sorted_latencies)"""
+        with self._lock:
+            samples = list(self._samples)
+        if not samples:
+            return 0, 0.0, 0.0, []
+        latencies = sorted(latency for latency, ok in samples if ok)
+        error_rate = 1 - len(latencies) / len(samples)
+        mean = sum(latencies) / len(latencies) if latencies else 0.0
+        return len(samples), error_rate, mean, latencies
+
+
+def _percentile(sorted_values, percentile):
+    if not sorted_values:
+        return None
+    index = min(int(len(sorted_values) * percentile / 100), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class Vendor:
+    def __init__(self, name, call, normalize):
+        self.name = name
+        self.call = call
+        self.acall = None
+        self.normalize = normalize
+        self.stats = VendorStats(int(os.getenv('ROUTER_WINDOW', '100')))
+
+    def score(self):
+        """Expected cost of sending a request here; vendors with few samples go first"""
+        samples, error_rate, mean, _ = self.stats.summary()
+        if samples < int(os.getenv('ROUTER_MIN_SAMPLES', '5')):
+            return -1.0
+        return mean / max(1 - error_rate, 0.1)
+
+    def hedge_delay(self):
+        """Seconds to wait on this vendor before hedging: its p95, clamped"""
+        low = _env_float('ROUTER_HEDGE_MIN_MS', '20') / 1000
+        high = _env_float('ROUTER_HEDGE_MAX_MS', '1000') / 1000
+        samples, _, _, latencies = self.stats.summary()
+        p95 = _percentile(latencies, _env_float('ROUTER_HEDGE_PERCENTILE', '95'))
+        if samples < int(os.getenv('ROUTER_MIN_SAMPLES', '5')) or p95 is None:
+            return high
+        return min(max(p95, low), high)
+
+    def snapshot(self):
+        samples, error_rate, mean, latencies = self.stats.summary()
+        p50 = _percentile(latencies, 50)
+        p95 = _percentile(latencies, 95)
+        return dict(
+            self.stats.counters,
+            samples=samples,
+            error_rate=round(error_rate, 4),
+            mean_ms=round(mean * 1000, 2),
+            p50_ms=round(p50 * 1000, 2) if p50 is not None else None,
+            p95_ms=round(p95 * 1000, 2) if p95 is not None else None,
+            hedge_delay_ms=round(self.hedge_delay() * 1000, 2),
+        )
+
+
+def register_vendor(name, normalize):
+    """Decorator registering a sync backend ``fn(data, cancel) -> (body, status)``.
+
+    ``cancel`` is a threading.Event set when the attempt loses; backends
+    should wait on it instead of sleeping. ``normalize(data, body)`` returns
+    (content, usage) for a successful body.
+    """
+    def decorator(call):
+        _vendors[name] = Vendor(name, call, normalize)
+        return call
+    return decorator
+
+
+def async_backend(name):
+    """Decorator attaching a coroutine backend ``fn(data) -> (body, status)`` (ASGI mode)"""
+    def decorator(call):
+        _vendors[name].acall = call
+        return call
+    return decorator
+
+
+def get_vendor(name):
+    return _vendors.get(name)
+
+
+def default_vendors():
+    names = os.getenv('ROUTER_VENDORS', 'vendor-a,vendor-b,vendor-e')
+    return [name.strip() for name in names.split(',') if name.strip() in _vendors]
+
+
+def retryable(status):
+    return status == 429 or status >= 500
+
+
+class Attempt:
+    def __init__(self, vendor, hedge):
+        self.vendor = vendor
+        self.hedge = hedge
+        self.started = time.monotonic()
+        self.cancel = threading.Event()
+        self.status = None
+        self.result = None
+        self.latency = None
+
+    def to_dict(self):
+        return {
+            'vendor': self.vendor.name,
+            'status': self.status,
+            'result': self.result,
+            'hedge': self.hedge,
+            'latency_ms': int(self.latency * 1000) if self.latency is not None else None,
+        }
+
+
+def _rate_limited(attempts):
+    return any(attempt.status == 429 or attempt.result == 'throttled' for attempt in attempts)
+
+
+class Route:
+    """State of one routed request, shared by the sync and async drivers"""
+
+    def __init__(self, data, timeout=None):
+        if not isinstance(data, dict):
+            raise ValueError('Body must be a JSON object')
+        self.data = {key: value for key, value in data.items() if key not in ROUTER_FIELDS}
+        self.started = time.monotonic()
+        self.deadline = self.started + request_timeout(data, timeout)
+        self.hedging = data.get('hedge', True) is not False
+        self.attempts = []
+        self.in_flight = []
+        self.rounds = 0
+        self.round_start = 0
+
+        requested = data.get('vendors')
+        if requested is not None:
+            if not isinstance(requested, list) or not all(isinstance(name, str) for name in requested):
+                raise ValueError('vendors must be a list of vendor names')
+            unknown = [name for name in requested if name not in _vendors]
+            if unknown:
+                raise ValueError(f"Unknown vendors: {', '.join(map(str, unknown))}")
+            # An explicit list is tried in the order given
+            self.ranked = False
+            self.candidates = [_vendors[name] for name in requested]
+        else:
+            self.ranked = True
+            self.candidates = [_vendors[name] for name in default_vendors()]
+        if not self.candidates:
+            raise ValueError('No vendors to route to')
+        self.remaining = self.ordered()
+        _count('routed')
+
+    def ordered(self):
+        if not self.ranked:
+            return list(self.candidates)
+        vendors = sorted(self.candidates, key=Vendor.score)
+        explore_rate = _env_float('ROUTER_EXPLORE_RATE', '0.05')
+        if len(vendors) > 1 and random.random() < explore_rate:
+            # Occasionally lead with another vendor so its stats stay fresh
+            vendors.insert(0, vendors.pop(random.randrange(1, len(vendors))))
+        return vendors
+
+    def start(self, hedge=False):
+        """Start an attempt on the next vendor with rate limit headroom, or return None"""
+        while self.remaining:
+            vendor = self.remaining.pop(0)
+            attempt = Attempt(vendor, hedge)
+            self.attempts.append(attempt)
+            if ratelimit.vendor_bucket(vendor.name).acquire():
+                attempt.result = 'throttled'
+                continue
+            self.in_flight.append(attempt)
+            return attempt
+        return None
+
+    def can_hedge(self):
+        return self.hedging and self.remaining and len(self.in_flight) == 1
+
+    def wait_timeout(self):
+        """Seconds until the next hedge or the deadline, whichever is first"""
+        now = time.monotonic()
+        timeout = self.deadline - now
+        if self.can_hedge():
+            attempt = self.in_flight[0]
+            timeout = min(timeout, attempt.started + attempt.vendor.hedge_delay() - now)
+        return max(timeout, 0)
+
+    def expired(self):
+        return time.monotonic() >= self.deadline
+
+    def hedge(self):
+        """Start a hedged attempt if the one in flight is past its hedge delay"""
+        if not self.can_hedge():
+            return None
+        attempt = self.in_flight[0]
+        if time.monotonic() < attempt.started + attempt.vendor.hedge_delay():
+            return None
+        hedge = self.start(hedge=True)
+        if hedge is not None:
+            _count('hedges')
+        return hedge
+
+    def failover(self):
+        if self.in_flight or not self.remaining:
+            return None
+        attempt = self.start()
+        if attempt is not None:
+            _count('failovers')
+        return attempt
+
+    def retry_delay(self):
+        """Seconds to back off before another round, or None if there should be none.
+
+        Only a round that was rate limited (a 429, or a vendor throttled
+        here) is retried; vendors that failed outright would fail again.
+        """
+        if self.in_flight or self.rounds >= ratelimit.max_retries():
+            return None
+        if not _rate_limited(self.attempts[self.round_start:]):
+            return None
+        hint = min(ratelimit.vendor_bucket(vendor.name).wait_time() for vendor in self.candidates)
+        delay = ratelimit.backoff_delay(self.rounds, hint)
+        return delay if ratelimit.plan_wait(delay, self.deadline) else None
+
+    def next_round(self):
+        self.rounds += 1
+        self.round_start = len(self.attempts)
+        self.remaining = self.ordered()
+
+    def finish(self, attempt, body, status):
+        """Record a finished attempt; returns the response to send, or None to keep going"""
+        self.in_flight.remove(attempt)
+        attempt.latency = time.monotonic() - attempt.started
+        attempt.status = status
+        ok = status == 200
+        attempt.result = 'ok' if ok else 'error'
+        attempt.vendor.stats.record(attempt.latency, ok, status)
+        metrics.VENDOR_SECONDS.observe(attempt.latency, attempt.vendor.name,
+                                       attempt.result if status != 429 else 'rate_limited')
+        if ok:
+            ratelimit.vendor_succeeded(attempt.vendor.name)
+        elif status == 429:
+            ratelimit.vendor_limited(attempt.vendor.name, body)
+
+        if ok:
+            attempt.vendor.stats.count('wins')
+            if attempt.hedge:
+                _count('hedge_wins')
+            return self.success(attempt, body)
+        if not retryable(status):
+            # The request itself is bad; another vendor will not do better
+            return dict(body, vendor=attempt.vendor.name, attempts=self.attempt_log()), status
+        return None
+
+    def cancel_in_flight(self):
+        """Mark every attempt still running as cancelled and return them"""
+        cancelled = list(self.in_flight)
+        for attempt in cancelled:
+            attempt.latency = time.monotonic() - attempt.started
+            attempt.result = 'cancelled'
+            attempt.vendor.stats.record_cancelled(attempt.latency)
+            metrics.VENDOR_SECONDS.observe(attempt.latency, attempt.vendor.name, 'cancelled')
+            attempt.cancel.set()
+        self.in_flight.clear()
+        return cancelled
+
+    def success(self, attempt, body):
+        content, usage = attempt.vendor.normalize(self.data, body)
+        self.cancel_in_flight()
+        return {
+            'id': f"msg_{uuid.uuid4().hex[:12]}",
+            'vendor': attempt.vendor.name,
+            'content': content,
+            'usage': usage,
+            'latency_ms': int((time.monotonic() - self.started) * 1000),
+            'hedged': any(a.hedge for a in self.attempts),
+            'attempts': self.attempt_log(),
+        }, 200
+
+    def failure(self):
+        if self.in_flight:
+            self.cancel_in_flight()
+            _count('timeouts')
+            return {'error': 'Router timed out', 'attempts': self.attempt_log()}, 504
+        _count('exhausted')
+        if _rate_limited(self.attempts):
+            wait = min(ratelimit.vendor_bucket(vendor.name).wait_time() for vendor in self.candidates)
+            return ratelimit.shed_response(wait, self.attempt_log())
+        return {'error': 'All vendors failed', 'attempts': self.attempt_log()}, 502
+
+    def attempt_log(self):
+        return [attempt.to_dict() for attempt in self.attempts]
+
+
+ROUTER_FIELDS = ('vendors', 'hedge', 'stream', 'timeout_ms')
+
+
+def request_timeout(data, timeout=None):
+    """Seconds the request may take: ROUTER_TIMEOUT, capped by the client's own deadline
+
+    The deadline comes from ``timeout_ms`` in the body or the
+    X-Request-Timeout-Ms header (passed in as ``timeout``).
+    """
+    limit = _env_float('ROUTER_TIMEOUT', '30')
+    for value in (data.get('timeout_ms'), timeout):
+        try:
+            if value is not None and float(value) > 0:
+                limit = min(limit, float(value) / 1000)
+        except (TypeError, ValueError):
+            raise ValueError('timeout_ms must be a number of milliseconds')
+    return limit
+
+
+def client_key(client_id, authorization, remote_addr):
+    """Identify the API client for per-client limits (``remote_addr`` from client_address)"""
+    return client_id or authorization or remote_addr
+
+
+def _trusted_proxy(address):
+    """Whether ``address`` is a proxy whose forwarding headers are believed (TRUSTED_PROXIES)"""
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    networks = os.getenv('TRUSTED_PROXIES', 'private')
+    if networks == 'private':
+        # fly-proxy reaches the machine over Fly's private network
+        return ip.is_private
+    for network in networks.split(','):
+        try:
+            if network.strip() and ip in ipaddress.ip_network(network.strip(), strict=False):
+                return True
+        except ValueError:
+            continue
+    return False
+
+
+def client_address(remote_addr, get_header):
+    """The caller's address: Fly-Client-IP, else the first X-Forwarded-For hop, when a trusted proxy sent them"""
+    if remote_addr and _trusted_proxy(remote_addr):
+        forwarded = get_header('Fly-Client-IP') or (get_header('X-Forwarded-For') or '').split(',')[0].strip()
+        if forwarded:
+            return forwarded
+    return remote_addr
+
+
+def get_executor():
+    """Return this process's router thread pool (rebuilt after a fork)"""
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                workers = max(int(os.getenv('ROUTER_WORKERS', '32')), 1)
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='router')
+                _executor_pid = pid
+    return _executor
+
+
+def call_backend(vendor, data, cancel):
+    """Run one vendor backend; an exception becomes a 500 body"""
+    try:
+        return vendor.call(data, cancel)
+    except Exception as e:
+        return {'error': str(e), 'type': type(e).__name__}, 500
+
+
+async def acall_backend(vendor, data, cancel):
+    """Async counterpart of call_backend(); sync-only backends run in a worker thread"""
+    try:
+        if vendor.acall is None:
+            return await asyncio.to_thread(vendor.call, data, cancel)
+        return await vendor.acall(data)
+    except asyncio.CancelledError:
+        cancel.set()
+        raise
+    except Exception as e:
+        return {'error': str(e), 'type': type(e).__name__}, 500
+
+
+def _call(attempt, data):
+    return call_backend(attempt.vendor, data, attempt.cancel)
+
+
+async def _acall(attempt, data):
+    return await acall_backend(attempt.vendor, data, attempt.cancel)
+
+
+def _run_round(state, executor):
+    """Run attempts until one answers, the vendors run out or the deadline passes"""
+    futures = {}
+
+    def launch(attempt):
+        if attempt is not None:
+            # The backend runs with the request's context (its session caller)
+            futures[executor.submit(contextvars.copy_context().run, _call, attempt, state.data)] = attempt
+
+    launch(state.start())
+    while futures:
+        done, _ = wait_futures(futures, timeout=state.wait_timeout(), return_when=FIRST_COMPLETED)
+        if not done:
+            if state.expired():
+                return None
+            launch(state.hedge())
+            continue
+        for future in done:
+            response = state.finish(futures.pop(future), *future.result())
+            if response is not None:
+                # Losers see their cancel event; their threads wind down on their own
+                return response
+        launch(state.failover())
+    return None
+
+
+def route(data, client=None, timeout=None):
+    """Route a /v1/messages request; returns (body, status)"""
+    try:
+        state = Route(data, timeout)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    bucket = ratelimit.client_bucket(client)
+    wait = bucket.acquire() if bucket else 0
+    while wait:
+        if not ratelimit.plan_wait(wait, state.deadline) or not ratelimit.queue.enter():
+            return ratelimit.shed_response(wait, reason='Client rate limit exceeded')
+        try:
+            time.sleep(wait)
+        finally:
+            ratelimit.queue.leave(retried=False)
+        wait = bucket.acquire()
+
+    executor = get_executor()
+    while True:
+        response = _run_round(state, executor)
+        if response is not None:
+            return response
+        delay = state.retry_delay()
+        if delay is None or not ratelimit.queue.enter():
+            return state.failure()
+        try:
+            time.sleep(delay)
+        finally:
+            ratelimit.queue.leave()
+        state.next_round()
+
+
+async def _arun_round(state):
+    """Async counterpart of _run_round; losing attempts are cancelled as tasks"""
+    tasks = {}
+
+    def launch(attempt):
+        if attempt is not None:
+            tasks[asyncio.ensure_future(_acall(attempt, state.data))] = attempt
+
+    launch(state.start())
+    try:
+        while tasks:
+            done, _ = await asyncio.wait(tasks, timeout=state.wait_timeout(), return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                if state.expired():
+                    return None
+                launch(state.hedge())
+                continue
+            for task in done:
+                response = state.finish(tasks.pop(task), *task.result())
+                if response is not None:
+                    return response
+            launch(state.failover())
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def aroute(data, client=None, timeout=None):
+    """Async counterpart of route()"""
+    try:
+        state = Route(data, timeout)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    bucket = ratelimit.client_bucket(client)
+    wait = bucket.acquire() if bucket else 0
+    while wait:
+        if not ratelimit.plan_wait(wait, state.deadline) or not ratelimit.queue.enter():
+            return ratelimit.shed_response(wait, reason='Client rate limit exceeded')
+        try:
+            await asyncio.sleep(wait)
+        finally:
+            ratelimit.queue.leave(retried=False)
+        wait = bucket.acquire()
+
+    while True:
+        response = await _arun_round(state)
+        if response is not None:
+            return response
+        delay = state.retry_delay()
+        if delay is None or not ratelimit.queue.enter():
+            return state.failure()
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            ratelimit.queue.leave()
+        state.next_round()
+
+
+def router_stats():
+    with _totals_lock:
+        totals = dict(_totals)
+    return dict(totals, vendors={name: vendor.snapshot() for name, vendor in _vendors.items()})
@@ -0,0 +1,151 @@
+"""Prompt rules for the canned vendors: keyword responses and invoice IDs.
+
+Rules are read once from a JSON file (data/rules.json, or RULES_PATH) and
+compiled at startup. Rules are tried in file order and the first match
+wins, like the old if/elif chain. The prompt is lowercased once per request
+(``lower``) and shared by both rule sets. Keywords are plain substrings checked with
+``in`` (CPython's substring search scans at memory speed, several times
+faster than a combined regex). Invoice patterns are precompiled regexes
+with one capture group for the number, matched case-sensitively against
+the lowercased prompt so ``re`` can use its literal-prefix scan.
+
+A prompt longer than RULES_CHUNK_CHARS is not lowercased whole: it is
+scanned in chunks that overlap by CHUNK_OVERLAP characters, so a keyword or
+invoice reference cut by a chunk boundary is still seen in one piece, and
+only one chunk's lowercase copy exists at a time.
+"""
+import json
+import os
+import re
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'rules.json')
+
+# Longest keyword or invoice reference guaranteed to be found across a chunk boundary
+CHUNK_OVERLAP = 256
+
+_rules = None
+
+
+def chunk_chars():
+    return max(int(os.getenv('RULES_CHUNK_CHARS', '65536')), CHUNK_OVERLAP)
+
+
+def lower(prompt):
+    """``prompt`` lowercased for the rule sets: a str, or a LoweredText if it is long"""
+    if len(prompt) <= chunk_chars():
+        return prompt.lower()
+    return LoweredText(prompt, chunk_chars())
+
+
+class LoweredText:
+    """A long prompt, lowercased one overlapping chunk at a time when scanned"""
+
+    def __init__(self, text, size):
+        self.text = text
+        self.size = size
+
+    def chunks(self):
+        """Yield ``(chunk, core)``: a lowercased chunk, and the length of its part not repeated in the next"""
+        text, size = self.text, self.size
+        for start in range(0, len(text), size):
+            # Lowered apart so ``core`` is exact even where lower() changes a length
+            core = text[start:start + size].lower()
+            yield core + text[start + size:start + size + CHUNK_OVERLAP].lower(), len(core)
+
+    def __contains__(self, keyword):
+        return any(keyword in chunk for chunk, _ in self.chunks())
+
+    def finditer(self, pattern):
+        """Matches of ``pattern`` in prompt order, each reported once (match positions are per chunk)"""
+        resume = 0
+        for chunk, core in self.chunks():
+            for match in pattern.finditer(chunk, resume):
+                if match.start() >= core:
+                    break
+                yield match
+                resume = match.end()
+            # A match may have run into the overlap; the next chunk starts after it
+            resume = max(resume - core, 0)
+
+
+def _search(pattern, prompt_lower):
+    if isinstance(prompt_lower, LoweredText):
+        return next(prompt_lower.finditer(pattern), None)
+    return pattern.search(prompt_lower)
+
+
+def _findall(pattern, prompt_lower):
+    if isinstance(prompt_lower, LoweredText):
+        return [match.group(1) for match in prompt_lower.finditer(pattern)]
+    return pattern.findall(prompt_lower)
+
+
+class RuleSet:
+    def __init__(self, config):
+        self.responses = []
+        for rule in config['canned_responses']:
+            keywords = tuple(keyword.lower() for keyword in rule['keywords'])
+            if not keywords or not all(keywords):
+                raise ValueError(f"Rule for {rule['response']!r} needs non-empty keywords")
+            if any(len(keyword) > CHUNK_OVERLAP for keyword in keywords):
+                raise ValueError(f"Rule for {rule['response']!r} has a keyword over {CHUNK_OVERLAP} characters")
+            self.responses.append((keywords, rule['response']))
+        self.default_response = config['default_response']
+
+        self.invoice_patterns = []
+        for pattern in config.get('invoice_patterns', []):
+            compiled = re.compile(pattern)
+            if compiled.groups != 1:
+                raise ValueError(f"Invoice pattern {pattern!r} must have exactly one capture group")
+            self.invoice_patterns.append(compiled)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def respond(self, prompt_lower):
+        """Canned response for a prompt from ``lower``"""
+        if isinstance(prompt_lower, LoweredText):
+            return self._respond_chunked(prompt_lower)
+        for keywords, response in self.responses:
+            for keyword in keywords:
+                if keyword in prompt_lower:
+                    return response
+        return self.default_response
+
+    def _respond_chunked(self, prompt_lower):
+        """``respond`` in one pass over the chunks, keeping the earliest rule matched so far"""
+        best = len(self.responses)
+        for chunk, _ in prompt_lower.chunks():
+            for index in range(best):
+                if any(keyword in chunk for keyword in self.responses[index][0]):
+                    best = index
+                    break
+            if best == 0:
+                break
+        return self.responses[best][1] if best < len(self.responses) else self.default_response
+
+    def find_invoice(self, prompt_lower):
+        """Invoice ID (INV-<number>) for a prompt from ``lower``, or None"""
+        for pattern in self.invoice_patterns:
+            match = _search(pattern, prompt_lower)
+            if match:
+                return f"INV-{match.group(1)}"
+        return None
+
+    def find_invoices(self, prompt_lower, limit=10):
+        """Every invoice ID matched by the first pattern that matches, in prompt order"""
+        for pattern in self.invoice_patterns:
+            numbers = _findall(pattern, prompt_lower)
+            if numbers:
+                return [f"INV-{number}" for number in dict.fromkeys(numbers)][:limit]
+        return []
+
+
+def get_rules():
+    """Return this process's rules, loaded from RULES_PATH on first use"""
+    global _rules
+    if _rules is None:
+        _rules = RuleSet.load(os.getenv('RULES_PATH') or RULES_PATH)
+    return _rules
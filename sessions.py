@@ -0,0 +1,283 @@
+"""Server-side conversation history for vendor-o.
+
+A vendor-o request with a ``session_id`` only carries its new turn; the
+gateway keeps the earlier ones and sends them upstream ahead of it. A
+session holds its system prompt and compact turns (final user and
+assistant texts only, each with its token count; tool call rounds are not
+kept). Once the turns pass SESSION_HISTORY_TOKENS the oldest are dropped,
+and a one-line gist of each dropped turn is kept in a short summary (at
+most SESSION_SUMMARY_TOKENS) that is sent as a second system message.
+
+Sessions live in a per-worker LRU, bounded by SESSION_MAXSIZE and expiring
+SESSION_TTL seconds after their last turn. With several workers, set
+SESSION_SQLITE_PATH: sessions are then kept only in that file so any
+worker can continue any conversation.
+
+Sessions are scoped to their caller: each request sets its caller
+(X-Client-Id, else Authorization, else the client address from
+router.client_address) with ``set_caller``, and a session id names a
+different session for every caller, so a guessed id is not enough to read,
+continue or delete another caller's conversation. The scope is only as
+strong as the identity: X-Client-Id is whatever the caller says it is, and
+callers sharing an address share a scope unless they send a key.
+"""
+import contextvars
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import cache
+import tokenizer
+
+MAX_ID_LENGTH = 128
+SUMMARY_HEADER = 'Earlier in this conversation:'
+GIST_CHARS = 160
+
+_store = None
+_store_lock = threading.Lock()
+
+# The current request's caller, hashed so credentials are never stored as keys
+_caller = contextvars.ContextVar('session_caller', default='')
+
+
+def history_tokens():
+    return int(os.getenv('SESSION_HISTORY_TOKENS', '2000'))
+
+
+def summary_tokens():
+    return int(os.getenv('SESSION_SUMMARY_TOKENS', '200'))
+
+
+def session_id(data):
+    """The request's session id, None without one; raises ValueError if malformed"""
+    value = data.get('session_id')
+    if value is None:
+        return None
+    if not isinstance(value, str) or not value or len(value) > MAX_ID_LENGTH:
+        raise ValueError(f'"session_id" must be a non-empty string of at most {MAX_ID_LENGTH} characters')
+    return value
+
+
+def set_caller(client):
+    """Scope this request's sessions to ``client`` (router.client_key)"""
+    _caller.set(hashlib.sha256(str(client or '').encode()).hexdigest()[:16])
+
+
+def _key(sid):
+    return f'{_caller.get()}/{sid}'
+
+
+def new_session():
+    return {'system_prompt': None, 'turns': [], 'summary': []}
+
+
+def gist(role, content):
+    """One summary line for a dropped turn: its first sentence, clipped"""
+    text = ' '.join(content.split())
+    end = text.find('. ')
+    if 0 < end < GIST_CHARS:
+        text = text[:end + 1]
+    elif len(text) > GIST_CHARS:
+        text = text[:GIST_CHARS - 3] + '...'
+    return f'{role}: {text}'
+
+
+def append_turns(session, system_prompt, prompt, reply):
+    """Add one exchange to ``session`` and trim it back under the token budgets"""
+    if system_prompt is not None:
+        session['system_prompt'] = system_prompt
+    prompt_tokens, reply_tokens = tokenizer.count_batch([prompt, reply])
+    turns = session['turns']
+    turns.append(['user', prompt, prompt_tokens])
+    turns.append(['assistant', reply, reply_tokens])
+
+    budget = history_tokens()
+    total = sum(turn[2] for turn in turns)
+    dropped = 0
+    # Drop whole exchanges so the history never starts with an assistant turn
+    while total > budget and len(turns) - dropped > 2:
+        total -= turns[dropped][2] + turns[dropped + 1][2]
+        dropped += 2
+    if not dropped:
+        return session
+
+    summary = session['summary']
+    limit = summary_tokens()
+    if limit > 0:
+        lines = [gist(role, content) for role, content, _ in turns[:dropped]]
+        summary.extend([line, count] for line, count in zip(lines, tokenizer.count_batch(lines)))
+        total = sum(line[1] for line in summary)
+        while summary and total > limit:
+            total -= summary.pop(0)[1]
+    del turns[:dropped]
+    return session
+
+
+def messages(session, system_prompt, prompt):
+    """The chat/completions messages for a new ``prompt`` in ``session``"""
+    system = system_prompt or session['system_prompt'] or 'You are a helpful assistant'
+    result = [{'role': 'system', 'content': system}]
+    if session['summary']:
+        lines = '\n'.join(line for line, _ in session['summary'])
+        result.append({'role': 'system', 'content': f'{SUMMARY_HEADER}\n{lines}'})
+    result.extend({'role': role, 'content': content} for role, content, _ in session['turns'])
+    result.append({'role': 'user', 'content': prompt})
+    return result
+
+
+class MemorySessionStore:
+    """Sessions in this worker's memory: an LRU whose entries expire ``ttl``
+    seconds after their last turn"""
+
+    def __init__(self, maxsize, ttl):
+        self.sessions = cache.TTLCache(maxsize, ttl)
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        return self.sessions.get(sid)
+
+    def update(self, sid, change):
+        """Apply ``change(session)`` to a session, creating it if needed"""
+        with self._lock:
+            session = self.sessions.get(sid)
+            if session is None:
+                session = new_session()
+            else:
+                # Change a copy: other requests may be building messages from the stored one
+                session = dict(session, turns=list(session['turns']), summary=list(session['summary']))
+            self.sessions.set(sid, change(session))
+
+    def delete(self, sid):
+        return self.sessions.pop(sid)
+
+    def snapshot(self):
+        return {'backend': 'memory', 'sessions': len(self.sessions),
+                'maxsize': self.sessions.maxsize, 'evictions': self.sessions.evictions}
+
+
+class SQLiteSessionStore:
+    """Sessions in a SQLite file shared by every worker on the machine.
+
+    Connections are per thread (and re-opened after a fork); an update reads
+    and writes its session in one transaction, so concurrent turns from
+    different workers are not lost.
+    """
+
+    PRUNE_EVERY = 256
+
+    def __init__(self, path, maxsize, ttl):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                'id TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, sid, conn=None):
+        row = (conn or self._connection()).execute(
+            'SELECT value FROM sessions WHERE id = ? AND expires_at > ?', (sid, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, sid, change):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            session = change(self.get(sid, conn) or new_session())
+            conn.execute(
+                'INSERT OR REPLACE INTO sessions (id, value, expires_at) VALUES (?, ?, ?)',
+                (sid, json.dumps(session, separators=(',', ':')), time.time() + self.ttl)
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self._prune(conn)
+
+    def delete(self, sid):
+        return self._connection().execute('DELETE FROM sessions WHERE id = ?', (sid,)).rowcount > 0
+
+    def _prune(self, conn):
+        # Expired sessions, then the least recently continued beyond maxsize
+        conn.execute('DELETE FROM sessions WHERE expires_at <= ?', (time.time(),))
+        conn.execute(
+            'DELETE FROM sessions WHERE id IN ('
+            'SELECT id FROM sessions ORDER BY expires_at DESC LIMIT -1 OFFSET ?)',
+            (self.maxsize,)
+        )
+
+    def snapshot(self):
+        count = self._connection().execute(
+            'SELECT COUNT(*) FROM sessions WHERE expires_at > ?', (time.time(),)
+        ).fetchone()[0]
+        return {'backend': 'sqlite', 'sessions': count, 'maxsize': self.maxsize, 'sqlite_path': self.path}
+
+
+def get_store():
+    """Return this process's session store"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                maxsize = int(os.getenv('SESSION_MAXSIZE', '10000'))
+                ttl = float(os.getenv('SESSION_TTL', '3600'))
+                path = os.getenv('SESSION_SQLITE_PATH')
+                _store = SQLiteSessionStore(path, maxsize, ttl) if path else MemorySessionStore(maxsize, ttl)
+    return _store
+
+
+def build_messages(sid, data):
+    """Messages for a session request: system prompt, summary, history, new turn"""
+    session = get_store().get(_key(sid)) or new_session()
+    return messages(session, data.get('system_prompt'), data.get('prompt', data.get('message', 'Hello')))
+
+
+def record(sid, data, reply):
+    """Keep a finished exchange; called only once the upstream answered"""
+    if not isinstance(reply, str):
+        return
+    prompt = data.get('prompt', data.get('message', 'Hello'))
+    get_store().update(_key(sid), lambda session: append_turns(session, data.get('system_prompt'), prompt, reply))
+
+
+def describe(sid):
+    """A session's state for GET /sessions/<id>, or None"""
+    session = get_store().get(_key(sid))
+    if session is None:
+        return None
+    return {
+        'session_id': sid,
+        'system_prompt': session['system_prompt'],
+        'summary': [line for line, _ in session['summary']],
+        'turns': [{'role': role, 'content': content, 'tokens': tokens}
+                  for role, content, tokens in session['turns']],
+        'history_tokens': sum(turn[2] for turn in session['turns']),
+    }
+
+
+def delete(sid):
+    """End the caller's session ``sid``; False if it had none"""
+    return get_store().delete(_key(sid))
+
+
+def session_stats():
+    return dict(get_store().snapshot(), history_tokens=history_tokens(), summary_tokens=summary_tokens())
@@ -0,0 +1,114 @@
+"""Single-flight request coalescing.
+
+While one upstream call for a key is in flight, later callers with the same
+key wait for it and share its result instead of going upstream themselves.
+Shared results are handed to every caller, so treat them as read-only.
+
+Set SINGLEFLIGHT_ENABLED=0 to turn coalescing off.
+"""
+import asyncio
+import os
+import threading
+
+_groups = {}
+
+
+def enabled():
+    return os.getenv('SINGLEFLIGHT_ENABLED', '1') != '0'
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls across threads"""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {'leaders': 0, 'collapsed': 0}
+        _groups[name] = self
+
+    def do(self, key, fn):
+        """Return fn(), or the result of an identical call already in flight"""
+        if not enabled():
+            return fn()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats['leaders'] += 1
+            else:
+                self.stats['collapsed'] += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def in_flight(self):
+        return len(self._calls)
+
+
+class AsyncSingleFlight:
+    """Coalesces concurrent coroutines on one event loop.
+
+    The shared call runs as its own task, so a caller that gets cancelled
+    (client disconnect, hedging) does not cancel it for the others.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._tasks = {}
+        self.stats = {'leaders': 0, 'collapsed': 0}
+        _groups[name] = self
+
+    async def do(self, key, coro_fn):
+        if not enabled():
+            return await coro_fn()
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self.stats['leaders'] += 1
+        else:
+            self.stats['collapsed'] += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every waiter went away
+
+    def in_flight(self):
+        return len(self._tasks)
+
+
+def stats():
+    """Counters for every coalescing group in this worker"""
+    return {
+        name: dict(group.stats, in_flight=group.in_flight())
+        for name, group in _groups.items()
+    }
@@ -0,0 +1,102 @@
+"""Cold-start timing and warm-up.
+
+With fly.io's ``auto_stop_machines``, a stopped machine boots on the next
+request, so that request waits for the interpreter, the imports and
+whatever the gateway builds lazily on first use (the BPE merge table, the
+rules file, connection pools, ...). This module measures those phases and
+runs the warm-up that moves the lazy work before the first request.
+
+Times are seconds since the process started (read from /proc on Linux, else
+since this module was imported). Under gunicorn with ``preload_app`` the
+master imports the app once and forks the workers, so a worker's clock
+starts with the master's: ``first_request`` is the real cold start a client
+saw. Each worker prints one line when it serves its first request and
+reports all of it on ``GET /metrics/startup``.
+"""
+import os
+import sys
+import threading
+import time
+
+_imported = time.time()
+
+
+def _process_start():
+    """Wall-clock start of this process (of the gunicorn master in a preforked worker)"""
+    try:
+        with open('/proc/self/stat') as f:
+            # Field 22, counted after the parenthesised command name
+            start_ticks = int(f.read().rpartition(')')[2].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - (uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return _imported
+
+
+_origin = _process_start()
+_phases = {}
+_warmup = {}
+_lock = threading.Lock()
+
+
+def mark(phase):
+    """Record when ``phase`` was first reached; later calls are ignored"""
+    if phase not in _phases:
+        _phases[phase] = time.time() - _origin
+
+
+def reached(phase):
+    return phase in _phases
+
+
+def warm_up(steps, phase='warm'):
+    """Run ``(name, fn)`` steps, timing each, then mark ``phase``.
+
+    A step that fails is recorded and skipped; its work happens on first use
+    as it would have without the warm-up. Does nothing once ``phase`` is reached.
+    """
+    if reached(phase):
+        return
+    start = time.perf_counter()
+    for name, fn in steps:
+        step_start = time.perf_counter()
+        try:
+            fn()
+            _warmup[name] = round(time.perf_counter() - step_start, 6)
+        except Exception as e:
+            _warmup[name] = f'failed: {e}'
+    _warmup[f'{phase}_total'] = round(time.perf_counter() - start, 6)
+    mark(phase)
+
+
+def first_request_served():
+    """Mark the first served request and log this worker's startup timings once"""
+    if 'first_request' in _phases:
+        return
+    with _lock:
+        if 'first_request' in _phases:
+            return
+        mark('first_request')
+    phases = ', '.join(f'{phase} {seconds:.3f}s' for phase, seconds in _phases.items())
+    print(f'[startup] pid {os.getpid()}: {phases} after process start', file=sys.stderr, flush=True)
+
+
+def startup_stats():
+    return {
+        'pid': os.getpid(),
+        'process_start': _origin,
+        'phases': {phase: round(seconds, 6) for phase, seconds in _phases.items()},
+        'warmup': dict(_warmup),
+    }
+
+
+def _after_fork():
+    # A worker keeps the master's clock and import time; warm-up and first request are its own
+    for phase in [phase for phase in _phases if phase not in ('imported', 'shared_warm')]:
+        del _phases[phase]
+    global _lock
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
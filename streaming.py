@@ -0,0 +1,163 @@
+"""Server-sent events for streamed completions.
+
+Canned vendors stream their text token by token at a configurable pace;
+vendor-o relays OpenAI's ``chat/completions`` stream as it arrives. The
+event generators here do no I/O or sleeping themselves, so the Flask and
+ASGI servers share them and only differ in how they pace and send.
+"""
+import os
+import re
+import time
+
+import jsoncodec
+
+DONE = b'data: [DONE]\n\n'
+
+# Bytes kept from the end of a relayed vendor-o stream: its usage chunk is the last before [DONE]
+USAGE_TAIL_BYTES = 4096
+
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no',
+}
+
+_TOKEN_RE = re.compile(r'\s*\S+')
+
+
+def sse_event(obj):
+    return b'data: ' + jsoncodec.dumps_bytes(obj) + b'\n\n'
+
+
+def wants_stream(data):
+    return data.get('stream') is True
+
+
+def token_delay(data):
+    """Seconds between streamed tokens (request's stream_delay_ms, else STREAM_TOKEN_DELAY_MS)"""
+    delay_ms = data.get('stream_delay_ms', os.getenv('STREAM_TOKEN_DELAY_MS', '30'))
+    try:
+        return max(float(delay_ms), 0) / 1000
+    except (TypeError, ValueError):
+        return 0.03
+
+
+def split_tokens(text):
+    """Split text into word tokens that keep their leading whitespace"""
+    return _TOKEN_RE.findall(text)
+
+
+def paced(events, delay):
+    """Yield events with ``delay`` seconds between them (first one immediately)"""
+    for index, event in enumerate(events):
+        if index and delay:
+            time.sleep(delay)
+        yield event
+
+
+async def apaced(events, delay):
+    import asyncio
+    for index, event in enumerate(events):
+        if index and delay:
+            await asyncio.sleep(delay)
+        yield event
+
+
+def vendor_a_events(body, start_time):
+    """vendor-a stream: outputText deltas, then the full response body"""
+    for token in split_tokens(body['outputText']):
+        yield sse_event({'outputTextDelta': token})
+    final = dict(body, latencyMS=int((time.time() - start_time) * 1000))
+    yield sse_event(final)
+    yield DONE
+
+
+def vendor_b_events(body):
+    """vendor-b stream: OpenAI-style content deltas, then finish_reason and usage"""
+    for token in split_tokens(body['choices'][0]['message']['content']):
+        yield sse_event({'choices': [{'index': 0, 'delta': {'content': token}}]})
+    yield sse_event({
+        'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}],
+        'usage': body['usage']
+    })
+    yield DONE
+
+
+def streaming_payload(payload):
+    """Turn a chat/completions payload into its streaming form"""
+    return dict(payload, stream=True, stream_options={'include_usage': True})
+
+
+class ToolCallCollector:
+    """Reassembles tool_call deltas from an OpenAI stream.
+
+    ``feed`` takes one raw SSE line and returns the raw lines to relay to the
+    client now. Tool call fragments and the upstream ``[DONE]`` are held
+    back, because the gateway executes the tools and streams the follow-up
+    completion instead. So are a round's role-only chunks, until its content
+    shows it is the answer, and the usage chunk of a round that ended in tool
+    calls: the client sees one completion, with one id and one usage chunk.
+    Content deltas are kept for ``text()`` and the stream's token counts for
+    ``usage``.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.content = []
+        self.usage = None
+        self.held = []
+
+    def feed(self, line):
+        if not line.startswith(b'data:'):
+            return []
+        data = line[5:].strip()
+        if data == b'[DONE]':
+            return []
+        try:
+            chunk = jsoncodec.loads(data)
+        except ValueError:
+            return [line]
+        if chunk.get('usage'):
+            self.usage = chunk['usage']
+        choices = chunk.get('choices')
+        if not choices:
+            # The usage chunk (``choices: []``) follows the round's finish_reason
+            return [] if self.calls else self._release(line)
+        delta = choices[0].get('delta') or {}
+        if delta.get('content'):
+            self.content.append(delta['content'])
+        if delta.get('tool_calls'):
+            for fragment in delta['tool_calls']:
+                call = self.calls.setdefault(fragment.get('index', 0), {
+                    'id': None,
+                    'type': 'function',
+                    'function': {'name': '', 'arguments': ''}
+                })
+                if fragment.get('id'):
+                    call['id'] = fragment['id']
+                function = fragment.get('function') or {}
+                call['function']['name'] += function.get('name') or ''
+                call['function']['arguments'] += function.get('arguments') or ''
+        if self.calls:
+            self.held = []
+            return []
+        if delta.get('content') or choices[0].get('finish_reason'):
+            return self._release(line)
+        self.held.append(line)
+        return []
+
+    def _release(self, line):
+        """``line``, after any chunks held back until the round proved to be the answer"""
+        lines = self.held + [line]
+        self.held = []
+        return lines
+
+    def text(self):
+        """The content relayed so far"""
+        return ''.join(self.content)
+
+    def assistant_message(self):
+        return {
+            'role': 'assistant',
+            'content': None,
+            'tool_calls': [self.calls[index] for index in sorted(self.calls)]
+        }
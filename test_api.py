@@ -1,12 +1,48 @@
 #!/usr/bin/env python3
 import pytest
 import requests
+import contextlib
 import os
+import json
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 # Base URL can be set via environment variable or defaults to localhost
 BASE_URL = os.environ.get('BASE_URL', 'https://llm-gateway.fly.dev')
 
 
+@contextlib.contextmanager
+def gunicorn_server(**env):
+    """Run gunicorn with the repo's gunicorn.conf.py on a free local port; yields its base URL"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    env = dict({k: v for k, v in os.environ.items() if not k.startswith(('GUNICORN_', 'ADMISSION_', 'METRICS_'))},
+               PORT=str(port), **env)
+    root = os.path.dirname(os.path.abspath(__file__))
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:app'], cwd=root, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        for _ in range(300):
+            try:
+                requests.get(f"{base_url}/health", timeout=5)
+                break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        yield base_url
+    finally:
+        # SIGINT is gunicorn's quick shutdown
+        server.send_signal(signal.SIGINT)
+        server.wait(timeout=30)
+
+
 class TestVendorA:
     """Test cases for Vendor A endpoints"""
 
@@ -109,6 +145,28 @@ class TestVendorB:
         rate_limit_rate = results.get('429', 0) / 30
         assert 0 <= rate_limit_rate <= 0.3, f"Rate limit rate {rate_limit_rate:.1%} outside expected range"
 
+    def test_stream(self):
+        """Test vendor-b streams OpenAI-style deltas when stream is set"""
+        response = requests.post(
+            f"{BASE_URL}/vendor-b/messages",
+            json={'prompt': 'Hello there', 'stream': True, 'stream_delay_ms': 0},
+            timeout=10,
+            stream=True
+        )
+        
+        if response.status_code == 429:
+            return
+        assert response.status_code == 200
+        assert response.headers['Content-Type'].startswith('text/event-stream')
+        
+        events = [line[len('data: '):] for line in response.iter_lines(decode_unicode=True) if line.startswith('data: ')]
+        assert events[-1] == '[DONE]'
+        chunks = [json.loads(event) for event in events[:-1]]
+        text = ''.join(chunk['choices'][0]['delta'].get('content', '') for chunk in chunks)
+        assert text == "Hello! How can I assist you today?"
+        assert chunks[-1]['choices'][0]['finish_reason'] == 'stop'
+        assert isinstance(chunks[-1]['usage']['output_tokens'], int)
+
 
 class TestVendorE:
     """Test cases for Vendor E endpoints"""
@@ -147,6 +205,103 @@ class TestVendorE:
             data = response.json()
             assert data['response'] == f"You entered {test_input}"
 
+    def test_echo_unicode(self):
+        """Test non-ASCII input survives the JSON round trip"""
+        test_input = "héllo wörld, 日本語 ✓"
+        response = requests.post(f"{BASE_URL}/vendor-e/messages", json={'prompt': test_input}, timeout=10)
+        assert response.status_code == 200
+        assert response.json()['response'] == f"You entered {test_input}"
+
+
+class TestCannedRules:
+    """Test keyword and invoice rules keep their priority order"""
+
+    def test_keyword_priority(self):
+        """Test the first rule in order wins even when a later rule matches earlier in the prompt"""
+        for _ in range(10):
+            response = requests.post(
+                f"{BASE_URL}/vendor-b/messages",
+                json={'prompt': 'Thanks for the weather report'},
+                timeout=10
+            )
+            if response.status_code == 200:
+                break
+        assert response.status_code == 200
+        content = response.json()['choices'][0]['message']['content']
+        assert content == "I can help with weather information. Please specify a location."
+
+    def test_invoice_pattern_priority(self):
+        """Test an INV- reference wins over an earlier #number"""
+        for _ in range(20):
+            response = requests.post(
+                f"{BASE_URL}/vendor-a/messages",
+                json={'prompt': 'Ticket #5 is about inv-981', 'tools': [{'type': 'function'}]},
+                timeout=10
+            )
+            if response.status_code == 200:
+                break
+        assert response.status_code == 200
+        assert response.json()['invoice_data']['invoice_id'] == 'INV-981'
+
+
+class TestTokenCounting:
+    """Test token counts reported in usage"""
+
+    def test_code_prompt_counts_subword_tokens(self):
+        """Test the BPE tokenizer counts code as more tokens than whitespace-separated words"""
+        tokenizer = requests.get(f"{BASE_URL}/metrics/tokenizer", timeout=10).json()['tokenizer']
+        prompt = 'def fib(n): return n if n < 2 else fib(n-1) + fib(n-2)'
+        for _ in range(10):
+            response = requests.post(f"{BASE_URL}/vendor-b/messages", json={'prompt': prompt}, timeout=10)
+            if response.status_code == 200:
+                break
+        assert response.status_code == 200
+        input_tokens = response.json()['usage']['input_tokens']
+        if tokenizer == 'bpe':
+            assert input_tokens > len(prompt.split())
+        else:
+            assert input_tokens == len(prompt.split())
+
+    def test_long_word_is_counted_quickly(self):
+        """Test a 64 KB prompt with no whitespace is counted in bounded time"""
+        prompt = ''.join(chr(97 + (i * 7919) % 26) for i in range(65536))
+        start = time.time()
+        response = requests.post(f"{BASE_URL}/vendor-a/messages", json={'prompt': prompt},
+                                 headers={'X-Fault': 'none'}, timeout=30)
+        assert response.status_code == 200
+        assert response.json()['tokensIn'] > 1000
+        assert time.time() - start < 5
+
+    def test_multi_megabyte_prompt_without_whitespace(self):
+        """Test a 3 MB prompt with no whitespace is cut into chunks and counted in bounded time"""
+        prompt = ''.join(chr(97 + (i * 7919) % 26) for i in range(3 * 1024 * 1024))
+        start = time.time()
+        response = requests.post(f"{BASE_URL}/vendor-a/messages", json={'prompt': prompt},
+                                 headers={'X-Fault': 'none'}, timeout=60)
+        assert response.status_code == 200
+        assert response.json()['tokensIn'] > 100000
+        assert time.time() - start < 15
+
+
+class TestConcurrency:
+    """Test the gateway under concurrent in-flight requests"""
+
+    def test_concurrent_requests(self):
+        """Test many simultaneous requests all complete with the right body"""
+        def send(i):
+            return requests.post(
+                f"{BASE_URL}/vendor-e/messages",
+                json={'prompt': f'concurrent {i}'},
+                timeout=30
+            )
+
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            responses = list(pool.map(send, range(64)))
+
+        for i, response in enumerate(responses):
+            assert response.status_code == 200
+            assert response.json()['response'] == f"You entered concurrent {i}"
+
 
 class TestHealthEndpoint:
     """Test health check endpoint"""
@@ -159,6 +314,492 @@ class TestHealthEndpoint:
         assert data['status'] == 'healthy'
 
 
+class TestUpstreamPool:
+    """Test upstream connection pool metrics"""
+
+    def test_pool_stats(self):
+        """Test upstream pool metrics endpoint reports per-host usage"""
+        response = requests.get(f"{BASE_URL}/metrics/upstream", timeout=10)
+        assert response.status_code == 200
+        data = response.json()
+        assert isinstance(data['hosts'], dict)
+        assert data['connect_timeout'] > 0
+        for stats in data['hosts'].values():
+            assert stats['connections_opened'] <= stats['requests']
+            assert stats['in_flight'] >= 0
+        for group in data['singleflight'].values():
+            assert group['leaders'] >= 0
+            assert group['collapsed'] >= 0
+
+
+class TestResponseCache:
+    """Test vendor-o response cache metrics"""
+
+    def test_cache_stats(self):
+        """Test cache metrics endpoint reports whether the cache is enabled"""
+        response = requests.get(f"{BASE_URL}/metrics/cache", timeout=10)
+        assert response.status_code == 200
+        data = response.json()
+        assert isinstance(data['enabled'], bool)
+        if data['enabled']:
+            assert data['entries'] <= data['maxsize']
+            assert data['ttl'] > 0
+
+
+class TestTools:
+    """Test the tool registry endpoints"""
+
+    def test_list_tools(self):
+        """Test tool definitions are listed in chat/completions format"""
+        response = requests.get(f"{BASE_URL}/tools", timeout=10)
+        assert response.status_code == 200
+        names = {tool['function']['name'] for tool in response.json()['tools']}
+        assert {'get_current_weather', 'get_invoice'} <= names
+
+    def test_invoice_lookup_is_cached(self):
+        """Test repeated vendor-a invoice lookups are served from the invoice store's cache"""
+        payload = {
+            'prompt': 'Show me invoice INV-4242',
+            'tools': [{'type': 'function', 'function': {'name': 'get_invoice'}}]
+        }
+        bodies = []
+        for _ in range(10):
+            response = requests.post(f"{BASE_URL}/vendor-a/messages", json=payload, timeout=10)
+            if response.status_code == 200:
+                bodies.append(response.json())
+        assert bodies, "every vendor-a request failed"
+        assert all(body['invoice_data'] == bodies[0]['invoice_data'] for body in bodies)
+
+        stats = requests.get(f"{BASE_URL}/metrics/invoices", timeout=10).json()
+        if len(bodies) > 1:
+            assert stats['cache_hits'] >= 1
+        assert stats['cached'] >= 1
+
+    def test_multiple_invoices(self):
+        """Test a prompt naming several invoices gets one tool call per invoice"""
+        payload = {
+            'prompt': 'Compare INV-12 with inv-40 and INV-12 again',
+            'tools': [{'type': 'function', 'function': {'name': 'get_invoice'}}]
+        }
+        for _ in range(20):
+            response = requests.post(f"{BASE_URL}/vendor-a/messages", json=payload, timeout=10)
+            if response.status_code == 200:
+                break
+        assert response.status_code == 200
+        data = response.json()
+        arguments = [json.loads(call['function']['arguments']) for call in data['tool_calls']]
+        assert arguments == [{'invoice_id': 'INV-12'}, {'invoice_id': 'INV-40'}]
+        assert [invoice['invoice_id'] for invoice in data['invoices']] == ['INV-12', 'INV-40']
+        assert data['invoice_data']['invoice_id'] == 'INV-12'
+
+
+    def test_tool_loop_stream_is_one_completion(self):
+        """Test a streamed vendor-o tool loop reaches the client as one completion id with one usage chunk"""
+        tools = requests.get(f"{BASE_URL}/tools", timeout=10).json()['tools']
+        response = requests.post(
+            f"{BASE_URL}/vendor-o/messages",
+            json={'prompt': 'What is the weather in Paris?', 'tools': tools, 'stream': True, 'cache': False},
+            timeout=60
+        )
+        if response.status_code == 500 and response.json().get('type') == 'ConfigurationError':
+            pytest.skip('vendor-o has no OpenAI key')
+        assert response.status_code == 200
+        events = [line[len('data: '):] for line in response.text.splitlines() if line.startswith('data: ')]
+        assert events[-1] == '[DONE]'
+        chunks = [json.loads(event) for event in events[:-1]]
+        assert len({chunk['id'] for chunk in chunks}) == 1
+        assert len([chunk for chunk in chunks if chunk.get('usage')]) == 1
+
+
+class TestRouter:
+    """Test the /v1/messages vendor router"""
+
+    def test_route_message(self):
+        """Test routed responses are normalized and survive vendor faults"""
+        statuses = []
+        for _ in range(20):
+            response = requests.post(f"{BASE_URL}/v1/messages", json={'prompt': 'Hello'}, timeout=40)
+            statuses.append(response.status_code)
+            if response.status_code == 200:
+                data = response.json()
+                assert data['vendor'] in ('vendor-a', 'vendor-b', 'vendor-e')
+                assert data['content']
+                assert data['usage']['input_tokens'] > 0
+                assert data['attempts'][-1]['result'] == 'ok' or data['hedged']
+
+        # Failover means an occasional vendor fault does not reach the client
+        assert statuses.count(200) >= 18
+
+    def test_explicit_vendor_order(self):
+        """Test a request can pin the vendor order"""
+        response = requests.post(
+            f"{BASE_URL}/v1/messages",
+            json={'prompt': 'Hello', 'vendors': ['vendor-e']},
+            timeout=10
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data['vendor'] == 'vendor-e'
+        assert data['content'] == 'You entered Hello'
+
+    def test_unknown_vendor(self):
+        """Test unknown vendors are rejected"""
+        response = requests.post(
+            f"{BASE_URL}/v1/messages",
+            json={'prompt': 'Hello', 'vendors': ['vendor-z']},
+            timeout=10
+        )
+        assert response.status_code == 400
+
+    def test_malformed_body(self):
+        """Test a non-object body and non-string vendor names get a JSON 400"""
+        for body in ([1, 2], {'prompt': 'Hello', 'vendors': [['vendor-e']]}):
+            response = requests.post(f"{BASE_URL}/v1/messages", json=body, timeout=10)
+            assert response.status_code == 400
+            assert 'error' in response.json()
+
+    def test_failed_round_is_not_retried(self):
+        """Test a round that failed without a 429 ends in a 502 at once, and the retry queue is exported"""
+        response = requests.post(f"{BASE_URL}/v1/messages", json={'prompt': 123, 'vendors': ['vendor-a']}, timeout=40)
+        assert response.status_code == 502
+        assert len(response.json()['attempts']) == 1
+
+        text = requests.get(f"{BASE_URL}/metrics", timeout=10).text
+        assert '# TYPE gateway_retry_queue_total counter' in text
+        assert '# TYPE gateway_retry_queue_depth gauge' in text
+
+    def test_deadline_shed(self):
+        """Test a request whose deadline is too short for a rate-limited vendor is shed with Retry-After"""
+        for _ in range(50):
+            response = requests.post(
+                f"{BASE_URL}/v1/messages",
+                json={'prompt': 'Hello', 'vendors': ['vendor-b'], 'timeout_ms': 100},
+                timeout=10
+            )
+            if response.status_code == 429:
+                assert response.json()['retryAfterMs'] > 0
+                assert int(response.headers['Retry-After']) >= 1
+                break
+            assert response.status_code == 200
+
+        stats = requests.get(f"{BASE_URL}/metrics/ratelimit", timeout=10).json()
+        assert stats['queue']['depth'] >= 0
+        assert 'vendor-b' in stats['vendors']
+
+    def test_router_stats(self):
+        """Test router metrics report per-vendor stats"""
+        response = requests.get(f"{BASE_URL}/metrics/router", timeout=10)
+        assert response.status_code == 200
+        data = response.json()
+        assert 'vendor-a' in data['vendors']
+        assert data['routed'] >= 0
+
+
+class TestBatch:
+    """Test the /v1/batch endpoint"""
+
+    def test_batch_ndjson(self):
+        """Test every item gets one NDJSON line with its own status"""
+        items = [
+            {'id': 'echo', 'vendor': 'vendor-e', 'prompt': 'Hello'},
+            {'vendor': 'vendor-z', 'prompt': 'Hello'},
+            {'prompt': 'Hello', 'vendors': ['vendor-e']},
+            {'prompt': 'Hello', 'vendors': [['vendor-e']]},
+            {'vendor': ['vendor-e'], 'prompt': 'Hello'},
+        ] + [{'vendor': 'vendor-b', 'prompt': 'Hello'}] * 5
+        response = requests.post(
+            f"{BASE_URL}/v1/batch",
+            json={'requests': items, 'concurrency': 4},
+            timeout=30
+        )
+        assert response.status_code == 200
+        assert response.headers['Content-Type'].startswith('application/x-ndjson')
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        by_index = {line['index']: line for line in lines}
+        assert sorted(by_index) == list(range(len(items)))
+        assert by_index[0]['id'] == 'echo'
+        assert by_index[0]['body'] == {'response': 'You entered Hello'}
+        assert by_index[1]['status'] == 400
+        assert by_index[2]['body']['vendor'] == 'vendor-e'
+        assert by_index[3]['status'] == 400
+        assert by_index[4]['status'] == 400
+        assert all(by_index[i]['status'] in (200, 429) for i in range(5, len(items)))
+
+    def test_invalid_batch(self):
+        """Test a batch without a requests array is rejected"""
+        response = requests.post(f"{BASE_URL}/v1/batch", json={'requests': []}, timeout=10)
+        assert response.status_code == 400
+
+
+class TestRequestLog:
+    """Test the request log query endpoint"""
+
+    def test_logged_request(self):
+        """Test a request shows up in the log with its vendor, status and tokens"""
+        prompt = f"log me {time.time()}"
+        requests.post(f"{BASE_URL}/vendor-b/messages", json={'prompt': prompt}, timeout=10)
+        for _ in range(20):
+            time.sleep(0.25)
+            response = requests.get(f"{BASE_URL}/logs/requests", params={'vendor': 'vendor-b', 'limit': 20}, timeout=10)
+            assert response.status_code == 200
+            matches = [e for e in response.json()['entries'] if (e['request'] or {}).get('prompt') == prompt]
+            if matches:
+                break
+        assert matches, "request never reached the log"
+        entry = matches[0]
+        assert entry['path'] == '/vendor-b/messages'
+        assert entry['status'] in (200, 429)
+        if entry['status'] == 200:
+            assert entry['tokens_out'] > 0
+
+    def test_invalid_cursor(self):
+        """Test a malformed cursor is rejected"""
+        response = requests.get(f"{BASE_URL}/logs/requests", params={'cursor': '!!'}, timeout=10)
+        assert response.status_code == 400
+
+
+class TestPrometheusMetrics:
+    """Test the Prometheus /metrics endpoint"""
+
+    def test_request_metrics(self):
+        """Test requests show up in the route histogram, status counter and token counter"""
+        requests.post(f"{BASE_URL}/vendor-e/messages", json={'prompt': 'Hello'}, timeout=10)
+        response = requests.get(f"{BASE_URL}/metrics", timeout=10)
+        assert response.status_code == 200
+        assert response.headers['Content-Type'].startswith('text/plain')
+        text = response.text
+        assert '# TYPE gateway_request_duration_seconds histogram' in text
+        assert 'gateway_request_duration_seconds_bucket{route="/vendor-e/messages",method="POST",le="+Inf"}' in text
+        assert 'gateway_requests_total{route="/vendor-e/messages",method="POST",status="200"}' in text
+        assert '# TYPE gateway_tokens_total counter' in text
+
+    def test_workers_share_counters(self):
+        """Test every scrape under the default gunicorn config sums all workers' requests"""
+        with gunicorn_server(METRICS_FLUSH_INTERVAL='0.1') as base_url:
+            for i in range(20):
+                assert requests.post(f"{base_url}/vendor-e/messages", json={'prompt': f'Hello {i}'},
+                                     timeout=10).status_code == 200
+            time.sleep(0.5)
+            series = 'gateway_requests_total{route="/vendor-e/messages",method="POST",status="200"} 20'
+            for _ in range(5):
+                assert series in requests.get(f"{base_url}/metrics", timeout=10).text.splitlines()
+
+    def test_streamed_vendor_o_tokens(self):
+        """Test a streamed vendor-o completion records its token counts"""
+        def input_tokens():
+            text = requests.get(f"{BASE_URL}/metrics", timeout=10).text
+            prefix = 'gateway_tokens_total{vendor="vendor-o",direction="input"} '
+            return next((int(line[len(prefix):]) for line in text.splitlines() if line.startswith(prefix)), 0)
+
+        before = input_tokens()
+        response = requests.post(f"{BASE_URL}/vendor-o/messages", json={'prompt': 'Hello', 'stream': True}, timeout=30)
+        if response.status_code == 500 and response.json().get('type') == 'ConfigurationError':
+            pytest.skip('vendor-o has no OpenAI key')
+        assert response.status_code == 200
+        assert response.text.rstrip().endswith('data: [DONE]')
+        assert input_tokens() > before
+
+    def test_startup_phases(self):
+        """Test the startup report orders its phases once a request has been served"""
+        requests.get(f"{BASE_URL}/health", timeout=10)
+        response = requests.get(f"{BASE_URL}/metrics/startup", timeout=10)
+        assert response.status_code == 200
+        phases = response.json()['phases']
+        assert 0 <= phases['imported'] <= phases['first_request']
+
+
+class TestAdmission:
+    """Test the per-route concurrency limiter"""
+
+    def test_limited_routes_only(self):
+        """Test vendor routes take a slot and health checks never do"""
+        requests.post(f"{BASE_URL}/vendor-e/messages", json={'prompt': 'Hello'}, timeout=10)
+        requests.get(f"{BASE_URL}/health", timeout=10)
+        response = requests.get(f"{BASE_URL}/metrics/admission", timeout=10)
+        assert response.status_code == 200
+        routes = response.json()['routes']
+        assert routes['/vendor-e/messages']['admitted'] >= 1
+        assert routes['/vendor-e/messages']['limit'] >= 1
+        assert '/health' not in routes
+
+    def test_default_gunicorn_config(self):
+        """Test a worker under the default gunicorn config runs more vendor requests at once than it had threads before"""
+        with gunicorn_server(WEB_CONCURRENCY='1') as base_url:
+            def send(i):
+                # vendor-e has no faults of its own; the header delay holds each request's thread
+                return requests.post(f"{base_url}/vendor-e/messages", json={'prompt': f'Hello {i}'},
+                                     headers={'X-Fault-Delay-Ms': '500'}, timeout=30)
+
+            with ThreadPoolExecutor(max_workers=12) as pool:
+                responses = list(pool.map(send, range(12)))
+            assert [response.status_code for response in responses] == [200] * 12
+
+            threads = requests.get(f"{base_url}/metrics/admission", timeout=10).json()['threads']
+            assert threads['shed'] == 0
+            assert threads['capacity'] > 12
+
+    def test_shed_request_body_not_logged(self):
+        """Test a request shed for a full worker is logged without reading its body"""
+        with tempfile.TemporaryDirectory() as tmp, \
+                gunicorn_server(WEB_CONCURRENCY='1', ADMISSION_TOTAL_LIMIT='1', REQUEST_LOG_FLUSH_INTERVAL='0.1',
+                                REQUEST_LOG_PATH=os.path.join(tmp, 'requests.log')) as base_url:
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                held = pool.submit(requests.post, f"{base_url}/vendor-e/messages", json={'prompt': 'Hold'},
+                                   headers={'X-Fault-Delay-Ms': '1500'}, timeout=30)
+                time.sleep(0.5)
+                response = requests.post(f"{base_url}/vendor-e/messages", json={'prompt': 'Shed'}, timeout=10)
+                assert response.status_code == 503
+                assert held.result().status_code == 200
+
+            for _ in range(20):
+                time.sleep(0.25)
+                entries = requests.get(f"{base_url}/logs/requests", params={'status': '503'}, timeout=10).json()['entries']
+                if entries:
+                    break
+            assert entries, "shed request never reached the log"
+            assert entries[0]['request'] is None
+
+
+class TestRequestLimits:
+    """Test body size limits and long prompts"""
+
+    def test_oversized_body(self):
+        """Test a body over the cap gets a 413 and too many tools a 400"""
+        response = requests.post(f"{BASE_URL}/vendor-e/messages", json={'prompt': 'x' * (5 * 1024 * 1024)}, timeout=30)
+        assert response.status_code == 413
+        assert response.json()['maxBytes'] > 0
+
+        response = requests.post(f"{BASE_URL}/vendor-e/messages",
+                                 json={'prompt': 'Hello', 'tools': [{'type': 'function'}] * 129}, timeout=10)
+        assert response.status_code == 400
+        assert 'tools' in response.json()['error'].lower()
+
+    def test_long_prompt_rules(self):
+        """Test keywords and invoice IDs are found past the first chunk of a long prompt"""
+        filler = 'zzz ' * 50000
+        response = requests.post(f"{BASE_URL}/vendor-a/messages", json={'prompt': filler + 'What about the weather?'},
+                                 headers={'X-Fault': 'none'}, timeout=10)
+        assert response.status_code == 200
+        assert response.json()['outputText'] == "I can help with weather information. Please specify a location."
+        assert response.json()['tokensIn'] > 50000
+
+        response = requests.post(f"{BASE_URL}/vendor-a/messages",
+                                 json={'prompt': filler + 'Ticket #5 is about inv-981', 'tools': [{'type': 'function'}]},
+                                 headers={'X-Fault': 'none'}, timeout=10)
+        assert response.status_code == 200
+        assert response.json()['invoice_data']['invoice_id'] == 'INV-981'
+
+
+class TestFaultInjection:
+    """Test the X-Fault* override headers"""
+
+    def test_forced_faults(self):
+        """Test faults can be turned off, forced by rule name, or forced by status"""
+        for _ in range(10):
+            response = requests.post(f"{BASE_URL}/vendor-a/messages", json={'prompt': 'Hello'},
+                                     headers={'X-Fault': 'none'}, timeout=10)
+            assert response.status_code == 200
+
+        response = requests.post(f"{BASE_URL}/vendor-a/messages", json={'prompt': 'Hello'},
+                                 headers={'X-Fault': 'error'}, timeout=10)
+        assert response.status_code == 500
+        assert response.json() == {'error': 'Internal server error'}
+
+        response = requests.post(f"{BASE_URL}/vendor-b/messages", json={'prompt': 'Hello'},
+                                 headers={'X-Fault': 'rate_limit'}, timeout=10)
+        assert response.status_code == 429
+        assert 5000 <= response.json()['retryAfterMs'] <= 10000
+
+        response = requests.post(f"{BASE_URL}/vendor-e/messages", json={'prompt': 'Hello'},
+                                 headers={'X-Fault': '503'}, timeout=10)
+        assert response.status_code == 503
+
+    def test_invalid_overrides(self):
+        """Test malformed fault headers get a 400 instead of a crash or an invalid status"""
+        for headers in ({'X-Fault-Delay-Ms': '-5'}, {'X-Fault-Delay-Ms': 'nan'}, {'X-Fault-Delay-Ms': 'inf'},
+                        {'X-Fault': '0'}, {'X-Fault': '99'}, {'X-Fault': '1000'}, {'X-Fault-Seed': 'abc'}):
+            response = requests.post(f"{BASE_URL}/vendor-e/messages", json={'prompt': 'Hello'},
+                                     headers=headers, timeout=10)
+            assert response.status_code == 400, headers
+            assert 'X-Fault' in response.json()['error']
+
+        response = requests.post(f"{BASE_URL}/vendor-a/messages", json={'prompt': 'Hello'},
+                                 headers={'X-Fault': 'eror'}, timeout=10)
+        assert response.status_code == 400
+        assert response.json()['error'] == 'Unknown fault rule: eror'
+
+    def test_seeded_roll_is_reproducible(self):
+        """Test the same X-Fault-Seed gives the same outcome"""
+        for seed in range(5):
+            statuses = {
+                requests.post(f"{BASE_URL}/vendor-b/messages", json={'prompt': 'Hello'},
+                              headers={'X-Fault-Seed': str(seed)}, timeout=10).status_code
+                for _ in range(3)
+            }
+            assert len(statuses) == 1
+
+
+class TestSessions:
+    """Test the vendor-o session endpoints"""
+
+    def test_unknown_session(self):
+        """Test an unknown session is a 404 for both lookup and delete"""
+        response = requests.get(f"{BASE_URL}/sessions/no-such-session", timeout=10)
+        assert response.status_code == 404
+        response = requests.delete(f"{BASE_URL}/sessions/no-such-session", timeout=10)
+        assert response.status_code == 404
+
+    def test_sessions_are_scoped_to_caller(self):
+        """Test another caller can neither read nor delete a session"""
+        session_id = f"scope-{uuid.uuid4().hex}"
+        owner = {'X-Client-Id': 'session-owner'}
+        response = requests.post(f"{BASE_URL}/vendor-o/messages", json={'session_id': session_id, 'prompt': 'Hello'},
+                                 headers=owner, timeout=30)
+        if response.status_code == 500 and response.json().get('type') == 'ConfigurationError':
+            pytest.skip('vendor-o has no OpenAI key')
+        assert response.status_code == 200
+
+        other = {'X-Client-Id': 'someone-else'}
+        assert requests.get(f"{BASE_URL}/sessions/{session_id}", headers=other, timeout=10).status_code == 404
+        assert requests.delete(f"{BASE_URL}/sessions/{session_id}", headers=other, timeout=10).status_code == 404
+        response = requests.get(f"{BASE_URL}/sessions/{session_id}", headers=owner, timeout=10)
+        assert response.status_code == 200
+        assert response.json()['turns'][0]['content'] == 'Hello'
+        assert requests.delete(f"{BASE_URL}/sessions/{session_id}", headers=owner, timeout=10).status_code == 200
+
+    def test_anonymous_callers_behind_proxy(self):
+        """Test callers without a key are told apart by the address the proxy forwards"""
+        session_id = f"proxy-{uuid.uuid4().hex}"
+        owner = {'Fly-Client-IP': '203.0.113.7'}
+        response = requests.post(f"{BASE_URL}/vendor-o/messages", json={'session_id': session_id, 'prompt': 'Hello'},
+                                 headers=owner, timeout=30)
+        if response.status_code == 500 and response.json().get('type') == 'ConfigurationError':
+            pytest.skip('vendor-o has no OpenAI key')
+        assert response.status_code == 200
+
+        other = {'X-Forwarded-For': '198.51.100.9, 203.0.113.7'}
+        assert requests.get(f"{BASE_URL}/sessions/{session_id}", headers=other, timeout=10).status_code == 404
+        assert requests.get(f"{BASE_URL}/sessions/{session_id}", headers=owner, timeout=10).status_code == 200
+        assert requests.delete(f"{BASE_URL}/sessions/{session_id}", headers=owner, timeout=10).status_code == 200
+
+    def test_malformed_session_id_on_router(self):
+        """Test a bad session_id routed to vendor-o is a 400, not a 500"""
+        for session_id in (42, 'x' * 129):
+            response = requests.post(f"{BASE_URL}/v1/messages",
+                                     json={'prompt': 'Hello', 'vendors': ['vendor-o'], 'session_id': session_id},
+                                     timeout=10)
+            assert response.status_code == 400
+            assert 'session_id' in response.json()['error']
+
+    def test_session_stats(self):
+        """Test the session store reports its backend and budgets"""
+        response = requests.get(f"{BASE_URL}/metrics/sessions", timeout=10)
+        assert response.status_code == 200
+        data = response.json()
+        assert data['backend'] in ('memory', 'sqlite')
+        assert data['history_tokens'] > 0
+
+
 if __name__ == '__main__':
     # Run with: python test_api.py or pytest test_api.py
     pytest.main([__file__, '-v'])
@@ -0,0 +1,269 @@
+"""Token counting for the canned vendors' usage numbers.
+
+The default tokenizer is a byte-level BPE in the GPT-2 style: text is split
+into words, each word's UTF-8 bytes are merged pairwise in the rank order of
+a bundled merges file (data/bpe_merges.txt), and the remaining pieces are
+the tokens. It runs offline, and counts code and non-English text far more
+like a real model's tokenizer than splitting on whitespace does.
+
+Merging is quadratic in a word's length, so a word longer than
+MAX_WORD_BYTES (a run of text with no spaces) is cut into pieces of that
+size and each piece is merged on its own. That can add a token at each cut,
+but it bounds the cost per byte and keeps long words out of the memo.
+
+Counting is memoized twice: per word (most words repeat across requests)
+and per text (system prompts repeat verbatim). ``count_batch`` counts many
+strings in one call and counts duplicates once.
+
+Texts longer than TOKENIZER_CHUNK_CHARS are counted a chunk at a time, cut
+where a whitespace character is followed by a non-whitespace one. Every
+word starts at such a point, so the count is exact while the word list held
+at once stays the size of one chunk. The cut is looked for in the chunk's
+next TOKENIZER_CHUNK_CHARS characters only; text with no such point there (a
+prompt with no spaces) is cut at the chunk size, which may split a word and
+add a token at the cut, like MAX_WORD_BYTES does.
+
+TOKENIZER=whitespace restores the old ``len(text.split())`` counting.
+
+Rebuild the merges file with ``python tokenizer.py train``.
+"""
+import os
+import re
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+MERGES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'bpe_merges.txt')
+
+# GPT-2's pre-tokenizer, written for the stdlib re module: contractions,
+# letter runs, digit runs and punctuation runs (each with one leading space),
+# then whitespace
+_WORD_RE = re.compile(r"""'(?:[sdmt]|ll|ve|re)| ?[^\W\d_]+| ?\d+| ?[^\s\w]+|\s+(?!\S)|\s+""")
+
+# Longest word merged whole; the longest bundled merge is 96 bytes, nearly all far shorter
+MAX_WORD_BYTES = 64
+
+# Cut points for chunked counting: no word spans one
+_BOUNDARY_RE = re.compile(r'\s(?=\S)')
+
+_tokenizer = None
+
+
+def chunks(text, size=None):
+    """Slices of ``text`` ``size`` to ``2 * size`` characters long (TOKENIZER_CHUNK_CHARS), cut between words if possible"""
+    if size is None:
+        size = int(os.getenv('TOKENIZER_CHUNK_CHARS', '65536'))
+    start = 0
+    while len(text) - start > size:
+        boundary = _BOUNDARY_RE.search(text, start + size, start + 2 * size)
+        end = boundary.start() if boundary else start + size
+        yield text[start:end]
+        start = end
+    yield text[start:] if start else text
+
+
+class WhitespaceTokenizer:
+    name = 'whitespace'
+
+    def count(self, text):
+        return sum(len(chunk.split()) for chunk in chunks(text))
+
+
+class BPETokenizer:
+    name = 'bpe'
+
+    def __init__(self, path=MERGES_PATH):
+        self.path = path
+        self.ranks = load_merges(path)
+        word_cache_size = int(os.getenv('TOKENIZER_WORD_CACHE_SIZE', '65536'))
+        self._word_tokens = lru_cache(maxsize=word_cache_size)(self._bpe)
+        self._cached_count = lru_cache(maxsize=int(os.getenv('TOKENIZER_CACHE_SIZE', '4096')))(self._count)
+        # Long texts are rarely repeated verbatim; keep them out of the memo
+        self.max_cached_chars = int(os.getenv('TOKENIZER_CACHE_MAX_CHARS', '8192'))
+
+    def count(self, text):
+        if len(text) > self.max_cached_chars:
+            return self._count(text)
+        return self._cached_count(text)
+
+    def _bpe(self, word):
+        """Number of tokens ``word`` (UTF-8 bytes) merges down to"""
+        parts = [bytes([b]) for b in word]
+        ranks = self.ranks
+        while len(parts) > 1:
+            best = None
+            best_rank = None
+            for pair in zip(parts, parts[1:]):
+                rank = ranks.get(pair)
+                if rank is not None and (best_rank is None or rank < best_rank):
+                    best, best_rank = pair, rank
+            if best is None:
+                break
+            merged = []
+            i = 0
+            while i < len(parts):
+                if i < len(parts) - 1 and parts[i] == best[0] and parts[i + 1] == best[1]:
+                    merged.append(best[0] + best[1])
+                    i += 2
+                else:
+                    merged.append(parts[i])
+                    i += 1
+            parts = merged
+        return len(parts)
+
+    def _count(self, text):
+        word_tokens = self._word_tokens
+        total = 0
+        for chunk in chunks(text):
+            for word in _WORD_RE.findall(chunk):
+                encoded = word.encode()
+                if len(encoded) <= MAX_WORD_BYTES:
+                    total += word_tokens(encoded)
+                else:
+                    total += sum(word_tokens(encoded[start:start + MAX_WORD_BYTES])
+                                 for start in range(0, len(encoded), MAX_WORD_BYTES))
+        return total
+
+    def cache_info(self):
+        return {'texts': self._cached_count.cache_info()._asdict(), 'words': self._word_tokens.cache_info()._asdict()}
+
+
+TOKENIZERS = {
+    'bpe': BPETokenizer,
+    'whitespace': WhitespaceTokenizer,
+}
+
+
+def load_merges(path):
+    """Read a merges file: one hex-encoded ``left right`` pair per line, in rank order"""
+    ranks = {}
+    with open(path) as f:
+        for line in f:
+            if not line.strip() or line.startswith('#'):
+                continue
+            left, right = line.split()
+            ranks[(bytes.fromhex(left), bytes.fromhex(right))] = len(ranks)
+    return ranks
+
+
+def get_tokenizer():
+    """Return this process's tokenizer, chosen by TOKENIZER (bpe or whitespace)"""
+    global _tokenizer
+    if _tokenizer is None:
+        name = os.getenv('TOKENIZER', 'bpe')
+        if name not in TOKENIZERS:
+            raise ValueError(f"Unknown TOKENIZER {name!r}; expected one of {', '.join(TOKENIZERS)}")
+        _tokenizer = TOKENIZERS[name]()
+    return _tokenizer
+
+
+def count_tokens(text):
+    return get_tokenizer().count(text)
+
+
+def count_batch(texts):
+    """Count tokens for many strings in one call; duplicates are counted once"""
+    count = get_tokenizer().count
+    counts = {text: count(text) for text in set(texts)}
+    return [counts[text] for text in texts]
+
+
+def tokenizer_stats():
+    tokenizer = get_tokenizer()
+    stats = {'tokenizer': tokenizer.name}
+    if hasattr(tokenizer, 'cache_info'):
+        stats.update(tokenizer.cache_info(), merges=len(tokenizer.ranks))
+    return stats
+
+
+def train(texts, num_merges, max_words=100000):
+    """Learn ``num_merges`` byte-pair merges from an iterable of strings"""
+    word_counts = Counter()
+    for text in texts:
+        word_counts.update(word.encode() for word in _WORD_RE.findall(text))
+    words = []
+    freqs = []
+    for word, freq in word_counts.most_common(max_words):
+        words.append([bytes([b]) for b in word])
+        freqs.append(freq)
+
+    pair_counts = Counter()
+    pair_words = defaultdict(set)
+    for index, parts in enumerate(words):
+        for pair in zip(parts, parts[1:]):
+            pair_counts[pair] += freqs[index]
+            pair_words[pair].add(index)
+
+    merges = []
+    while len(merges) < num_merges and pair_counts:
+        best, count = max(pair_counts.items(), key=lambda item: (item[1], item[0]))
+        if count < 2:
+            break
+        merges.append(best)
+        joined = best[0] + best[1]
+        for index in pair_words.pop(best, ()):
+            parts = words[index]
+            freq = freqs[index]
+            for pair in zip(parts, parts[1:]):
+                pair_counts[pair] -= freq
+                if pair_counts[pair] <= 0:
+                    del pair_counts[pair]
+            merged = []
+            i = 0
+            while i < len(parts):
+                if i < len(parts) - 1 and parts[i] == best[0] and parts[i + 1] == best[1]:
+                    merged.append(joined)
+                    i += 2
+                else:
+                    merged.append(parts[i])
+                    i += 1
+            words[index] = merged
+            for pair in zip(merged, merged[1:]):
+                pair_counts[pair] += freq
+                pair_words[pair].add(index)
+        pair_counts.pop(best, None)
+    return merges
+
+
+def _corpus(root, limit_bytes):
+    """Yield text files under ``root`` (.py, .txt, .rst) until ``limit_bytes`` have been read"""
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d not in ('site-packages', '__pycache__'))
+        for filename in sorted(filenames):
+            if not filename.endswith(('.py', '.txt', '.rst')):
+                continue
+            try:
+                with open(os.path.join(dirpath, filename), encoding='utf-8') as f:
+                    text = f.read()
+            except (OSError, UnicodeDecodeError):
+                continue
+            yield text
+            total += len(text)
+            if total >= limit_bytes:
+                return
+
+
+def main():
+    import argparse
+    import sysconfig
+
+    parser = argparse.ArgumentParser(description='Train the bundled BPE merges')
+    parser.add_argument('command', choices=['train'])
+    parser.add_argument('--corpus', default=sysconfig.get_paths()['stdlib'],
+                        help='Directory of text to train on (default: the Python standard library)')
+    parser.add_argument('--corpus-mb', type=float, default=16)
+    parser.add_argument('--merges', type=int, default=16000)
+    parser.add_argument('--output', default=MERGES_PATH)
+    args = parser.parse_args()
+
+    merges = train(_corpus(args.corpus, args.corpus_mb * 1e6), args.merges)
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w') as f:
+        f.write(f"# Byte-level BPE merges: {len(merges)} merges from {args.corpus_mb:g} MB of training text\n")
+        for left, right in merges:
+            f.write(f"{left.hex()} {right.hex()}\n")
+    print(f"wrote {len(merges)} merges to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""Tool registry and tool call execution for the vendor-o tool loop.
+
+Each tool registers its OpenAI function schema, a timeout and how long its
+results may be cached. Cacheable tools keep a per-tool TTL cache keyed on
+their normalized arguments, and concurrent misses for the same key share one
+call, so repeated lookups skip the upstream round trip entirely.
+
+All tool calls from one assistant turn run concurrently, on a bounded
+per-worker thread pool (Flask) or as coroutines under a semaphore (ASGI).
+Each call has its own timeout, and results come back in the order the
+model asked for them, so a turn costs roughly its slowest tool, not the
+sum of all of them.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import cache
+import jsoncodec
+import metrics
+import singleflight
+
+_registry = {}
+
+_flight = singleflight.SingleFlight('tools')
+_async_flight = singleflight.AsyncSingleFlight('tools.async')
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_async_semaphore = None
+
+
+def _default_cache_key(arguments):
+    return jsoncodec.dumps(arguments)
+
+
+class Tool:
+    """A registered tool: its handler(s), schema, timeout and result cache.
+
+    Handlers take the parsed arguments dict and return either a dict (sent
+    to the model as JSON; a dict with an "error" key is never cached) or an
+    already-serialized JSON string.
+    """
+
+    def __init__(self, name, handler, schema, timeout=None, cache_ttl=0, cache_key=None):
+        self.name = name
+        self.handler = handler
+        self.async_handler = None
+        self.schema = schema
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.cache_key = cache_key or _default_cache_key
+        self.results = None
+        if cache_ttl > 0:
+            self.results = cache.TTLCache(int(os.getenv('TOOL_CACHE_MAXSIZE', '1024')), cache_ttl)
+        self.stats = {'calls': 0, 'cache_hits': 0, 'errors': 0}
+        self._stats_lock = threading.Lock()
+
+    def count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def definition(self):
+        """The entry clients put in a chat/completions ``tools`` array"""
+        return {'type': 'function', 'function': dict(self.schema, name=self.name)}
+
+    def encode(self, result):
+        """Return (result string, cacheable)"""
+        if isinstance(result, str):
+            return result, True
+        if 'error' in result:
+            self.count('errors')
+            return jsoncodec.dumps(result), False
+        return jsoncodec.dumps(result), True
+
+
+def register_tool(name, schema, timeout=None, cache_ttl=0, cache_key=None):
+    """Decorator registering a sync tool handler under ``name``"""
+    def decorator(handler):
+        _registry[name] = Tool(name, handler, schema, timeout, cache_ttl, cache_key)
+        return handler
+    return decorator
+
+
+def async_handler(name):
+    """Decorator attaching a coroutine implementation to a registered tool (ASGI mode)"""
+    def decorator(handler):
+        _registry[name].async_handler = handler
+        return handler
+    return decorator
+
+
+def get_tool(name):
+    return _registry.get(name)
+
+
+def definitions():
+    return [tool.definition() for tool in _registry.values()]
+
+
+def tool_stats():
+    return {
+        name: dict(
+            tool.stats,
+            timeout=tool_timeout(name),
+            cache_ttl=tool.cache_ttl,
+            cache_entries=len(tool.results) if tool.results else 0,
+        )
+        for name, tool in _registry.items()
+    }
+
+
+def _parse_arguments(arguments_str):
+    try:
+        return jsoncodec.loads(arguments_str)
+    except (TypeError, ValueError):
+        return None
+
+
+def _not_implemented(function_name):
+    return jsoncodec.dumps({"error": f"Function {function_name} not implemented"})
+
+
+def _invalid_arguments():
+    return jsoncodec.dumps({"error": "Invalid JSON arguments"})
+
+
+def _timed(function_name, handler, arguments):
+    start = time.perf_counter()
+    try:
+        return handler(arguments)
+    finally:
+        metrics.TOOL_SECONDS.observe(time.perf_counter() - start, function_name)
+
+
+async def _atimed(function_name, handler, arguments):
+    start = time.perf_counter()
+    try:
+        return await handler(arguments)
+    finally:
+        metrics.TOOL_SECONDS.observe(time.perf_counter() - start, function_name)
+
+
+def call(function_name, arguments):
+    """Run a tool with parsed arguments (through its cache), returning the result string"""
+    tool = _registry.get(function_name)
+    if tool is None:
+        return _not_implemented(function_name)
+    tool.count('calls')
+
+    if tool.results is None:
+        return tool.encode(_timed(function_name, tool.handler, arguments))[0]
+
+    key = tool.cache_key(arguments)
+    cached = tool.results.get(key)
+    if cached is not None:
+        tool.count('cache_hits')
+        return cached
+
+    def run():
+        result, cacheable = tool.encode(_timed(function_name, tool.handler, arguments))
+        if cacheable:
+            tool.results.set(key, result)
+        return result
+    return _flight.do((function_name, key), run)
+
+
+def execute(function_name, arguments_str):
+    """Execute a model tool call (arguments as a JSON string) and return the result string"""
+    arguments = _parse_arguments(arguments_str)
+    if arguments is None:
+        return _invalid_arguments()
+    return call(function_name, arguments)
+
+
+async def execute_async(function_name, arguments_str):
+    """Async counterpart of execute(); sync-only tools run in a worker thread"""
+    arguments = _parse_arguments(arguments_str)
+    if arguments is None:
+        return _invalid_arguments()
+    tool = _registry.get(function_name)
+    if tool is None:
+        return _not_implemented(function_name)
+    if tool.async_handler is None:
+        return await asyncio.to_thread(call, function_name, arguments)
+    tool.count('calls')
+
+    if tool.results is None:
+        return tool.encode(await _atimed(function_name, tool.async_handler, arguments))[0]
+
+    key = tool.cache_key(arguments)
+    cached = tool.results.get(key)
+    if cached is not None:
+        tool.count('cache_hits')
+        return cached
+
+    async def run():
+        result, cacheable = tool.encode(await _atimed(function_name, tool.async_handler, arguments))
+        if cacheable:
+            tool.results.set(key, result)
+        return result
+    return await _async_flight.do((function_name, key), run)
+
+
+def tool_timeout(function_name):
+    """Seconds a single call to ``function_name`` may take"""
+    tool = _registry.get(function_name)
+    if tool is not None and tool.timeout is not None:
+        return tool.timeout
+    return float(os.getenv('TOOL_CALL_TIMEOUT', '15'))
+
+
+def max_tool_rounds():
+    return max(int(os.getenv('MAX_TOOL_ROUNDS', '5')), 1)
+
+
+def _max_workers():
+    return max(int(os.getenv('TOOL_EXECUTOR_WORKERS', '16')), 1)
+
+
+def timeout_result(function_name, timeout):
+    return jsoncodec.dumps({"error": f"Function {function_name} timed out after {timeout:g}s"})
+
+
+def get_executor():
+    """Return this process's tool thread pool (rebuilt after a fork)"""
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(max_workers=_max_workers(), thread_name_prefix='tool')
+                _executor_pid = pid
+    return _executor
+
+
+def run_tool_calls(tool_calls, execute=execute):
+    """Run ``execute(name, arguments)`` for each tool call concurrently.
+
+    Returns the result strings in the same order as ``tool_calls``. A call
+    that overruns its timeout gets an error result; its thread is left to
+    finish in the background.
+    """
+    executor = get_executor()
+    started = time.monotonic()
+    futures = [
+        executor.submit(execute, call['function']['name'], call['function']['arguments'])
+        for call in tool_calls
+    ]
+    results = []
+    for call, future in zip(tool_calls, futures):
+        name = call['function']['name']
+        timeout = tool_timeout(name)
+        try:
+            results.append(future.result(timeout=max(started + timeout - time.monotonic(), 0)))
+        except FutureTimeoutError:
+            future.cancel()
+            results.append(timeout_result(name, timeout))
+    return results
+
+
+async def run_tool_calls_async(tool_calls, execute=execute_async):
+    """Async counterpart of run_tool_calls; ``execute`` is a coroutine function"""
+    global _async_semaphore
+    if _async_semaphore is None:
+        _async_semaphore = asyncio.Semaphore(_max_workers())
+
+    async def run(call):
+        name = call['function']['name']
+        timeout = tool_timeout(name)
+        async with _async_semaphore:
+            try:
+                return await asyncio.wait_for(execute(name, call['function']['arguments']), timeout)
+            except asyncio.TimeoutError:
+                return timeout_result(name, timeout)
+
+    return list(await asyncio.gather(*(run(call) for call in tool_calls)))
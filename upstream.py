@@ -0,0 +1,344 @@
+"""Shared upstream HTTP client.
+
+Every outbound call (OpenAI, wttr.in) goes through one keep-alive
+``requests.Session`` per worker process, so repeated calls reuse pooled
+TCP+TLS connections instead of paying a fresh handshake each time. The
+ASGI app uses the async equivalent: one ``httpx.AsyncClient`` per host and
+event loop, sized from the same settings and feeding the same stats.
+Neither client library is imported until the first outbound call (or
+``preconnect``), so routes that never leave the process don't pay for it.
+"""
+import asyncio
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import metrics
+
+DEFAULT_OPENAI_BASE_URL = 'https://api.openai.com'
+DEFAULT_WEATHER_BASE_URL = 'https://wttr.in'
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+_adapter_class = None
+
+_async_clients = {}
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def openai_url(path):
+    """Build an OpenAI API URL (OPENAI_BASE_URL can point at a local stand-in)"""
+    return os.getenv('OPENAI_BASE_URL', DEFAULT_OPENAI_BASE_URL).rstrip('/') + path
+
+
+def weather_url(path):
+    """Build a wttr.in URL (WEATHER_BASE_URL can point at a local stand-in)"""
+    return os.getenv('WEATHER_BASE_URL', DEFAULT_WEATHER_BASE_URL).rstrip('/') + path
+
+
+def _connect_timeout():
+    return float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', '3.05'))
+
+
+def _pool_sizes():
+    """Parse UPSTREAM_POOL_SIZES, e.g. "api.openai.com=16,wttr.in=4" """
+    sizes = {}
+    for entry in os.getenv('UPSTREAM_POOL_SIZES', '').split(','):
+        host, _, size = entry.strip().partition('=')
+        if host and size.isdigit():
+            sizes[host] = int(size)
+    return sizes
+
+
+def _host_stats(host):
+    stats = _stats.get(host)
+    if stats is None:
+        with _stats_lock:
+            stats = _stats.setdefault(host, {
+                'requests': 0,
+                'in_flight': 0,
+                'peak_in_flight': 0,
+                'connections_opened': 0,
+                'connect_seconds_total': 0.0,
+                'errors': 0,
+            })
+    return stats
+
+
+def _record_connect(host, seconds):
+    stats = _host_stats(host)
+    with _stats_lock:
+        stats['connections_opened'] += 1
+        stats['connect_seconds_total'] += seconds
+    metrics.UPSTREAM_CONNECT_SECONDS.observe(seconds, host)
+
+
+def _pooled_adapter_class():
+    """PooledAdapter, an HTTPAdapter whose connections report how often (and
+    how slowly) they connect. Built on first use: requests and urllib3 are a
+    large share of the gateway's import time and only vendor-o and the
+    weather tool need them."""
+    global _adapter_class
+    if _adapter_class is not None:
+        return _adapter_class
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class _TimedHTTPConnection(HTTPConnection):
+        def connect(self):
+            start = time.perf_counter()
+            super().connect()
+            _record_connect(self.host, time.perf_counter() - start)
+
+    class _TimedHTTPSConnection(HTTPSConnection):
+        def connect(self):
+            start = time.perf_counter()
+            super().connect()
+            _record_connect(self.host, time.perf_counter() - start)
+
+    class _TimedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = _TimedHTTPConnection
+
+    class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = _TimedHTTPSConnection
+
+    class PooledAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                'http': _TimedHTTPConnectionPool,
+                'https': _TimedHTTPSConnectionPool,
+            }
+
+    _adapter_class = PooledAdapter
+    return _adapter_class
+
+
+def _build_session():
+    import requests
+    PooledAdapter = _pooled_adapter_class()
+    default_size = int(os.getenv('UPSTREAM_POOL_MAXSIZE', '10'))
+    session = requests.Session()
+    session.mount('http://', PooledAdapter(pool_maxsize=default_size))
+    session.mount('https://', PooledAdapter(pool_maxsize=default_size))
+
+    # Dedicated pools for hosts that need more (or fewer) keep-alive slots
+    for host, size in _pool_sizes().items():
+        adapter = PooledAdapter(pool_connections=1, pool_maxsize=size)
+        session.mount(f'https://{host}/', adapter)
+        session.mount(f'http://{host}/', adapter)
+    return session
+
+
+def preload(async_client=False):
+    """Import the client libraries now instead of on the first outbound call"""
+    _pooled_adapter_class()
+    if async_client:
+        import httpx  # noqa: F401
+
+
+def get_session():
+    """Return this process's pooled session (rebuilt after a fork)"""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is None or _session_pid != pid:
+        with _session_lock:
+            if _session is None or _session_pid != pid:
+                _session = _build_session()
+                _session_pid = pid
+    return _session
+
+
+def _in_flight_release(stats):
+    """A callable that ends one in-flight call; only its first call counts"""
+    released = []
+
+    def release():
+        if not released:
+            released.append(True)
+            with _stats_lock:
+                stats['in_flight'] -= 1
+    return release
+
+
+def request(method, url, read_timeout=30, **kwargs):
+    """Send a request over the shared pool with separate connect/read timeouts.
+
+    With ``stream=True`` the call stays in flight until its body is fully
+    read or the response is closed.
+    """
+    import requests
+    host = urlsplit(url).hostname
+    stats = _host_stats(host)
+    with _stats_lock:
+        stats['requests'] += 1
+        stats['in_flight'] += 1
+        stats['peak_in_flight'] = max(stats['peak_in_flight'], stats['in_flight'])
+    release = _in_flight_release(stats)
+    streamed = False
+    start = time.perf_counter()
+    try:
+        response = get_session().request(
+            method, url, timeout=(_connect_timeout(), read_timeout), **kwargs
+        )
+        # requests' elapsed stops once the response headers are parsed
+        metrics.UPSTREAM_TTFB_SECONDS.observe(response.elapsed.total_seconds(), host)
+        metrics.UPSTREAM_SECONDS.observe(time.perf_counter() - start, host)
+        if kwargs.get('stream'):
+            # urllib3 releases the connection once the body is read to the end or closed
+            release_conn = response.raw.release_conn
+
+            def release_conn_and_count():
+                try:
+                    release_conn()
+                finally:
+                    release()
+            response.raw.release_conn = release_conn_and_count
+            streamed = True
+        return response
+    except requests.RequestException:
+        with _stats_lock:
+            stats['errors'] += 1
+        raise
+    finally:
+        if not streamed:
+            release()
+
+
+def get(url, read_timeout=30, **kwargs):
+    return request('GET', url, read_timeout=read_timeout, **kwargs)
+
+
+def post(url, read_timeout=30, **kwargs):
+    return request('POST', url, read_timeout=read_timeout, **kwargs)
+
+
+def preconnect(url, read_timeout=5):
+    """Open a pooled connection to ``url``'s host before the first real call.
+
+    Failures are ignored; the first real call just connects itself.
+    """
+    import requests
+    try:
+        request('HEAD', url, read_timeout=read_timeout).close()
+    except requests.RequestException:
+        pass
+
+
+def _async_client(host):
+    """Return the AsyncClient for ``host`` on the running event loop"""
+    key = (id(asyncio.get_running_loop()), host)
+    client = _async_clients.get(key)
+    if client is None:
+        import httpx
+        keepalive = _pool_sizes().get(host, int(os.getenv('UPSTREAM_POOL_MAXSIZE', '10')))
+        client = httpx.AsyncClient(limits=httpx.Limits(
+            max_connections=int(os.getenv('UPSTREAM_ASYNC_MAX_CONNECTIONS', '1000')),
+            max_keepalive_connections=keepalive,
+        ))
+        _async_clients[key] = client
+    return client
+
+
+def _connect_tracer(host, scheme, request_start):
+    """httpx trace hook that records new connections like _TimedHTTPSConnection,
+    and the time to response headers like requests' ``elapsed``"""
+    started = []
+    done_event = 'connection.start_tls.complete' if scheme == 'https' else 'connection.connect_tcp.complete'
+
+    async def trace(event_name, info):
+        if event_name == 'connection.connect_tcp.started':
+            started.append(time.perf_counter())
+        elif event_name == done_event and started:
+            _record_connect(host, time.perf_counter() - started.pop())
+        elif event_name.endswith('.receive_response_headers.complete'):
+            metrics.UPSTREAM_TTFB_SECONDS.observe(time.perf_counter() - request_start, host)
+    return trace
+
+
+async def async_request(method, url, read_timeout=30, stream=False, **kwargs):
+    """Async counterpart of request(), returning an ``httpx.Response``.
+
+    With ``stream=True`` the body is not read; the caller iterates it and must
+    ``aclose()`` the response, and the call stays in flight until then.
+    """
+    import httpx
+    parts = urlsplit(url)
+    stats = _host_stats(parts.hostname)
+    with _stats_lock:
+        stats['requests'] += 1
+        stats['in_flight'] += 1
+        stats['peak_in_flight'] = max(stats['peak_in_flight'], stats['in_flight'])
+    release = _in_flight_release(stats)
+    streamed = False
+    start = time.perf_counter()
+    try:
+        client = _async_client(parts.hostname)
+        outgoing = client.build_request(
+            method, url,
+            timeout=httpx.Timeout(read_timeout, connect=_connect_timeout()),
+            extensions={'trace': _connect_tracer(parts.hostname, parts.scheme, start)},
+            **kwargs
+        )
+        response = await client.send(outgoing, stream=stream)
+        metrics.UPSTREAM_SECONDS.observe(time.perf_counter() - start, parts.hostname)
+        if stream:
+            # httpx also closes a streamed response itself once it is read to the end
+            aclose = response.aclose
+
+            async def aclose_and_count():
+                try:
+                    await aclose()
+                finally:
+                    release()
+            response.aclose = aclose_and_count
+            streamed = True
+        return response
+    except httpx.HTTPError:
+        with _stats_lock:
+            stats['errors'] += 1
+        raise
+    finally:
+        if not streamed:
+            release()
+
+
+async def async_get(url, read_timeout=30, **kwargs):
+    return await async_request('GET', url, read_timeout=read_timeout, **kwargs)
+
+
+async def async_post(url, read_timeout=30, stream=False, **kwargs):
+    return await async_request('POST', url, read_timeout=read_timeout, stream=stream, **kwargs)
+
+
+async def aclose_async_clients():
+    """Close the running loop's AsyncClients (ASGI lifespan shutdown)"""
+    loop_id = id(asyncio.get_running_loop())
+    for key in [key for key in _async_clients if key[0] == loop_id]:
+        await _async_clients.pop(key).aclose()
+
+
+def pool_stats():
+    """Per-host pool usage for this worker"""
+    sizes = _pool_sizes()
+    default_size = int(os.getenv('UPSTREAM_POOL_MAXSIZE', '10'))
+    with _stats_lock:
+        hosts = {}
+        for host, stats in _stats.items():
+            opened = stats['connections_opened']
+            hosts[host] = dict(
+                stats,
+                pool_maxsize=sizes.get(host, default_size),
+                connections_reused=max(stats['requests'] - opened, 0),
+                avg_connect_ms=round(stats['connect_seconds_total'] * 1000 / opened, 2) if opened else 0.0,
+            )
+    return {
+        'pid': os.getpid(),
+        'connect_timeout': _connect_timeout(),
+        'hosts': hosts,
+    }